@@ -48,6 +48,13 @@ def taproot_assets_stop():
         except Exception as ex:
             logger.warning(ex)
     
+    # Stop the asset cache invalidation watchers
+    try:
+        from .tapd.taproot_assets import TaprootAssetManager
+        TaprootAssetManager.stop_event_watchers()
+    except Exception as ex:
+        logger.warning(f"Error stopping asset event watchers: {ex}")
+    
     # Close the parser client connection if it exists
     async def close_parser_client():
         try:
@@ -59,6 +66,20 @@ def taproot_assets_stop():
                 logger.info("TaprootParserClient connection closed")
         except Exception as ex:
             logger.warning(f"Error closing TaprootParserClient: {ex}")
+        
+        # Close the gRPC channels shared by the wallets' nodes
+        try:
+            from .tapd.taproot_node import TaprootAssetsNodeExtension
+            await TaprootAssetsNodeExtension.close_shared_channels()
+        except Exception as ex:
+            logger.warning(f"Error closing gRPC channels: {ex}")
+        
+        # Close the shared LNURL HTTP client
+        try:
+            from .services.lnurl_service import LnurlService
+            await LnurlService.close()
+        except Exception as ex:
+            logger.warning(f"Error closing LNURL HTTP client: {ex}")
     
     # Run the async close function in a new event loop
     try:
@@ -2,12 +2,13 @@
 Re-exports for CRUD operations in the Taproot Assets extension.
 """
 from .invoices import (
-    create_invoice, get_invoice, get_invoice_by_payment_hash,
+    create_invoice, get_invoice, get_invoice_for_user, get_invoice_by_payment_hash,
+    get_invoices_by_payment_hashes, is_invoice_paid, load_invoice_by_payment_hash,
     update_invoice_status, get_user_invoices, validate_invoice_for_settlement,
     update_invoice_for_settlement
 )
 from .payments import (
-    create_payment_record, get_user_payments
+    create_payment_record, get_user_payments, get_user_payments_paginated
 )
 from .invoices import (
     is_internal_payment, is_self_payment
@@ -18,6 +19,7 @@ from .assets import (
 
 # Import and re-export the TransactionService methods
 from ..services.transaction_service import TransactionService
+from ..models import TxType
 
 # Transaction operations
 record_asset_transaction = TransactionService.record_transaction
@@ -25,6 +27,7 @@ get_asset_transactions = TransactionService.get_asset_transactions
 
 # Balance operations
 get_asset_balance = TransactionService.get_asset_balance
+get_asset_balances = TransactionService.get_asset_balances
 get_wallet_asset_balances = TransactionService.get_wallet_asset_balances
 
 # For backward compatibility in function signatures
@@ -32,7 +35,7 @@ async def update_asset_balance(wallet_id, asset_id, amount_change, payment_hash=
     """
     Update asset balance without creating a transaction record.
     """
-    tx_type = "credit" if amount_change > 0 else "debit"
+    tx_type = TxType.CREDIT if amount_change > 0 else TxType.DEBIT
     amount = abs(amount_change)
     
     _, _, balance = await TransactionService.record_transaction(
@@ -1,17 +1,40 @@
 """
 Invoice-related CRUD operations for Taproot Assets extension.
 """
-from typing import List, Optional, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 from datetime import datetime, timedelta
+import asyncio
 import json
 
 from lnbits.helpers import urlsafe_short_hash
 
-from ..models import TaprootInvoice
+from ..models import TaprootInvoice, InvoiceStatus
 from ..db import db, get_table_name
-from ..db_utils import with_transaction
+from ..db_utils import now_cached, with_transaction
 from .utils import get_record_by_id, get_record_by_field, get_records_by_field
 
+
+def _row_to_invoice(row) -> TaprootInvoice:
+    """
+    Convert an invoices row to a TaprootInvoice, decoding its extra JSON.
+    
+    Args:
+        row: The database row
+        
+    Returns:
+        TaprootInvoice: The invoice, with extra set to None if it isn't valid JSON
+    """
+    # Convert row to dict to make it mutable
+    row_dict = dict(row)
+    # Parse the extra field from JSON if it exists
+    if row_dict.get("extra") and isinstance(row_dict["extra"], str):
+        try:
+            row_dict["extra"] = json.loads(row_dict["extra"])
+        except json.JSONDecodeError:
+            row_dict["extra"] = None
+    return TaprootInvoice(**row_dict)
+
+
 @with_transaction
 async def create_invoice(
     asset_id: str,
@@ -57,7 +80,7 @@ async def create_invoice(
         asset_amount=asset_amount,
         satoshi_amount=satoshi_amount,
         description=description,
-        status="pending",
+        status=InvoiceStatus.PENDING,
         user_id=user_id,
         wallet_id=wallet_id,
         created_at=now,
@@ -102,18 +125,44 @@ async def get_invoice(invoice_id: str, conn=None) -> Optional[TaprootInvoice]:
         {"id": invoice_id}
     )
     if row:
-        # Convert row to dict to make it mutable
-        row_dict = dict(row)
-        # Parse the extra field from JSON if it exists
-        if row_dict.get("extra") and isinstance(row_dict["extra"], str):
-            try:
-                row_dict["extra"] = json.loads(row_dict["extra"])
-            except json.JSONDecodeError:
-                row_dict["extra"] = None
-        return TaprootInvoice(**row_dict)
+        return _row_to_invoice(row)
     return None
 
 
+async def get_invoice_for_user(
+    invoice_id: str, user_id: str, conn=None
+) -> Tuple[Optional[TaprootInvoice], bool]:
+    """
+    Get a specific Taproot Asset invoice by ID, scoped to its owner.
+    
+    The ownership check is part of the query itself. Only when no owned
+    invoice matches is a second EXISTS lookup made, to tell a missing
+    invoice apart from one that belongs to another user.
+    
+    Args:
+        invoice_id: The ID of the invoice to get
+        user_id: The ID of the user that must own the invoice
+        conn: Optional database connection to reuse
+        
+    Returns:
+        Tuple containing:
+        - invoice (Optional[TaprootInvoice]): The invoice if it exists and belongs to the user
+        - exists (bool): Whether an invoice with this ID exists at all
+    """
+    row = await (conn or db).fetchone(
+        f"SELECT * FROM {get_table_name('invoices')} WHERE id = :id AND user_id = :user_id",
+        {"id": invoice_id, "user_id": user_id}
+    )
+    if row:
+        return _row_to_invoice(row), True
+    
+    exists = await (conn or db).fetchone(
+        f"SELECT 1 FROM {get_table_name('invoices')} WHERE id = :id",
+        {"id": invoice_id}
+    )
+    return None, exists is not None
+
+
 async def get_invoice_by_payment_hash(payment_hash: str, conn=None) -> Optional[TaprootInvoice]:
     """
     Get a specific Taproot Asset invoice by payment hash.
@@ -130,18 +179,133 @@ async def get_invoice_by_payment_hash(payment_hash: str, conn=None) -> Optional[
         {"payment_hash": payment_hash}
     )
     if row:
-        # Convert row to dict to make it mutable
-        row_dict = dict(row)
-        # Parse the extra field from JSON if it exists
-        if row_dict.get("extra") and isinstance(row_dict["extra"], str):
-            try:
-                row_dict["extra"] = json.loads(row_dict["extra"])
-            except json.JSONDecodeError:
-                row_dict["extra"] = None
-        return TaprootInvoice(**row_dict)
+        return _row_to_invoice(row)
     return None
 
 
+async def is_invoice_paid(payment_hash: str, conn=None) -> bool:
+    """
+    Check whether the local invoice for a payment hash is already paid.
+    
+    Only tests for a matching row instead of loading the invoice.
+    
+    Args:
+        payment_hash: The payment hash to look up
+        conn: Optional database connection to reuse
+        
+    Returns:
+        bool: True if a paid invoice exists for the payment hash, False otherwise
+    """
+    row = await (conn or db).fetchone(
+        f"""
+        SELECT 1 FROM {get_table_name('invoices')}
+        WHERE payment_hash = :payment_hash AND status = :status
+        LIMIT 1
+        """,
+        {"payment_hash": payment_hash, "status": InvoiceStatus.PAID}
+    )
+    return row is not None
+
+
+async def get_invoices_by_payment_hashes(
+    payment_hashes: List[str], conn=None
+) -> Dict[str, TaprootInvoice]:
+    """
+    Get the invoices for several payment hashes in a single query.
+    
+    Args:
+        payment_hashes: The payment hashes to look up
+        conn: Optional database connection to reuse
+        
+    Returns:
+        Dict[str, TaprootInvoice]: Mapping of payment hash to invoice; hashes
+        without a local invoice are omitted
+    """
+    if not payment_hashes:
+        return {}
+    
+    params: Dict[str, Any] = {}
+    placeholders = []
+    for i, payment_hash in enumerate(payment_hashes):
+        params[f"payment_hash_{i}"] = payment_hash
+        placeholders.append(f":payment_hash_{i}")
+    
+    rows = await (conn or db).fetchall(
+        f"""
+        SELECT * FROM {get_table_name('invoices')}
+        WHERE payment_hash IN ({", ".join(placeholders)})
+        """,
+        params
+    )
+    invoices = {}
+    for row in rows:
+        invoice = _row_to_invoice(row)
+        invoices[invoice.payment_hash] = invoice
+    return invoices
+
+
+class _InvoiceLoader:
+    """
+    Coalesces invoice lookups by payment hash made in the same event loop tick.
+    
+    Payments arriving in a burst each ask for their invoice; instead of one
+    query per payment, all lookups queued before the loop gets to run the
+    batch are answered by a single IN query.
+    """
+    
+    def __init__(self):
+        self._pending: Dict[str, List[asyncio.Future]] = {}
+        self._scheduled = False
+        # Strong references to running batches, so they aren't garbage collected
+        self._batches: set = set()
+    
+    async def load(self, payment_hash: str) -> Optional[TaprootInvoice]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.setdefault(payment_hash, []).append(future)
+        if not self._scheduled:
+            self._scheduled = True
+            loop.call_soon(self._flush)
+        return await future
+    
+    def _flush(self) -> None:
+        pending, self._pending = self._pending, {}
+        self._scheduled = False
+        task = asyncio.get_running_loop().create_task(self._run_batch(pending))
+        self._batches.add(task)
+        task.add_done_callback(self._batches.discard)
+    
+    async def _run_batch(self, pending: Dict[str, List[asyncio.Future]]) -> None:
+        try:
+            invoices = await get_invoices_by_payment_hashes(list(pending))
+        except Exception as e:
+            for futures in pending.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+            return
+        for payment_hash, futures in pending.items():
+            for future in futures:
+                if not future.done():
+                    future.set_result(invoices.get(payment_hash))
+
+
+_invoice_loader = _InvoiceLoader()
+
+
+async def load_invoice_by_payment_hash(payment_hash: str) -> Optional[TaprootInvoice]:
+    """
+    Get an invoice by payment hash, batched with concurrent lookups.
+    
+    Args:
+        payment_hash: The payment hash to look up
+        
+    Returns:
+        Optional[TaprootInvoice]: The invoice if found, None otherwise
+    """
+    return await _invoice_loader.load(payment_hash)
+
+
 @with_transaction
 async def update_invoice_status(invoice_id: str, status: str, conn=None) -> Optional[TaprootInvoice]:
     """
@@ -155,26 +319,27 @@ async def update_invoice_status(invoice_id: str, status: str, conn=None) -> Opti
     Returns:
         Optional[TaprootInvoice]: The updated invoice if found, None otherwise
     """
-    invoice = await get_invoice(invoice_id, conn)
-    if not invoice:
-        return None
-        
-    now = datetime.now()
-    invoice.status = status
+    params: Dict[str, Any] = {"id": invoice_id, "status": status}
+    set_clause = "status = :status"
     
     # Set paid_at timestamp if status is changing to paid
-    if status == "paid":
-        invoice.paid_at = now
-    
-    # Update the invoice in the database using standardized method
-    await conn.update(
-        get_table_name("invoices"),
-        invoice,
-        "WHERE id = :id"
-    )
+    if status == InvoiceStatus.PAID:
+        params["paid_at"] = now_cached()
+        set_clause += ", paid_at = :paid_at"
+    
+    query = f"UPDATE {get_table_name('invoices')} SET {set_clause} WHERE id = :id"
+    
+    if db.type == "SQLITE":
+        # RETURNING needs SQLite 3.35, so read the row back instead
+        await conn.execute(query, params)
+        return await get_invoice(invoice_id, conn)
+    
+    # Update and read back the invoice in a single statement
+    row = await conn.fetchone(f"{query} RETURNING *", params)
+    if not row:
+        return None
     
-    # Return the updated invoice
-    return await get_invoice(invoice_id, conn)
+    return _row_to_invoice(row)
 
 
 async def get_user_invoices(user_id: str) -> List[TaprootInvoice]:
@@ -193,15 +358,7 @@ async def get_user_invoices(user_id: str) -> List[TaprootInvoice]:
     )
     invoices = []
     for row in rows:
-        # Convert row to dict to make it mutable
-        row_dict = dict(row)
-        # Parse the extra field from JSON if it exists
-        if row_dict.get("extra") and isinstance(row_dict["extra"], str):
-            try:
-                row_dict["extra"] = json.loads(row_dict["extra"])
-            except json.JSONDecodeError:
-                row_dict["extra"] = None
-        invoices.append(TaprootInvoice(**row_dict))
+        invoices.append(_row_to_invoice(row))
     return invoices
 
 
@@ -265,7 +422,7 @@ async def validate_invoice_for_settlement(payment_hash: str, conn=None) -> Tuple
         return False, None, "Invoice not found"
     
     # Step 2: Check if already paid
-    if invoice.status == "paid":
+    if invoice.status == InvoiceStatus.PAID:
         return False, invoice, "Invoice already paid"
     
     # Step 3: Check if expired
@@ -291,7 +448,7 @@ async def update_invoice_for_settlement(invoice: TaprootInvoice, conn=None) -> O
     """
     from loguru import logger
     try:
-        return await update_invoice_status(invoice.id, "paid", conn)
+        return await update_invoice_status(invoice.id, InvoiceStatus.PAID, conn)
     except Exception as e:
         logger.error(f"Failed to update invoice status: {str(e)}")
         return None
@@ -1,14 +1,13 @@
 """
 Payment-related CRUD operations for Taproot Assets extension.
 """
-from typing import List, Optional
-from datetime import datetime
+from typing import List, Optional, Tuple
 
 from lnbits.helpers import urlsafe_short_hash
 
 from ..models import TaprootPayment
 from ..db import db, get_table_name
-from ..db_utils import with_transaction
+from ..db_utils import now_cached, with_transaction
 from .utils import get_records_by_field
 
 @with_transaction
@@ -42,7 +41,7 @@ async def create_payment_record(
     Returns:
         TaprootPayment: The created payment record
     """
-    now = datetime.now()
+    now = now_cached()
     payment_id = urlsafe_short_hash()
     
     # Create the payment model
@@ -71,6 +70,8 @@ async def get_user_payments(user_id: str) -> List[TaprootPayment]:
     """
     Get all sent payments for a user.
     
+    Deprecated: kept for backward compatibility, use get_user_payments_paginated.
+    
     Args:
         user_id: The user ID to get payments for
         
@@ -78,3 +79,61 @@ async def get_user_payments(user_id: str) -> List[TaprootPayment]:
         List[TaprootPayment]: List of payments for the user
     """
     return await get_records_by_field("payments", "user_id", user_id, TaprootPayment)
+
+
+async def get_user_payments_paginated(
+    user_id: str,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    conn=None
+) -> Tuple[List[TaprootPayment], Optional[str]]:
+    """
+    Get one page of sent payments for a user, newest first.
+    
+    Uses keyset pagination on (created_at, id), so each page costs the same
+    no matter how far into the history it is.
+    
+    Args:
+        user_id: The user ID to get payments for
+        limit: Maximum number of payments to return
+        cursor: ID of the last payment of the previous page, None for the first page
+        conn: Optional database connection to reuse
+        
+    Returns:
+        Tuple containing:
+        - payments (List[TaprootPayment]): The page of payments
+        - next_cursor (Optional[str]): Cursor for the next page, None if this is the last page
+        
+    Raises:
+        ValueError: If the cursor is not one of the user's payments
+    """
+    table = get_table_name("payments")
+    params = {"user_id": user_id, "limit": limit}
+    where = "user_id = :user_id"
+    if cursor:
+        where += f"""
+            AND (
+                created_at < (SELECT created_at FROM {table} WHERE id = :cursor AND user_id = :user_id)
+                OR (
+                    created_at = (SELECT created_at FROM {table} WHERE id = :cursor AND user_id = :user_id)
+                    AND id < :cursor
+                )
+            )
+        """
+        params["cursor"] = cursor
+    
+    payments = await (conn or db).fetchall(
+        f"SELECT * FROM {table} WHERE {where} ORDER BY created_at DESC, id DESC LIMIT :limit",
+        params,
+        TaprootPayment
+    )
+    # An empty page is either the end of the history or a cursor that isn't the user's
+    if cursor and not payments:
+        cursor_row = await (conn or db).fetchone(
+            f"SELECT id FROM {table} WHERE id = :cursor AND user_id = :user_id",
+            {"cursor": cursor, "user_id": user_id}
+        )
+        if not cursor_row:
+            raise ValueError(f"Unknown cursor: {cursor}")
+    next_cursor = payments[-1].id if len(payments) == limit else None
+    return payments, next_cursor
@@ -3,24 +3,72 @@ Database utilities for the Taproot Assets extension.
 Provides transaction management and connection pooling.
 """
 import asyncio
+import contextvars
 import functools
 import time
 import random
-from contextlib import asynccontextmanager
-from typing import Any, Callable, Dict, Optional, TypeVar, cast
+from contextlib import asynccontextmanager, contextmanager
+from datetime import datetime
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple, TypeVar, cast
 from loguru import logger
 
 from sqlalchemy.ext.asyncio import AsyncConnection
 
 from .db import db
+from .tapd_settings import taproot_settings
 
 # Use a semaphore instead of a lock to allow multiple concurrent transactions
 # but limit the total number to prevent overloading the database
 _transaction_semaphore = asyncio.Semaphore(5)  # Allow up to 5 concurrent transactions
 
+# Retries of transactions that hit lock contention. The delay before each
+# retry doubles from the base delay up to the max delay (in milliseconds).
+# Configured with DB_MAX_RETRIES, DB_RETRY_BASE_DELAY_MS and DB_RETRY_MAX_DELAY_MS.
+_MAX_RETRIES = taproot_settings.db_max_retries
+_RETRY_BASE_DELAY_MS = taproot_settings.db_retry_base_delay_ms
+_RETRY_MAX_DELAY_MS = taproot_settings.db_retry_max_delay_ms
+
 # Type variable for generic function return types
 T = TypeVar('T')
 
+# Timestamp shared by all writes within a timestamp_scope()
+_scoped_now: contextvars.ContextVar[Optional[datetime]] = contextvars.ContextVar(
+    "taproot_scoped_now", default=None
+)
+
+
+def now_cached() -> datetime:
+    """
+    Get the current time, or the timestamp of the enclosing timestamp_scope().
+    
+    Returns:
+        datetime: The scoped timestamp if inside a scope, datetime.now() otherwise
+    """
+    now = _scoped_now.get()
+    return now if now is not None else datetime.now()
+
+
+@contextmanager
+def timestamp_scope():
+    """
+    Share a single timestamp among all writes of an operation.
+    
+    The timestamp is taken once on entry and returned by now_cached() for
+    the rest of the scope, including in tasks started within it, so all rows
+    written for one settlement carry the same time.
+    
+    Example:
+        ```python
+        with timestamp_scope():
+            await record_transaction(...)  # created_at == now_cached()
+        ```
+    """
+    token = _scoped_now.set(datetime.now())
+    try:
+        yield
+    finally:
+        _scoped_now.reset(token)
+
 class ConnectionPoolManager:
     """
     Manages SQLAlchemy connection pools for better performance and reliability.
@@ -59,20 +107,175 @@ class ConnectionPoolManager:
 connection_pool = ConnectionPoolManager(db)
 
 
+class AsyncKeyedLock:
+    """
+    Per-key asyncio locks, so work on one key is serialized without a global lock.
+    
+    Each key's lock is reference counted by the tasks holding or waiting for
+    it, and is only dropped once the last of them is done, so a new task can
+    never get a second lock for a key that is still in use. Dropped locks are
+    kept in a small pool for reuse.
+    """
+    
+    # Maximum number of idle locks kept for reuse
+    POOL_MAX_SIZE = 64
+    
+    def __init__(self):
+        """Initialize an empty keyed lock."""
+        self._locks: Dict[Hashable, asyncio.Lock] = {}
+        self._refcounts: Dict[Hashable, int] = {}
+        self._pool: List[asyncio.Lock] = []
+    
+    @asynccontextmanager
+    async def __call__(self, key: Hashable):
+        """
+        Hold the lock of a key.
+        
+        Args:
+            key: The key to serialize on
+            
+        Example:
+            ```python
+            async with payment_locks(payment_hash):
+                ...
+            ```
+        """
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._pool.pop() if self._pool else asyncio.Lock()
+            self._locks[key] = lock
+        # Count this task before waiting, so the lock can't be dropped under it
+        self._refcounts[key] = self._refcounts.get(key, 0) + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            remaining = self._refcounts[key] - 1
+            if remaining:
+                self._refcounts[key] = remaining
+            else:
+                del self._refcounts[key]
+                del self._locks[key]
+                if len(self._pool) < self.POOL_MAX_SIZE:
+                    self._pool.append(lock)
+
+
+def _jittered(delay_ms: float) -> float:
+    """
+    Spread a retry delay over [delay / 2, delay * 3 / 2].
+    
+    The wide jitter window decorrelates retries of concurrently conflicting
+    transactions, so they don't collide again on the next attempt.
+    
+    Args:
+        delay_ms: The capped delay (in milliseconds)
+        
+    Returns:
+        float: The delay to wait (in seconds)
+    """
+    return random.uniform(delay_ms / 2, delay_ms * 1.5) / 1000
+
+
+def _backoff_delay(attempt: int, base_delay_ms: float, max_delay_ms: float) -> float:
+    """
+    Compute a retry delay using capped exponential backoff with jitter.
+    
+    Args:
+        attempt: Zero-based retry attempt
+        base_delay_ms: Delay of the first retry (in milliseconds)
+        max_delay_ms: Cap applied to the delay before jitter (in milliseconds)
+        
+    Returns:
+        float: The delay to wait (in seconds)
+    """
+    return _jittered(min(max_delay_ms, base_delay_ms * (2 ** attempt)))
+
+
+class BackoffPolicy:
+    """
+    Adaptive retry backoff per operation type.
+    
+    Operations contend on different rows (payments on their payment hash,
+    balance updates on their wallet and asset), so each one learns its own
+    delay ceiling. The ceiling grows when a transaction is retried on
+    contention and shrinks when it commits, separately for each number of
+    prior aborts.
+    """
+    
+    # Growth factor of the ceiling on abort, by number of prior aborts (2 = 2+)
+    ABORT_ALPHA = {0: 0.5, 1: 1.0, 2: 2.0}
+    
+    # Shrink factor of the ceiling on commit
+    COMMIT_ALPHA = 0.25
+    
+    # Current delay ceiling (in milliseconds) per (operation, prior aborts)
+    _ceilings: Dict[Tuple[str, int], float] = {}
+    
+    @classmethod
+    def on_abort(
+        cls,
+        operation: str,
+        aborts: int,
+        base_delay_ms: float,
+        max_delay_ms: float
+    ) -> float:
+        """
+        Grow the ceiling after an abort and draw the delay before the retry.
+        
+        Args:
+            operation: Operation type tag
+            aborts: Number of aborts before this one
+            base_delay_ms: Lower bound of the ceiling (in milliseconds)
+            max_delay_ms: Upper bound of the ceiling (in milliseconds)
+            
+        Returns:
+            float: The delay to wait (in seconds)
+        """
+        key = (operation, min(aborts, 2))
+        ceiling = cls._ceilings.get(key, base_delay_ms) * (1 + cls.ABORT_ALPHA[key[1]])
+        ceiling = min(max(ceiling, base_delay_ms), max_delay_ms)
+        cls._ceilings[key] = ceiling
+        return _jittered(ceiling)
+    
+    @classmethod
+    def on_commit(
+        cls,
+        operation: str,
+        aborts: int,
+        base_delay_ms: float,
+        max_delay_ms: float
+    ) -> None:
+        """
+        Shrink the ceiling after a commit.
+        
+        Args:
+            operation: Operation type tag
+            aborts: Number of aborts before the commit
+            base_delay_ms: Lower bound of the ceiling (in milliseconds)
+            max_delay_ms: Upper bound of the ceiling (in milliseconds)
+        """
+        key = (operation, min(aborts, 2))
+        ceiling = cls._ceilings.get(key)
+        if ceiling is None:
+            return
+        cls._ceilings[key] = min(max(ceiling / (1 + cls.COMMIT_ALPHA), base_delay_ms), max_delay_ms)
+
+
 @asynccontextmanager
-async def transaction(conn=None, max_retries=3, retry_delay=0.1):
+async def transaction(conn=None):
     """
-    Transaction context manager for atomic operations with retry capability.
+    Transaction context manager for atomic operations.
     
     This context manager ensures that multiple database operations are executed
     within a single transaction, with proper commit and rollback handling.
-    It uses a semaphore to limit concurrent transactions and implements
-    exponential backoff retry logic for handling contention.
+    It uses a semaphore to limit concurrent transactions.
+    
+    A context manager can't run its body a second time, so this makes a
+    single attempt. Use with_transaction to retry a function whose
+    transaction hits lock contention.
     
     Args:
         conn: Optional existing connection to reuse
-        max_retries: Maximum number of retry attempts for the transaction
-        retry_delay: Initial delay between retries (will increase exponentially)
         
     Yields:
         A database connection with an active transaction
@@ -88,107 +291,75 @@ async def transaction(conn=None, max_retries=3, retry_delay=0.1):
     """
     connection_pool._increment_stat('transactions_started')
     
-    # If we're reusing a connection, we don't need to acquire the semaphore
-    # as it should have been acquired by the parent transaction
-    need_semaphore = conn is None
-    
-    # Track if we acquired the semaphore so we know whether to release it
-    semaphore_acquired = False
-    
-    # Implement retry logic with exponential backoff
-    retry_count = 0
-    current_delay = retry_delay
+    if conn is not None:
+        # Reuse the existing connection. The parent transaction already holds
+        # the semaphore and owns the commit.
+        connection_pool._increment_stat('connections_reused')
+        try:
+            yield conn
+        except Exception as e:
+            connection_pool._increment_stat('transactions_rolled_back')
+            logger.error(f"Transaction failed (reused connection): {str(e)}")
+            raise
+        connection_pool._increment_stat('transactions_committed')
+        return
     
-    while True:
+    async with _transaction_semaphore:
+        logger.debug(f"Transaction semaphore acquired (available: {_transaction_semaphore._value})")
         try:
-            # Acquire the semaphore if needed
-            if need_semaphore:
-                await _transaction_semaphore.acquire()
-                semaphore_acquired = True
-                logger.debug(f"Transaction semaphore acquired (available: {_transaction_semaphore._value})")
-            
-            if conn is not None:
-                # Reuse the existing connection
-                connection_pool._increment_stat('connections_reused')
-                try:
-                    yield conn
-                    connection_pool._increment_stat('transactions_committed')
-                    break  # Success, exit the retry loop
-                except Exception as e:
-                    connection_pool._increment_stat('transactions_rolled_back')
-                    logger.error(f"Transaction failed (reused connection): {str(e)}")
-                    raise
-            else:
-                # Get a new connection with a transaction
-                async with db.connect() as new_conn:
-                    connection_pool._increment_stat('connections_created')
-                    try:
-                        yield new_conn
-                        # The connection context manager will commit automatically
-                        connection_pool._increment_stat('transactions_committed')
-                        break  # Success, exit the retry loop
-                    except Exception as e:
-                        # The connection context manager will rollback automatically
-                        connection_pool._increment_stat('transactions_rolled_back')
-                        
-                        # Check if this is a database lock error that we should retry
-                        error_str = str(e).lower()
-                        if ("database is locked" in error_str or 
-                            "deadlock detected" in error_str or 
-                            "could not serialize access" in error_str):
-                            
-                            retry_count += 1
-                            if retry_count <= max_retries:
-                                # Release the semaphore before retrying
-                                if semaphore_acquired:
-                                    _transaction_semaphore.release()
-                                    semaphore_acquired = False
-                                    logger.debug(f"Transaction semaphore released for retry (available: {_transaction_semaphore._value})")
-                                
-                                # Add some randomness to avoid all retries happening at the same time
-                                jitter = random.uniform(0, 0.1)
-                                wait_time = current_delay + jitter
-                                
-                                logger.warning(f"Database contention detected, retrying in {wait_time:.2f}s (attempt {retry_count}/{max_retries})")
-                                await asyncio.sleep(wait_time)
-                                
-                                # Exponential backoff
-                                current_delay *= 2
-                                continue
-                            else:
-                                logger.error(f"Max retries ({max_retries}) exceeded for transaction")
-                        
-                        # Either not a retryable error or max retries exceeded
-                        logger.error(f"Transaction failed (new connection): {str(e)}")
-                        raise
-        
-        except Exception as outer_e:
-            # Handle any exceptions that weren't caught in the inner try/except
-            if retry_count < max_retries:
-                retry_count += 1
-                logger.warning(f"Transaction error, retrying ({retry_count}/{max_retries}): {str(outer_e)}")
-                await asyncio.sleep(current_delay)
-                current_delay *= 2
-                continue
+            # Get a new connection with a transaction
+            async with db.connect() as new_conn:
+                connection_pool._increment_stat('connections_created')
+                # The connection context manager commits on exit, or rolls
+                # back if the body raises
+                yield new_conn
+        except Exception as e:
+            connection_pool._increment_stat('transactions_rolled_back')
+            logger.error(f"Transaction failed (new connection): {str(e)}")
             raise
+        connection_pool._increment_stat('transactions_committed')
+
+
+def _is_retryable(error: Exception) -> bool:
+    """
+    Check whether a transaction failed on lock contention, so a new attempt may succeed.
+    
+    Args:
+        error: The exception the transaction failed with
         
-        finally:
-            # Always release the semaphore if we acquired it
-            if semaphore_acquired:
-                _transaction_semaphore.release()
-                logger.debug(f"Transaction semaphore released (available: {_transaction_semaphore._value})")
-                semaphore_acquired = False
+    Returns:
+        bool: True if the transaction should be retried
+    """
+    error_str = str(error).lower()
+    return (
+        "database is locked" in error_str or
+        "deadlock detected" in error_str or
+        "could not serialize access" in error_str
+    )
 
 
-def with_transaction(func: Callable[..., Any]) -> Callable[..., Any]:
+def with_transaction(
+    func: Optional[Callable[..., Any]] = None,
+    *,
+    operation: Optional[str] = None
+) -> Callable[..., Any]:
     """
     Decorator to wrap a function in a transaction.
     
     This decorator ensures that the decorated function is executed within
-    a transaction, with proper commit and rollback handling.
+    a transaction, with proper commit and rollback handling. When it opens
+    the transaction itself and the transaction fails on lock contention,
+    the whole function is run again in a new transaction, with capped
+    exponential backoff and jitter between attempts. Functions given a
+    connection are part of the caller's transaction and are not retried.
+    
+    It can be used bare or as with_transaction(operation=...); tagged
+    functions wait according to the adaptive BackoffPolicy of their
+    operation instead.
     
     Args:
         func: The async function to wrap in a transaction
+        operation: Optional operation type tag for the adaptive backoff
         
     Returns:
         Wrapped function that executes within a transaction
@@ -204,6 +375,9 @@ def with_transaction(func: Callable[..., Any]) -> Callable[..., Any]:
             await record_transaction(user_id, amount, conn=conn)
         ```
     """
+    if func is None:
+        return functools.partial(with_transaction, operation=operation)
+    
     @functools.wraps(func)
     async def wrapper(*args, **kwargs):
         # Check if a connection was provided
@@ -212,11 +386,36 @@ def with_transaction(func: Callable[..., Any]) -> Callable[..., Any]:
         if conn is not None:
             # If a connection was provided, just call the function
             return await func(*args, **kwargs)
-        else:
-            # Otherwise, create a transaction and call the function
-            async with transaction() as new_conn:
-                # Add the connection to the kwargs
-                kwargs['conn'] = new_conn
-                return await func(*args, **kwargs)
+        
+        retry_count = 0
+        while True:
+            try:
+                # Create a transaction and call the function
+                async with transaction() as new_conn:
+                    # Add the connection to the kwargs
+                    kwargs['conn'] = new_conn
+                    result = await func(*args, **kwargs)
+            except Exception as e:
+                if not _is_retryable(e):
+                    raise
+                if retry_count >= _MAX_RETRIES:
+                    logger.error(f"Max retries ({_MAX_RETRIES}) exceeded for transaction")
+                    raise
+                
+                # The transaction is rolled back and its semaphore slot released,
+                # so wait without holding anything
+                if operation is not None:
+                    wait_time = BackoffPolicy.on_abort(operation, retry_count, _RETRY_BASE_DELAY_MS, _RETRY_MAX_DELAY_MS)
+                else:
+                    wait_time = _backoff_delay(retry_count, _RETRY_BASE_DELAY_MS, _RETRY_MAX_DELAY_MS)
+                retry_count += 1
+                logger.warning(f"Database contention detected, retrying in {wait_time:.2f}s (attempt {retry_count}/{_MAX_RETRIES})")
+                await asyncio.sleep(wait_time)
+                continue
+            
+            # Committed
+            if operation is not None:
+                BackoffPolicy.on_commit(operation, retry_count, _RETRY_BASE_DELAY_MS, _RETRY_MAX_DELAY_MS)
+            return result
     
     return wrapper
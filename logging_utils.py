@@ -30,40 +30,59 @@ LOG_LEVELS = {
 }
 
 
-def log_debug(component: str, message: str, **kwargs) -> None:
+def is_log_level_enabled(level: str) -> bool:
+    """
+    Check whether messages of a level are emitted by any configured handler.
+    
+    Args:
+        level: Log level (debug, info, warning, error, critical)
+        
+    Returns:
+        bool: True if messages at this level are logged, or if it can't be told
+    """
+    # loguru doesn't expose the effective level publicly, so fall back to
+    # assuming everything is logged if its internals change
+    min_level = getattr(getattr(logger, "_core", None), "min_level", 0)
+    return LOG_LEVELS.get(level, 0) >= min_level
+
+
+def log_debug(component: str, message: str, *args, **kwargs) -> None:
     """
     Log a debug message with standard formatting.
     
     Args:
         component: The component identifier (use constants from this module)
-        message: The message to log
+        message: The message to log, optionally with {} placeholders
+        *args: Values for the placeholders, only formatted if the message is emitted
         **kwargs: Additional parameters to pass to the logger
     """
-    logger.debug(f"[{component}] {message}", **kwargs)
+    logger.debug(f"[{component}] {message}", *args, **kwargs)
 
 
-def log_info(component: str, message: str, **kwargs) -> None:
+def log_info(component: str, message: str, *args, **kwargs) -> None:
     """
     Log an info message with standard formatting.
     
     Args:
         component: The component identifier (use constants from this module)
-        message: The message to log
+        message: The message to log, optionally with {} placeholders
+        *args: Values for the placeholders, only formatted if the message is emitted
         **kwargs: Additional parameters to pass to the logger
     """
-    logger.info(f"[{component}] {message}", **kwargs)
+    logger.info(f"[{component}] {message}", *args, **kwargs)
 
 
-def log_warning(component: str, message: str, **kwargs) -> None:
+def log_warning(component: str, message: str, *args, **kwargs) -> None:
     """
     Log a warning message with standard formatting.
     
     Args:
         component: The component identifier (use constants from this module)
-        message: The message to log
+        message: The message to log, optionally with {} placeholders
+        *args: Values for the placeholders, only formatted if the message is emitted
         **kwargs: Additional parameters to pass to the logger
     """
-    logger.warning(f"[{component}] {message}", **kwargs)
+    logger.warning(f"[{component}] {message}", *args, **kwargs)
 
 
 def log_error(component: str, message: str, exc_info: bool = False, **kwargs) -> None:
@@ -270,3 +270,34 @@ async def m007_add_extra_to_invoices(db):
     except Exception as e:
         # Column might already exist
         logger.warning(f"Error in migration m007_add_extra_to_invoices: {str(e)}")
+
+
+async def m008_add_asset_transactions_listing_indexes(db):
+    """
+    Add composite indexes matching the asset transaction listing queries.
+    
+    Transactions are listed per wallet, optionally per asset, newest first
+    with id as the tiebreaker, so these indexes serve both the filter and
+    the ordering without a sort.
+    """
+    try:
+        transactions_table = get_table_name("asset_transactions")
+        transactions_index_table = transactions_table.split(".")[-1] if db.type == "SQLITE" else transactions_table
+        
+        await db.execute(
+            f"""
+            CREATE INDEX IF NOT EXISTS asset_transactions_wallet_asset_created_idx
+            ON {transactions_index_table} (wallet_id, asset_id, created_at DESC, id DESC);
+            """
+        )
+        
+        await db.execute(
+            f"""
+            CREATE INDEX IF NOT EXISTS asset_transactions_wallet_created_idx
+            ON {transactions_index_table} (wallet_id, created_at DESC, id DESC);
+            """
+        )
+        
+        logger.info("Added listing indexes for asset_transactions table")
+    except Exception as e:
+        logger.warning(f"Error in migration m008_add_asset_transactions_listing_indexes: {str(e)}")
@@ -1,3 +1,4 @@
+from dataclasses import dataclass
 from datetime import datetime
 from http import HTTPStatus
 from typing import Optional, List, Dict, Any, Generic, TypeVar, Union
@@ -8,6 +9,22 @@ from pydantic import BaseModel, Field
 T = TypeVar('T')
 
 
+class InvoiceStatus:
+    """Invoice status values, as stored in the database and sent to clients."""
+    PENDING = "pending"
+    PAID = "paid"
+    EXPIRED = "expired"
+    CANCELLED = "cancelled"
+    
+    ALL = frozenset({PENDING, PAID, EXPIRED, CANCELLED})
+
+
+class TxType:
+    """Asset transaction types, as stored in the database."""
+    CREDIT = "credit"
+    DEBIT = "debit"
+
+
 class TaprootAsset(BaseModel):
     """Model for a Taproot Asset."""
     id: str
@@ -53,7 +70,7 @@ class TaprootInvoice(BaseModel):
     asset_amount: int
     satoshi_amount: int  # Satoshi amount for protocol requirements (from settings)
     description: Optional[str] = None
-    status: str = "pending"
+    status: str = InvoiceStatus.PENDING
     user_id: str
     wallet_id: str
     created_at: datetime
@@ -62,6 +79,29 @@ class TaprootInvoice(BaseModel):
     extra: Optional[dict] = None  # Store metadata from other extensions
 
 
+@dataclass(slots=True)
+class InvoiceNotification:
+    """WebSocket payload sent when a new Taproot Asset invoice is created."""
+    id: str
+    payment_hash: str
+    payment_request: str
+    asset_id: str
+    asset_amount: int
+    satoshi_amount: int
+    description: Optional[str]
+    status: str
+    created_at: str
+
+
+@dataclass(frozen=True, slots=True)
+class DecodedInvoice:
+    """Fields of a locally decoded BOLT11 invoice, immutable so it can be shared from a cache."""
+    payment_hash: str
+    description: Optional[str]
+    expiry: int
+    date: int
+
+
 class TaprootPayment(BaseModel):
     """Model for a Taproot Asset payment."""
     id: str
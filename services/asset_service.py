@@ -150,22 +150,28 @@ class AssetService:
     async def get_asset_transactions(
         wallet: WalletTypeInfo,
         asset_id: Optional[str] = None,
-        limit: int = 100
-    ) -> List[AssetTransaction]:
+        limit: int = 100,
+        cursor: Optional[str] = None
+    ) -> Tuple[List[AssetTransaction], Optional[str]]:
         """
-        Get asset transactions for the current wallet.
+        Get a page of asset transactions for the current wallet.
         
         Args:
             wallet: The wallet information
             asset_id: Optional asset ID to filter transactions
             limit: Maximum number of transactions to return
+            cursor: ID of the last transaction of the previous page, None for the first page
             
         Returns:
-            List[AssetTransaction]: List of asset transactions
+            Tuple containing:
+            - transactions (List[AssetTransaction]): The page of transactions
+            - next_cursor (Optional[str]): Cursor for the next page, None if this is the last page
             
         Raises:
-            HTTPException: If there's an error retrieving asset transactions
+            HTTPException: If the cursor is unknown or there's an error retrieving asset transactions
         """
         with ErrorContext("get_asset_transactions", ASSET):
-            transactions = await get_asset_transactions(wallet.wallet.id, asset_id, limit)
-            return transactions
+            try:
+                return await get_asset_transactions(wallet.wallet.id, asset_id, limit, cursor)
+            except ValueError as e:
+                raise_http_exception(status_code=HTTPStatus.BAD_REQUEST, detail=str(e))
@@ -5,6 +5,9 @@ from lnbits.core.models import Payment
 from lnbits.tasks import invoice_listeners
 from loguru import logger
 
+# Resolve the UTC tzinfo once rather than on every emitted event
+_UTC = timezone.utc
+
 
 class CrossExtensionService:
     """Handle communication between Taproot Assets and other extensions."""
@@ -29,7 +32,7 @@ class CrossExtensionService:
             bolt11="",  # Not used for taproot payments
             amount=satoshi_amount,  # Use satoshi amount for compatibility
             memo=extra.get("description", "") if extra else "",
-            time=datetime.now(timezone.utc),
+            time=datetime.now(_UTC),
             fee=0,
             preimage="",
             status="success",  # Set status to success for completed payments
@@ -6,9 +6,10 @@ from typing import Dict, Any, Optional, List, Tuple, Union
 from http import HTTPStatus
 from loguru import logger
 
-from lnbits.core.models import WalletTypeInfo, User
+from lnbits.core.models import WalletTypeInfo, User, Wallet
+from lnbits.core.models.wallets import KeyType
 
-from ..models import TaprootInvoiceRequest, InvoiceResponse, TaprootInvoice
+from ..models import TaprootInvoiceRequest, InvoiceResponse, TaprootInvoice, InvoiceNotification, InvoiceStatus
 from ..tapd.taproot_factory import TaprootAssetsFactory
 from ..error_utils import raise_http_exception, ErrorContext
 from ..logging_utils import API
@@ -16,9 +17,12 @@ from ..logging_utils import API
 from ..crud import (
     create_invoice,
     get_invoice,
+    get_invoice_for_user,
     get_invoice_by_payment_hash,
-    get_user_invoices
+    get_user_invoices,
+    update_invoice_status as db_update_invoice_status
 )
+from .asset_service import AssetService
 from .notification_service import NotificationService
 from .settlement_service import SettlementService
 from ..tapd_settings import taproot_settings
@@ -66,12 +70,7 @@ class InvoiceService:
             if peer_pubkey is None:
                 logger.info(f"[{API}] No peer specified, looking for available asset channels")
                 
-                # Use our own AssetService to find the peer
-                from .asset_service import AssetService
-                from lnbits.core.models import WalletTypeInfo, Wallet
-                
                 # Create wallet info for asset lookup
-                from lnbits.core.models.wallets import KeyType
                 wallet_obj = Wallet(id=wallet_id, user=user_id, adminkey="", inkey="", balance_msat=0, name="")
                 wallet_info = WalletTypeInfo(key_type=KeyType.admin, wallet=wallet_obj)
                 
@@ -116,48 +115,38 @@ class InvoiceService:
             # Get satoshi fee from settings
             satoshi_amount = taproot_settings.default_sat_fee
 
-            # Import transaction context manager
-            from ..db_utils import transaction
-            
-            # Create invoice record within a transaction
-            invoice = None
-            async with transaction(max_retries=3, retry_delay=0.2) as conn:
-                invoice = await create_invoice(
+            # Create invoice record - a single INSERT, so let the CRUD layer
+            # manage its own connection instead of wrapping it in a retrying transaction
+            invoice = await create_invoice(
+                asset_id=data.asset_id,
+                asset_amount=data.amount,
+                satoshi_amount=satoshi_amount,
+                payment_hash=payment_hash,
+                payment_request=payment_request,
+                user_id=user_id,
+                wallet_id=wallet_id,
+                description=data.description or "",
+                expiry=data.expiry,
+                extra=data.extra
+            )
+
+            # Send WebSocket notification for new invoice AFTER the insert is committed,
+            # without making the HTTP caller wait for the WebSocket fan-out
+            if invoice:
+                invoice_data = InvoiceNotification(
+                    id=invoice.id,
+                    payment_hash=payment_hash,
+                    payment_request=payment_request,
                     asset_id=data.asset_id,
                     asset_amount=data.amount,
                     satoshi_amount=satoshi_amount,
-                    payment_hash=payment_hash,
-                    payment_request=payment_request,
-                    user_id=user_id,
-                    wallet_id=wallet_id,
-                    description=data.description or "",
-                    expiry=data.expiry,
-                    extra=data.extra,
-                    conn=conn
+                    description=invoice.description,
+                    status=InvoiceStatus.PENDING,
+                    created_at=invoice.created_at.isoformat() if hasattr(invoice.created_at, "isoformat") else str(invoice.created_at)
+                )
+                NotificationService.send_in_background(
+                    NotificationService.notify_invoice_update(user_id, invoice_data)
                 )
-
-            # Send WebSocket notification for new invoice AFTER the transaction is committed
-            if invoice:
-                try:
-                    invoice_data = {
-                        "id": invoice.id,
-                        "payment_hash": payment_hash,
-                        "payment_request": payment_request,
-                        "asset_id": data.asset_id,
-                        "asset_amount": data.amount,
-                        "satoshi_amount": satoshi_amount,
-                        "description": invoice.description,
-                        "status": "pending",
-                        "created_at": invoice.created_at.isoformat() if hasattr(invoice.created_at, "isoformat") else str(invoice.created_at)
-                    }
-                    
-                    # Use NotificationService for WebSocket notification
-                    notification_sent = await NotificationService.notify_invoice_update(user_id, invoice_data)
-                    if not notification_sent:
-                        logger.warning(f"Failed to send WebSocket notification for invoice {invoice.id}")
-                except Exception as e:
-                    # Don't fail the whole operation if notification fails
-                    logger.warning(f"Failed to send notification for invoice {invoice.id}: {str(e)}")
 
             # Return response
             return InvoiceResponse(
@@ -185,15 +174,15 @@ class InvoiceService:
             HTTPException: If the invoice is not found or doesn't belong to the user
         """
         with ErrorContext("get_invoice", API):
-            invoice = await get_invoice(invoice_id)
+            invoice, exists = await get_invoice_for_user(invoice_id, user_id)
 
-            if not invoice:
+            if not exists:
                 raise_http_exception(
                     status_code=HTTPStatus.NOT_FOUND,
                     detail="Invoice not found",
                 )
 
-            if invoice.user_id != user_id:
+            if not invoice:
                 raise_http_exception(
                     status_code=HTTPStatus.FORBIDDEN,
                     detail="Not your invoice",
@@ -242,28 +231,28 @@ class InvoiceService:
             HTTPException: If the invoice is not found, doesn't belong to the user, or the status is invalid
         """
         with ErrorContext("update_invoice_status", API):
-            invoice = await get_invoice(invoice_id)
+            invoice, exists = await get_invoice_for_user(invoice_id, user_id)
 
-            if not invoice:
+            if not exists:
                 raise_http_exception(
                     status_code=HTTPStatus.NOT_FOUND,
                     detail="Invoice not found",
                 )
 
-            if invoice.user_id != user_id:
+            if not invoice:
                 raise_http_exception(
                     status_code=HTTPStatus.FORBIDDEN,
                     detail="Not your invoice",
                 )
 
-            if status not in ["pending", "paid", "expired", "cancelled"]:
+            if status not in InvoiceStatus.ALL:
                 raise_http_exception(
                     status_code=HTTPStatus.BAD_REQUEST,
                     detail="Invalid status",
                 )
 
             # If marking as paid, use SettlementService to handle it correctly
-            if status == "paid" and invoice.status != "paid":
+            if status == InvoiceStatus.PAID and invoice.status != InvoiceStatus.PAID:
                 # Initialize a wallet instance to get the node
                 taproot_wallet = await TaprootAssetsFactory.create_wallet(
                     user_id=user_id,
@@ -295,7 +284,6 @@ class InvoiceService:
                     )
             else:
                 # For non-payment status updates, use the regular update method
-                from ..crud import update_invoice_status as db_update_invoice_status
                 updated_invoice = await db_update_invoice_status(invoice_id, status)
                 
                 # Send WebSocket notification about status update using NotificationService
@@ -2,10 +2,21 @@
 LNURL service for Taproot Assets extension.
 Handles LNURL pay functionality for taproot assets.
 """
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Tuple, Type
+import asyncio
+import copy
+import functools
+import random
+import re
 import httpx
 from loguru import logger
 
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional
+    orjson = None
+
+from lnbits.utils.cache import cache
 from lnbits.lnurl import decode as lnurl_decode
 from lnbits.helpers import check_callback_url
 from lnbits.bolt11 import decode as bolt11_decode
@@ -13,14 +24,124 @@ from lnbits.bolt11 import decode as bolt11_decode
 from ..models import TaprootPaymentRequest, PaymentResponse
 from ..logging_utils import log_debug, log_info, log_warning, log_error, PAYMENT, API
 from ..error_utils import ErrorContext
+from ..db_utils import AsyncKeyedLock
 from .payment_service import PaymentService
 
+# Fields every LNURL pay response must carry
+_REQUIRED_LNURL_KEYS = frozenset({"callback", "minSendable", "maxSendable", "metadata"})
+
+
+@functools.lru_cache(maxsize=4096)
+def _decode_lnurl_cached(lnurl_string: str) -> str:
+    """Decode a bech32 LNURL to its URL, memoized per LNURL string."""
+    return str(lnurl_decode(lnurl_string))
+
+
+def _parse_json(response: httpx.Response) -> Any:
+    """Parse a JSON response body, using orjson when it is installed."""
+    if orjson is not None:
+        return orjson.loads(response.content)
+    return response.json()
+
 
 class LnurlService:
     """
     Service for handling LNURL payments with Taproot Assets.
     """
     
+    # Cache expiry for LNURL pay parameters in seconds, unless the
+    # endpoint's Cache-Control header says otherwise
+    LNURL_PARAMS_CACHE_EXPIRY = 60
+    
+    # How long ETag/Last-Modified validators are kept for conditional
+    # requests once the parameters themselves have expired
+    LNURL_VALIDATORS_CACHE_EXPIRY = 3600
+    
+    # Decode bolt11 invoices in a worker thread instead of on the event loop
+    DECODE_INVOICES_IN_THREAD = True
+    
+    # Attempts and initial backoff delay in seconds for LNURL requests
+    # that fail at the transport level
+    HTTP_MAX_ATTEMPTS = 3
+    HTTP_RETRY_DELAY = 1.0
+    HTTP_MAX_RETRY_DELAY = 4.0
+    
+    # Shared HTTP client, so LNURL requests reuse pooled connections
+    _client: Optional[httpx.AsyncClient] = None
+    
+    # Per-LNURL locks so concurrent first-time fetches share one request
+    _parse_locks = AsyncKeyedLock()
+    
+    @classmethod
+    async def _get_client(cls) -> httpx.AsyncClient:
+        """
+        Get or create the shared HTTP client for LNURL requests.
+        
+        Returns:
+            httpx.AsyncClient: The pooled client
+        """
+        if cls._client is None or cls._client.is_closed:
+            # Bounded pool and per-phase timeouts, so a slow or redirecting
+            # LNURL server cannot tie up connections under load
+            cls._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(connect=5.0, read=10.0, write=5.0, pool=2.0),
+                limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+                follow_redirects=False
+            )
+        return cls._client
+    
+    @classmethod
+    async def _get_with_retry(
+        cls,
+        url: str,
+        retry_on: Tuple[Type[Exception], ...] = (httpx.TransportError,),
+        **kwargs
+    ) -> httpx.Response:
+        """
+        GET a URL with the shared client, retrying transport errors.
+        
+        Retries reuse the pooled connections, with exponential backoff and
+        jitter so callers don't have to retry the whole LNURL flow.
+        
+        Args:
+            url: The URL to fetch
+            retry_on: Errors worth retrying. Requests that are not safe to
+                repeat should only retry errors raised before anything
+                reached the server, such as httpx.ConnectError.
+            **kwargs: Additional parameters passed to httpx.AsyncClient.get
+            
+        Returns:
+            httpx.Response: The response
+            
+        Raises:
+            httpx.TransportError: If every attempt fails
+        """
+        client = await cls._get_client()
+        current_delay = cls.HTTP_RETRY_DELAY
+        for attempt in range(1, cls.HTTP_MAX_ATTEMPTS + 1):
+            try:
+                return await client.get(url, **kwargs)
+            except retry_on as e:
+                if attempt >= cls.HTTP_MAX_ATTEMPTS:
+                    raise
+                
+                # Add some randomness to avoid all retries happening at the same time
+                wait_time = current_delay + random.uniform(0, current_delay)
+                log_warning(
+                    API,
+                    f"LNURL request failed ({type(e).__name__}), retrying in {wait_time:.2f}s "
+                    f"(attempt {attempt}/{cls.HTTP_MAX_ATTEMPTS})"
+                )
+                await asyncio.sleep(wait_time)
+                current_delay = min(current_delay * 2, cls.HTTP_MAX_RETRY_DELAY)
+    
+    @classmethod
+    async def close(cls) -> None:
+        """Close the shared HTTP client."""
+        if cls._client is not None:
+            await cls._client.aclose()
+            cls._client = None
+    
     @classmethod
     async def parse_lnurl(cls, lnurl_string: str) -> Dict[str, Any]:
         """
@@ -36,32 +157,77 @@ class LnurlService:
             Exception: If LNURL parsing or fetching fails
         """
         with ErrorContext("parse_lnurl", API):
+            cache_key = f"taproot:lnurl:params:{lnurl_string}"
+            validators_key = f"taproot:lnurl:validators:{lnurl_string}"
             try:
-                # Decode the LNURL to get the actual URL
-                url = str(lnurl_decode(lnurl_string))
-                log_info(API, f"Decoded LNURL to URL: {url}")
-                
-                # Validate the callback URL
-                check_callback_url(url)
+                # Return cached parameters if we fetched them recently. Callers
+                # get their own copy so they can't mutate the cached entry.
+                cached = cache.get(cache_key)
+                if cached:
+                    log_debug(API, "Using cached LNURL parameters")
+                    return copy.deepcopy(cached)
                 
-                # Fetch the LNURL parameters
-                async with httpx.AsyncClient() as client:
-                    response = await client.get(url, timeout=10)
-                    response.raise_for_status()
+                async with cls._parse_locks(lnurl_string):
+                    # Another request may have fetched the parameters while we waited
+                    cached = cache.get(cache_key)
+                    if cached:
+                        log_debug(API, "Using cached LNURL parameters")
+                        return copy.deepcopy(cached)
                     
-                    data = response.json()
-                    log_debug(API, f"LNURL response: {data}")
+                    # Decode the LNURL to get the actual URL
+                    url = _decode_lnurl_cached(lnurl_string)
+                    log_info(API, f"Decoded LNURL to URL: {url}")
                     
-                    # Check for errors
-                    if data.get("status") == "ERROR":
-                        raise Exception(f"LNURL error: {data.get('reason', 'Unknown error')}")
+                    # Validate the callback URL
+                    check_callback_url(url)
                     
-                    # Validate required fields
-                    if not all(key in data for key in ["callback", "minSendable", "maxSendable", "metadata"]):
-                        raise Exception("Invalid LNURL response: missing required fields")
+                    # Fetch the LNURL parameters, revalidating a previous
+                    # response if the endpoint gave us an ETag or Last-Modified
+                    validators = cache.get(validators_key)
+                    headers = cls._get_conditional_headers(validators)
+                    response = await cls._get_with_retry(url, headers=headers)
                     
-                    # Add the decoded URL for reference
-                    data["decoded_url"] = url
+                    if response.status_code == 304 and validators:
+                        log_debug(API, "LNURL parameters not modified, reusing previous response")
+                        data = copy.deepcopy(validators["data"])
+                    else:
+                        response.raise_for_status()
+                        
+                        data = _parse_json(response)
+                        log_debug(API, "LNURL response: {}", data)
+                        
+                        # Check for errors
+                        if data.get("status") == "ERROR":
+                            raise Exception(f"LNURL error: {data.get('reason', 'Unknown error')}")
+                        
+                        # Validate required fields
+                        missing = _REQUIRED_LNURL_KEYS - data.keys()
+                        if missing:
+                            raise Exception(f"Invalid LNURL response: missing {sorted(missing)}")
+                        
+                        # Add the decoded URL for reference
+                        data["decoded_url"] = url
+                    
+                    # Cache the parameters for subsequent calls in the same pay flow
+                    cache_control = response.headers.get("cache-control", "").lower()
+                    expiry = cls._get_cache_expiry(response)
+                    if expiry > 0:
+                        cache.set(cache_key, copy.deepcopy(data), expiry=expiry)
+                    
+                    # Keep the validators so the next fetch can be a conditional GET
+                    etag = response.headers.get("etag") or (validators or {}).get("etag")
+                    last_modified = (
+                        response.headers.get("last-modified")
+                        or (validators or {}).get("last_modified")
+                    )
+                    if "no-store" in cache_control:
+                        cache.pop(validators_key)
+                    elif etag or last_modified:
+                        cache.set(
+                            validators_key,
+                            {"etag": etag, "last_modified": last_modified, "data": copy.deepcopy(data)},
+                            expiry=cls.LNURL_VALIDATORS_CACHE_EXPIRY
+                        )
                     
                     return data
                     
@@ -69,6 +235,50 @@ class LnurlService:
                 log_error(API, f"Failed to parse LNURL: {str(e)}")
                 raise
     
+    @staticmethod
+    def _get_conditional_headers(validators: Optional[Dict[str, Any]]) -> Dict[str, str]:
+        """
+        Build conditional request headers from a previous LNURL response.
+        
+        Args:
+            validators: Cached ETag, Last-Modified and body of the previous response
+            
+        Returns:
+            Dict of If-None-Match/If-Modified-Since headers, empty if there is nothing to revalidate
+        """
+        headers: Dict[str, str] = {}
+        if not validators:
+            return headers
+        if validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        if validators.get("last_modified"):
+            headers["If-Modified-Since"] = validators["last_modified"]
+        return headers
+    
+    @classmethod
+    def _get_cache_expiry(cls, response: httpx.Response) -> int:
+        """
+        Determine how long LNURL parameters may be cached.
+        
+        Honors max-age, no-store and no-cache in the response's Cache-Control
+        header and falls back to LNURL_PARAMS_CACHE_EXPIRY.
+        
+        Args:
+            response: The LNURL endpoint response
+            
+        Returns:
+            int: Cache expiry in seconds, 0 if the response must not be cached
+        """
+        cache_control = response.headers.get("cache-control", "").lower()
+        if "no-store" in cache_control or "no-cache" in cache_control:
+            return 0
+        
+        max_age = re.search(r"max-age=(\d+)", cache_control)
+        if max_age:
+            return int(max_age.group(1))
+        
+        return cls.LNURL_PARAMS_CACHE_EXPIRY
+    
     @classmethod
     async def pay_lnurl(
         cls,
@@ -103,92 +313,95 @@ class LnurlService:
                 # The min/max limits from LNURL are in sats, but we're paying with assets
                 # which have their own units and values (1 asset could be worth 1000 sats or 0.001 sats)
                 
-                # Check if comment is allowed
-                comment_allowed = lnurl_params.get("commentAllowed", 0)
-                if comment and len(comment) > comment_allowed:
-                    comment = comment[:comment_allowed]
-                
                 # Make the callback to get the invoice
                 callback_url = lnurl_params["callback"]
                 log_info(PAYMENT, f"Making LNURL callback to: {callback_url}")
                 
-                # Prepare callback parameters
-                callback_params = {"amount": amount_msat}
-                if comment and comment_allowed > 0:
-                    callback_params["comment"] = comment
+                # Prepare callback parameters in one pass, truncating the
+                # comment to what the service allows
+                comment_allowed = lnurl_params.get("commentAllowed", 0)
+                accepts_asset = bool(asset_id and lnurl_params.get("acceptsAssets"))
+                accepted_assets = lnurl_params.get("acceptedAssetIds", []) if accepts_asset else []
+                include_asset = accepts_asset and asset_id in accepted_assets
+                callback_params = {
+                    "amount": amount_msat,
+                    **({"comment": comment[:comment_allowed]} if comment and comment_allowed > 0 else {}),
+                    **({"asset_id": asset_id} if include_asset else {})
+                }
                 
                 # If this LNURL accepts assets and we have an asset_id, include it
-                if asset_id and lnurl_params.get("acceptsAssets"):
-                    accepted_assets = lnurl_params.get("acceptedAssetIds", [])
-                    if asset_id in accepted_assets:
-                        callback_params["asset_id"] = asset_id
-                        log_info(PAYMENT, f"Including asset_id {asset_id} in LNURL callback")
-                    else:
-                        log_warning(PAYMENT, f"Asset {asset_id} not in accepted list: {accepted_assets}")
-                
-                # Make the callback request
-                async with httpx.AsyncClient() as client:
-                    check_callback_url(callback_url)
-                    log_info(PAYMENT, f"Making LNURL callback with params: {callback_params}")
-                    response = await client.get(
-                        callback_url,
-                        params=callback_params,
-                        timeout=10
-                    )
-                    response.raise_for_status()
-                    
-                    callback_data = response.json()
-                    log_info(PAYMENT, f"LNURL callback response: {callback_data}")
-                    
-                    # Check for errors
-                    if callback_data.get("status") == "ERROR":
-                        raise Exception(f"LNURL callback error: {callback_data.get('reason', 'Unknown error')}")
-                    
-                    # Get the payment request
-                    payment_request = callback_data.get("pr")
-                    if not payment_request:
-                        raise Exception("No payment request received from LNURL callback")
-                    
-                    log_info(PAYMENT, f"Got payment request: {payment_request[:100]}...")
-                    
-                    # For taproot assets, skip bolt11 validation since the invoice format might be different
-                    if asset_id:
-                        log_info(PAYMENT, "Skipping bolt11 validation for taproot asset payment")
+                if include_asset:
+                    log_info(PAYMENT, f"Including asset_id {asset_id} in LNURL callback")
+                elif accepts_asset:
+                    log_warning(PAYMENT, f"Asset {asset_id} not in accepted list: {accepted_assets}")
+                
+                # Make the callback request. Each callback can create a new
+                # invoice on the server, so only retry when the connection
+                # could not be established at all.
+                check_callback_url(callback_url)
+                log_info(PAYMENT, f"Making LNURL callback with params: {callback_params}")
+                response = await cls._get_with_retry(
+                    callback_url,
+                    retry_on=(httpx.ConnectError, httpx.ConnectTimeout),
+                    params=callback_params
+                )
+                response.raise_for_status()
+                
+                callback_data = _parse_json(response)
+                log_info(PAYMENT, f"LNURL callback response: {callback_data}")
+                
+                # Check for errors
+                if callback_data.get("status") == "ERROR":
+                    raise Exception(f"LNURL callback error: {callback_data.get('reason', 'Unknown error')}")
+                
+                # Get the payment request
+                payment_request = callback_data.get("pr")
+                if not payment_request:
+                    raise Exception("No payment request received from LNURL callback")
+                
+                log_info(PAYMENT, f"Got payment request: {payment_request[:100]}...")
+                
+                # For taproot assets, skip bolt11 validation since the invoice format might be different
+                if asset_id:
+                    log_info(PAYMENT, "Skipping bolt11 validation for taproot asset payment")
+                else:
+                    # Validate the invoice amount matches what we requested
+                    if cls.DECODE_INVOICES_IN_THREAD:
+                        decoded_invoice = await asyncio.to_thread(bolt11_decode, payment_request)
                     else:
-                        # Validate the invoice amount matches what we requested
                         decoded_invoice = bolt11_decode(payment_request)
-                        invoice_amount_msat = decoded_invoice.amount_msat
-                        
-                        # Allow small differences due to rounding
-                        if abs(invoice_amount_msat - amount_msat) > 1000:  # 1 sat tolerance
-                            raise ValueError(
-                                f"Invoice amount {invoice_amount_msat} msat doesn't match "
-                                f"requested amount {amount_msat} msat"
-                            )
-                    
-                    # Create payment request
-                    payment_data = TaprootPaymentRequest(
-                        payment_request=payment_request,
-                        asset_id=asset_id,
-                        fee_limit_sats=100  # Default fee limit for LNURL payments
-                    )
-                    
-                    # Process the payment using the regular payment service
-                    log_info(PAYMENT, f"Processing LNURL payment with asset_id={asset_id}, payment_request={payment_request[:50]}...")
-                    payment_response = await PaymentService.process_payment(
-                        data=payment_data,
-                        wallet=wallet_info
-                    )
-                    
-                    log_info(PAYMENT, f"Payment response: success={payment_response.success}, status={payment_response.status}, error={payment_response.error}")
-                    
-                    # Add LNURL success action to the response if available
-                    if payment_response.success and callback_data.get("successAction"):
-                        payment_response.lnurl_success_action = callback_data["successAction"]
-                        log_info(PAYMENT, f"Added success action: {callback_data.get('successAction')}")
-                    
-                    return payment_response
+                    invoice_amount_msat = decoded_invoice.amount_msat
                     
+                    # Allow small differences due to rounding
+                    if abs(invoice_amount_msat - amount_msat) > 1000:  # 1 sat tolerance
+                        raise ValueError(
+                            f"Invoice amount {invoice_amount_msat} msat doesn't match "
+                            f"requested amount {amount_msat} msat"
+                        )
+                
+                # Create payment request
+                payment_data = TaprootPaymentRequest(
+                    payment_request=payment_request,
+                    asset_id=asset_id,
+                    fee_limit_sats=100  # Default fee limit for LNURL payments
+                )
+                
+                # Process the payment using the regular payment service
+                log_info(PAYMENT, f"Processing LNURL payment with asset_id={asset_id}, payment_request={payment_request[:50]}...")
+                payment_response = await PaymentService.process_payment(
+                    data=payment_data,
+                    wallet=wallet_info
+                )
+                
+                log_info(PAYMENT, f"Payment response: success={payment_response.success}, status={payment_response.status}, error={payment_response.error}")
+                
+                # Add LNURL success action to the response if available
+                if payment_response.success and callback_data.get("successAction"):
+                    payment_response.lnurl_success_action = callback_data["successAction"]
+                    log_info(PAYMENT, f"Added success action: {callback_data.get('successAction')}")
+                
+                return payment_response
+                
             except Exception as e:
                 log_error(PAYMENT, f"Failed to pay LNURL: {str(e)}")
                 # Return a failed payment response
@@ -219,7 +432,7 @@ class LnurlService:
             lnurl_params = await cls.parse_lnurl(lnurl_string)
             
             # Log the full response for debugging
-            log_debug(API, f"LNURL params received: {lnurl_params}")
+            log_debug(API, "LNURL params received: {}", lnurl_params)
             
             result = {
                 "supports_assets": lnurl_params.get("acceptsAssets", False),
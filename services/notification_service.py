@@ -2,15 +2,63 @@
 Notification service for Taproot Assets extension.
 Centralizes WebSocket notification logic.
 """
+import asyncio
 import json
-from typing import Dict, Any, List, Optional, Union
+from dataclasses import asdict, is_dataclass
+from typing import Callable, Coroutine, Dict, Any, List, Optional, Set, Union
 from loguru import logger
 
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional
+    orjson = None
+
 from lnbits.core.services.websockets import websocket_manager
+from lnbits.utils.cache import cache
 from ..logging_utils import (
     log_debug, log_info, log_warning, log_error, 
     WEBSOCKET, ASSET
 )
+from ..models import InvoiceNotification
+from ..crud import get_asset_balances
+from ..crud.assets import get_assets
+
+
+# Constant message envelopes, so only the data is encoded per notification
+_INVOICE_PREFIX = '{"type":"invoice_update","data":'
+_PAYMENT_PREFIX = '{"type":"payment_update","data":'
+_ASSETS_PREFIX = '{"type":"assets_update","data":'
+_SUFFIX = '}'
+
+# WebSocket item_id prefixes for each notification channel
+_ITEM_ID_PREFIXES = {
+    "invoices": "taproot-assets-invoices-",
+    "payments": "taproot-assets-payments-",
+    "balances": "taproot-assets-balances-",
+}
+_INVOICES_ITEM_PREFIX = _ITEM_ID_PREFIXES["invoices"]
+_PAYMENTS_ITEM_PREFIX = _ITEM_ID_PREFIXES["payments"]
+_BALANCES_ITEM_PREFIX = _ITEM_ID_PREFIXES["balances"]
+
+
+def _encode_data(data: Any) -> str:
+    """
+    Encode WebSocket message data as JSON, using orjson when it is installed.
+    
+    orjson serializes dataclasses natively; the stdlib fallback converts
+    them with asdict first.
+    """
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS).decode()
+    if is_dataclass(data):
+        data = asdict(data)
+    return json.dumps(data, separators=(",", ":"))
+
+
+# Strong references to notifications sent in the background, so pending
+# tasks are not garbage collected before they complete
+_background_tasks: Set[asyncio.Task] = set()
+
 
 class NotificationService:
     """
@@ -18,14 +66,74 @@ class NotificationService:
     Centralizes notification logic and provides batch notification capabilities.
     """
     
+    # Cache expiry in seconds for the asset list used in transaction
+    # notifications, so bursts of payments share one lookup per user
+    ASSET_LIST_CACHE_EXPIRY = 2
+    
+    # Window in seconds in which assets updates for a user are coalesced
+    ASSETS_DEBOUNCE_SECONDS = 0.2
+    
+    # Pending debounced assets updates per user, as the send of the latest one
+    _assets_timers: Dict[str, asyncio.TimerHandle] = {}
+    _pending_assets: Dict[str, Callable[[], Coroutine[Any, Any, bool]]] = {}
+    
     @staticmethod
-    async def notify_invoice_update(user_id: str, invoice_data: Dict[str, Any]) -> bool:
+    def has_subscribers(user_id: str, channel: str = "invoices") -> bool:
+        """
+        Check whether a user has an open WebSocket for a notification channel.
+        
+        Lets callers skip building a notification payload nobody will receive.
+        
+        Args:
+            user_id: ID of the user to check
+            channel: Notification channel ("invoices", "payments" or "balances")
+            
+        Returns:
+            bool: True if at least one WebSocket is subscribed, False otherwise
+        """
+        connections = getattr(websocket_manager, "active_connections", None)
+        if connections is None:
+            # Unknown connection manager layout, assume someone may be listening
+            return True
+        
+        prefix = _ITEM_ID_PREFIXES.get(channel)
+        item_id = prefix + user_id if prefix else f"taproot-assets-{channel}-{user_id}"
+        return any(
+            getattr(connection, "path_params", {}).get("item_id") == item_id
+            for connection in connections
+        )
+    
+    @staticmethod
+    def send_in_background(notification: Coroutine[Any, Any, Any]) -> asyncio.Task:
+        """
+        Schedule a notification without waiting for it to be delivered.
+        
+        The notify_* methods (and other notification senders passed here) log
+        their own failures, so callers on a hot path can fire the notification
+        and return to their caller immediately.
+        
+        Args:
+            notification: The notification coroutine to run
+            
+        Returns:
+            asyncio.Task: The scheduled notification task
+        """
+        task = asyncio.create_task(notification)
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+        return task
+    
+    @staticmethod
+    async def notify_invoice_update(
+        user_id: str,
+        invoice_data: Union[Dict[str, Any], InvoiceNotification]
+    ) -> bool:
         """
         Send invoice update notification to a user.
         
         Args:
             user_id: ID of the user to notify
-            invoice_data: Invoice data to send
+            invoice_data: Invoice data to send, as a dict or an InvoiceNotification
             
         Returns:
             bool: True if notification was sent successfully, False otherwise
@@ -35,18 +143,20 @@ class NotificationService:
             return False
             
         try:
+            # Nothing to encode or send if the user has no open WebSocket
+            if not NotificationService.has_subscribers(user_id, "invoices"):
+                log_debug(WEBSOCKET, "No subscribers for invoice updates of user {}, skipping", user_id)
+                return True
+            
             # Create a unique item_id for this user and event type
-            item_id = f"taproot-assets-invoices-{user_id}"
+            item_id = _INVOICES_ITEM_PREFIX + user_id
             
-            # Prepare message with type and data
-            message = json.dumps({
-                "type": "invoice_update",
-                "data": invoice_data
-            })
+            # Wrap the encoded data in the prebuilt message envelope
+            message = _INVOICE_PREFIX + _encode_data(invoice_data) + _SUFFIX
             
             # Send directly through core WebSocket manager
             await websocket_manager.send_data(message, item_id)
-            log_debug(WEBSOCKET, f"Sent invoice update notification for user {user_id}")
+            log_debug(WEBSOCKET, "Sent invoice update notification for user {}", user_id)
             return True
         except Exception as e:
             log_error(WEBSOCKET, f"Error sending invoice update: {str(e)}")
@@ -69,18 +179,20 @@ class NotificationService:
             return False
             
         try:
+            # Nothing to encode or send if the user has no open WebSocket
+            if not NotificationService.has_subscribers(user_id, "payments"):
+                log_debug(WEBSOCKET, "No subscribers for payment updates of user {}, skipping", user_id)
+                return True
+            
             # Create a unique item_id for this user and event type
-            item_id = f"taproot-assets-payments-{user_id}"
+            item_id = _PAYMENTS_ITEM_PREFIX + user_id
             
-            # Prepare message with type and data
-            message = json.dumps({
-                "type": "payment_update",
-                "data": payment_data
-            })
+            # Wrap the encoded data in the prebuilt message envelope
+            message = _PAYMENT_PREFIX + _encode_data(payment_data) + _SUFFIX
             
             # Send directly through core WebSocket manager
             await websocket_manager.send_data(message, item_id)
-            log_debug(WEBSOCKET, f"Sent payment update notification for user {user_id}")
+            log_debug(WEBSOCKET, "Sent payment update notification for user {}", user_id)
             return True
         except Exception as e:
             log_error(WEBSOCKET, f"Error sending payment update: {str(e)}")
@@ -103,23 +215,87 @@ class NotificationService:
             return False
             
         try:
+            # Nothing to encode or send if the user has no open WebSocket
+            if not NotificationService.has_subscribers(user_id, "balances"):
+                log_debug(WEBSOCKET, "No subscribers for assets updates of user {}, skipping", user_id)
+                return True
+            
             # Create a unique item_id for this user and event type
-            item_id = f"taproot-assets-balances-{user_id}"
+            item_id = _BALANCES_ITEM_PREFIX + user_id
             
-            # Prepare message with type and data
-            message = json.dumps({
-                "type": "assets_update",
-                "data": assets_data
-            })
+            # Wrap the encoded data in the prebuilt message envelope
+            message = _ASSETS_PREFIX + _encode_data(assets_data) + _SUFFIX
             
             # Send directly through core WebSocket manager
             await websocket_manager.send_data(message, item_id)
-            log_debug(WEBSOCKET, f"Sent assets update notification for user {user_id}")
+            log_debug(WEBSOCKET, "Sent assets update notification for user {}", user_id)
             return True
         except Exception as e:
             log_error(WEBSOCKET, f"Error sending assets update: {str(e)}")
             return False
     
+    @classmethod
+    async def notify_assets_update_debounced(
+        cls,
+        user_id: str,
+        assets_data: List[Dict[str, Any]]
+    ) -> bool:
+        """
+        Schedule an assets update notification, coalescing rapid updates.
+        
+        Updates for the same user within ASSETS_DEBOUNCE_SECONDS of each other
+        replace one another, so only the latest assets are sent once the
+        window passes.
+        
+        Args:
+            user_id: ID of the user to notify
+            assets_data: List of asset data to send
+            
+        Returns:
+            bool: True if the notification was scheduled, False otherwise
+        """
+        if not user_id or not assets_data:
+            log_warning(WEBSOCKET, "Cannot send assets notification with empty user_id or data")
+            return False
+        
+        return cls._debounce_assets_update(
+            user_id, lambda: cls.notify_assets_update(user_id, assets_data)
+        )
+    
+    @classmethod
+    def _debounce_assets_update(
+        cls,
+        user_id: str,
+        send: Callable[[], Coroutine[Any, Any, bool]]
+    ) -> bool:
+        """
+        Schedule the assets update of a user, replacing any pending one.
+        
+        Each update restarts the user's ASSETS_DEBOUNCE_SECONDS window, and
+        only the latest update is sent once the window passes.
+        
+        Args:
+            user_id: ID of the user to notify
+            send: Function creating the coroutine that sends the update
+            
+        Returns:
+            bool: True once the update is scheduled
+        """
+        cls._pending_assets[user_id] = send
+        timer = cls._assets_timers.get(user_id)
+        if timer is not None:
+            timer.cancel()
+        
+        def send_latest() -> None:
+            cls._assets_timers.pop(user_id, None)
+            latest = cls._pending_assets.pop(user_id, None)
+            if latest is not None:
+                cls.send_in_background(latest())
+        
+        loop = asyncio.get_running_loop()
+        cls._assets_timers[user_id] = loop.call_later(cls.ASSETS_DEBOUNCE_SECONDS, send_latest)
+        return True
+    
     @staticmethod
     async def notify_batch_updates(
         user_id: str, 
@@ -132,6 +308,7 @@ class NotificationService:
             user_id: ID of the user to notify
             updates: Dictionary mapping update types to their data
                      Supported types: "invoice", "payment", "assets"
+                     (assets updates are debounced per user)
                      
         Returns:
             Dict mapping update types to success status
@@ -144,26 +321,31 @@ class NotificationService:
         
         log_info(WEBSOCKET, f"Sending batch notifications to user {user_id}: {', '.join(updates.keys())}")
         
-        # Process each update type
+        # Collect the notification for each update type without awaiting,
+        # so the sends for different channels don't block each other
+        pending_types = []
+        pending = []
         for update_type, data in updates.items():
             if not data:
                 log_warning(WEBSOCKET, f"Empty data for {update_type} notification")
                 results[update_type] = False
                 continue
                 
-            try:
-                if update_type == "invoice" and isinstance(data, dict):
-                    results[update_type] = await NotificationService.notify_invoice_update(user_id, data)
-                elif update_type == "payment" and isinstance(data, dict):
-                    results[update_type] = await NotificationService.notify_payment_update(user_id, data)
-                elif update_type == "assets" and isinstance(data, list):
-                    results[update_type] = await NotificationService.notify_assets_update(user_id, data)
-                else:
-                    log_warning(WEBSOCKET, f"Unknown notification type: {update_type}")
-                    results[update_type] = False
-            except Exception as e:
-                log_error(WEBSOCKET, f"Error sending {update_type} notification: {str(e)}")
+            entry = _DISPATCH.get(update_type)
+            if entry is None or not isinstance(data, entry[0]):
+                log_warning(WEBSOCKET, f"Unknown notification type: {update_type}")
+                results[update_type] = False
+                continue
+            pending.append(entry[1](user_id, data))
+            pending_types.append(update_type)
+        
+        sent = await asyncio.gather(*pending, return_exceptions=True)
+        for update_type, result in zip(pending_types, sent):
+            if isinstance(result, Exception):
+                log_error(WEBSOCKET, f"Error sending {update_type} notification: {str(result)}")
                 results[update_type] = False
+            else:
+                results[update_type] = result
         
         return results
     
@@ -182,7 +364,9 @@ class NotificationService:
     ) -> Dict[str, bool]:
         """
         Send all notifications related to a completed transaction.
-        This includes payment notification and assets update.
+        This includes payment notification and assets update; the assets
+        update is debounced per user like notify_assets_update_debounced, so
+        a burst of transactions shares a single refresh.
         
         Args:
             user_id: ID of the user to notify
@@ -199,9 +383,6 @@ class NotificationService:
         Returns:
             Dict mapping update types to success status
         """
-        from ..tapd.taproot_wallet import TaprootWalletExtension
-        from ..crud import get_asset_balance
-        
         log_info(WEBSOCKET, f"Preparing transaction complete notifications for user {user_id}")
         
         updates = {}
@@ -221,31 +402,68 @@ class NotificationService:
         # Add payment notification
         updates["payment"] = payment_data
         
-        # Get updated assets for notification
-        try:
-            # Get assets directly from the database instead of using the wallet
-            from ..crud.assets import get_assets
-            
-            log_debug(ASSET, f"Fetching assets for user {user_id} for notification")
+        # Send the payment notification now, the assets are fetched and sent
+        # once the user's debounce window closes
+        results = await NotificationService.notify_batch_updates(user_id, updates)
+        results["assets"] = NotificationService._debounce_assets_update(
+            user_id, lambda: NotificationService._send_assets_refresh(user_id, wallet_id)
+        )
+        return results
+    
+    @staticmethod
+    async def _send_assets_refresh(user_id: str, wallet_id: str) -> bool:
+        """
+        Fetch a user's channel assets with the wallet's balances and send them.
+        
+        Args:
+            user_id: ID of the user to notify
+            wallet_id: ID of the wallet whose balances are included
             
-            # Get assets for this user
-            assets = await get_assets(user_id)
+        Returns:
+            bool: True if the notification was sent (or nobody listens), False otherwise
+        """
+        # Skip the lookups entirely if nobody would receive the update
+        if not NotificationService.has_subscribers(user_id, "balances"):
+            log_debug(WEBSOCKET, "No subscribers for assets updates of user {}, skipping", user_id)
+            return True
+        
+        try:
+            log_debug(ASSET, "Fetching assets for user {} for notification", user_id)
             
-            # Filter to only include assets with channel info
-            filtered_assets = [asset for asset in assets if asset.get("channel_info")]
+            # Get assets for this user directly from the database, shared briefly across notifications
+            cache_key = f"taproot:notification:assets:{user_id}"
+            assets = cache.get(cache_key)
+            if assets is None:
+                assets = await get_assets(user_id)
+                cache.set(cache_key, assets, expiry=NotificationService.ASSET_LIST_CACHE_EXPIRY)
             
-            # Add user balance information
-            for asset in filtered_assets:
-                asset_id_check = asset.get("asset_id")
-                if asset_id_check:
-                    balance = await get_asset_balance(wallet_id, asset_id_check)
-                    asset["user_balance"] = balance.balance if balance else 0
+            # Keep only assets with channel info, collecting their IDs in the same pass.
+            # Entries are copied so adding balances doesn't touch the cached list.
+            filtered_assets = [
+                dict(asset) for asset in assets
+                if asset.get("channel_info") and asset.get("asset_id")
+            ]
+            ids = [asset["asset_id"] for asset in filtered_assets]
             
-            if filtered_assets:
-                log_debug(ASSET, f"Including {len(filtered_assets)} assets in notification")
-                updates["assets"] = filtered_assets
+            # Add user balance information with one query for all assets
+            balances = await get_asset_balances(wallet_id, ids)
+            get_balance = balances.get
+            for asset_id, asset in zip(ids, filtered_assets):
+                asset["user_balance"] = get_balance(asset_id, 0)
         except Exception as e:
             log_error(ASSET, f"Failed to fetch assets for notification: {str(e)}")
+            return False
+        
+        if not filtered_assets:
+            return True
         
-        # Send all notifications in one batch
-        return await NotificationService.notify_batch_updates(user_id, updates)
+        log_debug(ASSET, "Including {} assets in notification", len(filtered_assets))
+        return await NotificationService.notify_assets_update(user_id, filtered_assets)
+
+
+# Batch update types mapped to their expected data type and notifier
+_DISPATCH = {
+    "invoice": (dict, NotificationService.notify_invoice_update),
+    "payment": (dict, NotificationService.notify_payment_update),
+    "assets": (list, NotificationService.notify_assets_update_debounced),
+}
@@ -6,34 +6,56 @@ from typing import Dict, Any, Optional, List, Tuple, Union
 import re
 import grpc
 import asyncio
+import functools
 from http import HTTPStatus
 from fastapi import HTTPException
 from loguru import logger
 import bolt11
 
 from lnbits.core.models import WalletTypeInfo
+from lnbits.utils.cache import cache
 
-from ..models import TaprootPaymentRequest, PaymentResponse, ParsedInvoice, TaprootPayment
+from ..models import TaprootPaymentRequest, PaymentResponse, ParsedInvoice, TaprootPayment, TaprootInvoice, DecodedInvoice
 from ..logging_utils import log_debug, log_info, log_warning, log_error, PAYMENT, API
 from ..tapd.taproot_factory import TaprootAssetsFactory
+from ..tapd.taproot_wallet import TaprootWalletExtension
 from ..error_utils import raise_http_exception, ErrorContext, handle_error
 from ..tapd.taproot_adapter import lightning_pb2
 # Import from crud re-exports
 from ..crud import (
-    get_invoice_by_payment_hash,
-    is_internal_payment,
-    is_self_payment,
-    get_user_payments
+    load_invoice_by_payment_hash,
+    get_user_payments_paginated
 )
 from .settlement_service import SettlementService
 
 
+@functools.lru_cache(maxsize=1024)
+def _decode_bolt11_cached(payment_request: str) -> DecodedInvoice:
+    """
+    Decode a BOLT11 payment request, memoized per payment request.
+    
+    Every caller gets the same cached result, so only an immutable
+    projection of the fields the payment flow uses is kept.
+    """
+    decoded = bolt11.decode(payment_request)
+    return DecodedInvoice(
+        payment_hash=decoded.payment_hash,
+        description=decoded.description if hasattr(decoded, "description") else "",
+        expiry=decoded.expiry if hasattr(decoded, "expiry") else 3600,
+        date=decoded.date
+    )
+
+
 class PaymentService:
     """
     Service for handling Taproot Asset payments.
     This service encapsulates all payment-related business logic.
     """
     
+    # Cache expiry for the asset ID used to decode invoice amounts (in seconds)
+    DECODE_ASSET_ID_CACHE_EXPIRY = 60
+    DECODE_ASSET_ID_CACHE_KEY = "taproot:payment:decode_asset_id"
+    
     @classmethod
     async def process_payment(
         cls,
@@ -54,32 +76,49 @@ class PaymentService:
         Returns:
             PaymentResponse: The payment result
         """
+        # Bound up front so the failure response can report what was parsed
+        decoded: Optional[DecodedInvoice] = None
+        parsed_invoice: Optional[ParsedInvoice] = None
         try:
             with ErrorContext("process_payment", PAYMENT):
                 # RFQ Debug: Generate session ID for tracking
                 import hashlib
                 import time
                 rfq_session_id = hashlib.sha256(f"{data.payment_request}{time.time()}".encode()).hexdigest()[:16]
-                log_info(PAYMENT, f"RFQ_DEBUG: Session {rfq_session_id} - Starting payment process")
-                log_info(PAYMENT, f"RFQ_DEBUG: Session {rfq_session_id} - Asset ID: {data.asset_id}")
-                log_info(PAYMENT, f"RFQ_DEBUG: Session {rfq_session_id} - Fee limit: {data.fee_limit_sats}")
+                log_info(PAYMENT, "RFQ_DEBUG: Session {} - Starting payment process", rfq_session_id)
+                log_info(PAYMENT, "RFQ_DEBUG: Session {} - Asset ID: {}", rfq_session_id, data.asset_id)
+                log_info(PAYMENT, "RFQ_DEBUG: Session {} - Fee limit: {}", rfq_session_id, data.fee_limit_sats)
                 
-                # Parse the invoice to get payment details
-                parsed_invoice = await cls.parse_invoice(data.payment_request)
-                log_info(PAYMENT, f"RFQ_DEBUG: Session {rfq_session_id} - Invoice amount: {parsed_invoice.amount}")
-                log_info(PAYMENT, f"RFQ_DEBUG: Session {rfq_session_id} - Payment hash: {parsed_invoice.payment_hash}")
-                
-                # Determine the payment type if not forced
-                if force_payment_type:
-                    payment_type = force_payment_type
-                    log_info(PAYMENT, f"Using forced payment type: {payment_type}")
-                else:
-                    payment_type = await cls.determine_payment_type(
-                        parsed_invoice.payment_hash, wallet.wallet.user
+                # Decode the invoice locally for the payment hash, then decode the
+                # asset amount through tapd while the payment type is determined
+                # and the wallet is set up
+                with ErrorContext("parse_invoice", API):
+                    decoded = cls.parse_invoice_local(data.payment_request)
+                    invoice = None
+                    wallet_setup = TaprootAssetsFactory.create_wallet(
+                        user_id=wallet.wallet.user,
+                        wallet_id=wallet.wallet.id
                     )
-                    log_info(PAYMENT, f"Payment type determined: {payment_type}")
+                    if force_payment_type:
+                        payment_type = force_payment_type
+                        log_info(PAYMENT, "Using forced payment type: {}", payment_type)
+                        (asset_amount, decoded_asset_id), taproot_wallet = await asyncio.gather(
+                            cls.parse_invoice_remote(data.payment_request),
+                            wallet_setup
+                        )
+                    else:
+                        (asset_amount, decoded_asset_id), (payment_type, invoice), taproot_wallet = await asyncio.gather(
+                            cls.parse_invoice_remote(data.payment_request),
+                            cls.resolve_payment_type(decoded.payment_hash, wallet.wallet.user),
+                            wallet_setup
+                        )
+                        log_info(PAYMENT, "Payment type determined: {}", payment_type)
+                    parsed_invoice = cls._build_parsed_invoice(decoded, asset_amount, decoded_asset_id)
+                
+                log_info(PAYMENT, "RFQ_DEBUG: Session {} - Invoice amount: {}", rfq_session_id, parsed_invoice.amount)
+                log_info(PAYMENT, "RFQ_DEBUG: Session {} - Payment hash: {}", rfq_session_id, parsed_invoice.payment_hash)
                 
-                log_info(PAYMENT, f"RFQ_DEBUG: Session {rfq_session_id} - Payment type: {payment_type}")
+                log_info(PAYMENT, "RFQ_DEBUG: Session {} - Payment type: {}", rfq_session_id, payment_type)
                 
                 # Reject self-payments
                 if payment_type == "self":
@@ -95,26 +134,30 @@ class PaymentService:
                 
                 # Process based on payment type
                 if payment_type == "internal":
-                    return await cls._process_internal_payment(data, wallet, parsed_invoice)
+                    return await cls._process_internal_payment(
+                        data, wallet, parsed_invoice,
+                        prefetched_invoice=invoice,
+                        taproot_wallet=taproot_wallet
+                    )
                 else:
-                    return await cls._process_external_payment(data, wallet, parsed_invoice)
+                    return await cls._process_external_payment(
+                        data, wallet, parsed_invoice, taproot_wallet=taproot_wallet
+                    )
         except Exception as e:
             # Handle any exceptions and return a failed payment response
             error_message = str(e)
             log_error(PAYMENT, f"Payment failed with error: {error_message}")
             
-            # Try to extract payment hash from the parsed invoice if available
+            # Use the parsed invoice details if we got that far
             payment_hash = ""
             asset_amount = 0
             asset_id = ""
-            try:
-                # If we've parsed the invoice, use its details
-                if 'parsed_invoice' in locals():
-                    payment_hash = parsed_invoice.payment_hash
-                    asset_amount = parsed_invoice.amount
-                    asset_id = parsed_invoice.asset_id or ""
-            except Exception:
-                pass
+            if parsed_invoice is not None:
+                payment_hash = parsed_invoice.payment_hash
+                asset_amount = parsed_invoice.amount
+                asset_id = parsed_invoice.asset_id or ""
+            elif decoded is not None:
+                payment_hash = decoded.payment_hash
             
             # Return a failed payment response
             return PaymentResponse(
@@ -131,7 +174,9 @@ class PaymentService:
         cls,
         data: TaprootPaymentRequest,
         wallet: WalletTypeInfo,
-        parsed_invoice: ParsedInvoice
+        parsed_invoice: ParsedInvoice,
+        prefetched_invoice: Optional[TaprootInvoice] = None,
+        taproot_wallet: Optional[TaprootWalletExtension] = None
     ) -> PaymentResponse:
         """
         Process an internal payment (between users on the same node).
@@ -140,13 +185,16 @@ class PaymentService:
             data: The payment request data
             wallet: The wallet information
             parsed_invoice: The parsed invoice data
+            prefetched_invoice: The local invoice, if already fetched while
+                                determining the payment type
+            taproot_wallet: The wallet instance, if already set up
             
         Returns:
             PaymentResponse: The payment result
         """
         with ErrorContext("process_internal_payment", PAYMENT):
-            # Get the invoice to retrieve asset_id
-            invoice = await get_invoice_by_payment_hash(parsed_invoice.payment_hash)
+            # Get the invoice to retrieve asset_id, unless we already have it
+            invoice = prefetched_invoice or await load_invoice_by_payment_hash(parsed_invoice.payment_hash)
             if not invoice:
                 log_error(PAYMENT, f"Invoice not found for payment hash: {parsed_invoice.payment_hash}")
                 return PaymentResponse(
@@ -158,14 +206,14 @@ class PaymentService:
                     asset_id=parsed_invoice.asset_id or ""
                 )
                 
-            # Initialize wallet using the factory
-            taproot_wallet = await TaprootAssetsFactory.create_wallet(
+            # Initialize wallet using the factory, unless we already have it
+            taproot_wallet = taproot_wallet or await TaprootAssetsFactory.create_wallet(
                 user_id=wallet.wallet.user,
                 wallet_id=wallet.wallet.id
             )
             
             # Check if this is a self-payment
-            is_self = await is_self_payment(parsed_invoice.payment_hash, wallet.wallet.user)
+            is_self = invoice.user_id == wallet.wallet.user
             
             # Create sender information dictionary
             sender_info = {
@@ -234,7 +282,8 @@ class PaymentService:
         cls,
         data: TaprootPaymentRequest,
         wallet: WalletTypeInfo,
-        parsed_invoice: ParsedInvoice
+        parsed_invoice: ParsedInvoice,
+        taproot_wallet: Optional[TaprootWalletExtension] = None
     ) -> PaymentResponse:
         """
         Process an external payment (to a different node).
@@ -243,13 +292,14 @@ class PaymentService:
             data: The payment request data
             wallet: The wallet information
             parsed_invoice: The parsed invoice data
+            taproot_wallet: The wallet instance, if already set up
             
         Returns:
             PaymentResponse: The payment result
         """
         with ErrorContext("process_external_payment", PAYMENT):
-            # Initialize wallet using the factory
-            taproot_wallet = await TaprootAssetsFactory.create_wallet(
+            # Initialize wallet using the factory, unless we already have it
+            taproot_wallet = taproot_wallet or await TaprootAssetsFactory.create_wallet(
                 user_id=wallet.wallet.user,
                 wallet_id=wallet.wallet.id
             )
@@ -260,10 +310,10 @@ class PaymentService:
             
             # Determine which asset ID to use
             if data.asset_id:
-                log_info(PAYMENT, f"Using client-provided asset_id={data.asset_id}")
+                log_info(PAYMENT, "Using client-provided asset_id={}", data.asset_id)
                 asset_id_to_use = data.asset_id
             elif parsed_invoice.asset_id:
-                log_info(PAYMENT, f"Using invoice asset_id={parsed_invoice.asset_id}")
+                log_info(PAYMENT, "Using invoice asset_id={}", parsed_invoice.asset_id)
                 asset_id_to_use = parsed_invoice.asset_id
             else:
                 log_debug(PAYMENT, "No asset ID available from client or invoice")
@@ -275,32 +325,33 @@ class PaymentService:
                 from ..tapd.taproot_adapter import lightning_pb2_grpc
                 ln_stub = lightning_pb2_grpc.LightningStub(taproot_wallet.node.channel)
                 channels_before = await ln_stub.ListChannels(lightning_pb2.ListChannelsRequest())
-                log_info(PAYMENT, f"RFQ_DEBUG: Channels before payment: {len(channels_before.channels)} channels")
+                log_info(PAYMENT, "RFQ_DEBUG: Channels before payment: {} channels", len(channels_before.channels))
                 for ch in channels_before.channels:
                     if ch.active:
-                        log_info(PAYMENT, f"RFQ_DEBUG: Channel {ch.channel_point[:30]}... - Local: {ch.local_balance}, Remote: {ch.remote_balance}")
+                        log_info(PAYMENT, "RFQ_DEBUG: Channel {}... - Local: {}, Remote: {}", ch.channel_point[:30], ch.local_balance, ch.remote_balance)
             except Exception as e:
                 log_warning(PAYMENT, f"RFQ_DEBUG: Could not get channel state before: {e}")
             
             # Make the payment using the low-level wallet method
             # This only handles the direct node communication
-            log_info(PAYMENT, f"Making external payment, fee_limit_sats={fee_limit_sats}, invoice_amount={parsed_invoice.amount}")
+            log_info(PAYMENT, "Making external payment, fee_limit_sats={}, invoice_amount={}", fee_limit_sats, parsed_invoice.amount)
             payment_result = await taproot_wallet.send_raw_payment(
                 payment_request=data.payment_request,
                 fee_limit_sats=fee_limit_sats,
                 asset_id=asset_id_to_use,
-                peer_pubkey=data.peer_pubkey
+                peer_pubkey=data.peer_pubkey,
+                payment_hash=parsed_invoice.payment_hash
             )
             
-            log_info(PAYMENT, f"Raw payment result: {payment_result}")
+            log_info(PAYMENT, "Raw payment result: {}", payment_result)
             
             # RFQ Debug: Get channel state after payment
             try:
                 channels_after = await ln_stub.ListChannels(lightning_pb2.ListChannelsRequest())
-                log_info(PAYMENT, f"RFQ_DEBUG: Channels after payment: {len(channels_after.channels)} channels")
+                log_info(PAYMENT, "RFQ_DEBUG: Channels after payment: {} channels", len(channels_after.channels))
                 for ch in channels_after.channels:
                     if ch.active:
-                        log_info(PAYMENT, f"RFQ_DEBUG: Channel {ch.channel_point[:30]}... - Local: {ch.local_balance}, Remote: {ch.remote_balance}")
+                        log_info(PAYMENT, "RFQ_DEBUG: Channel {}... - Local: {}, Remote: {}", ch.channel_point[:30], ch.local_balance, ch.remote_balance)
             except Exception as e:
                 log_warning(PAYMENT, f"RFQ_DEBUG: Could not get channel state after: {e}")
 
@@ -322,18 +373,18 @@ class PaymentService:
             preimage = payment_result.get("payment_preimage", "")
             routing_fees_sats = payment_result.get("fee_sats", 0)
             
-            log_info(PAYMENT, f"Payment details: hash={payment_hash}, preimage={preimage}, fee={routing_fees_sats}")
+            log_info(PAYMENT, "Payment details: hash={}, preimage={}, fee={}", payment_hash, preimage, routing_fees_sats)
             
             # Use the client-provided asset_id for recording the payment
             asset_id = data.asset_id if data.asset_id else ""
-            log_info(PAYMENT, f"Using asset_id={asset_id} for recording payment")
+            log_info(PAYMENT, "Using asset_id={} for recording payment", asset_id)
             
             # Extract description from the parsed invoice
             description = parsed_invoice.description if parsed_invoice.description else None
             
             # Use the unified process_payment_settlement method
             
-            log_info(PAYMENT, f"Processing settlement: amount={parsed_invoice.amount}, asset_id={asset_id}")
+            log_info(PAYMENT, "Processing settlement: amount={}, asset_id={}", parsed_invoice.amount, asset_id)
             
             success, settlement_result = await SettlementService.process_payment_settlement(
                 payment_hash=payment_hash,
@@ -349,7 +400,7 @@ class PaymentService:
                 is_self_payment=False
             )
             
-            log_info(PAYMENT, f"Settlement result: success={success}, result={settlement_result}")
+            log_info(PAYMENT, "Settlement result: success={}, result={}", success, settlement_result)
             
             if not success:
                 log_warning(PAYMENT, f"Payment was successful but failed to record in database: {settlement_result}")
@@ -367,8 +418,8 @@ class PaymentService:
                 description=description
             )
     
-    @staticmethod
-    async def parse_invoice(payment_request: str) -> ParsedInvoice:
+    @classmethod
+    async def parse_invoice(cls, payment_request: str) -> ParsedInvoice:
         """
         Parse a BOLT11 payment request to extract invoice details.
         
@@ -386,71 +437,147 @@ class PaymentService:
             Exception: If the invoice format is invalid or the asset amount cannot be determined
         """
         with ErrorContext("parse_invoice", API):
-            # Use the bolt11 library to decode the invoice
-            decoded = bolt11.decode(payment_request)
+            decoded = cls.parse_invoice_local(payment_request)
+            asset_amount, asset_id = await cls.parse_invoice_remote(payment_request)
+            return cls._build_parsed_invoice(decoded, asset_amount, asset_id)
+    
+    @staticmethod
+    def parse_invoice_local(payment_request: str) -> DecodedInvoice:
+        """
+        Decode a BOLT11 payment request locally, without contacting tapd.
+        
+        Gives the payment hash, description and expiry, which is enough to
+        start work that doesn't depend on the asset amount. Decoding is
+        memoized, since the same invoice is usually parsed for display
+        right before it is paid.
+        
+        Args:
+            payment_request: BOLT11 payment request to decode
+            
+        Returns:
+            DecodedInvoice: The decoded invoice fields
+        """
+        return _decode_bolt11_cached(payment_request)
+    
+    @classmethod
+    async def _get_decode_asset_id(cls) -> Optional[str]:
+        """
+        Get the asset ID used to decode invoice amounts through tapd.
+        
+        Any asset can decode an invoice, so the first available one is used
+        and cached briefly instead of listing assets on every payment.
+        
+        Returns:
+            Optional[str]: The asset ID, or None if no asset is available
+            
+        Raises:
+            Exception: If no assets are available or the first one has no asset_id
+        """
+        asset_id = cache.get(cls.DECODE_ASSET_ID_CACHE_KEY)
+        if asset_id:
+            return asset_id
+        
+        # Get raw assets from AssetService
+        from .asset_service import AssetService
+        assets = await AssetService.get_raw_assets()
+        log_info(API, "Found {} available assets", len(assets))
+        
+        # Use the first available asset for decoding
+        if not assets:
+            raise Exception("No assets available for decoding invoice")
+        asset_id = assets[0].get("asset_id")
+        if not asset_id:
+            raise Exception("First asset has no asset_id")
+        
+        cache.set(cls.DECODE_ASSET_ID_CACHE_KEY, asset_id, expiry=cls.DECODE_ASSET_ID_CACHE_EXPIRY)
+        return asset_id
+    
+    @classmethod
+    async def parse_invoice_remote(cls, payment_request: str) -> Tuple[float, Optional[str]]:
+        """
+        Decode the asset amount of a payment request through tapd.
+        
+        Args:
+            payment_request: BOLT11 payment request to decode
             
-            # Extract the description and initialize variables
-            description = decoded.description if hasattr(decoded, "description") else ""
-            asset_id = None
-            asset_amount = None
+        Returns:
+            Tuple of the asset amount and the asset ID used for decoding
             
+        Raises:
+            Exception: If the asset amount cannot be determined
+        """
+        asset_id = None
+        asset_amount = None
+        
+        try:
+            asset_id_to_try = await cls._get_decode_asset_id()
+            log_info(API, "Using first available asset_id: {} for decoding", asset_id_to_try)
+            
+            # Import the parser client
+            from ..tapd.taproot_parser import TaprootParserClient
+            
+            # Get the singleton parser client instance
+            parser_client = TaprootParserClient.get_instance()
+            
+            # Decode the payment request using the parser client
             try:
-                # Get raw assets from AssetService
-                from .asset_service import AssetService
-                assets = await AssetService.get_raw_assets()
-                log_info(API, f"Found {len(assets)} available assets")
-                
-                # Use the first available asset for decoding
-                if assets and len(assets) > 0:
-                    asset_id_to_try = assets[0].get("asset_id")
-                    if asset_id_to_try:
-                        log_info(API, f"Using first available asset_id: {asset_id_to_try} for decoding")
-                        
-                        # Import the parser client
-                        from ..tapd.taproot_parser import TaprootParserClient
-                        
-                        # Get the singleton parser client instance
-                        parser_client = TaprootParserClient.get_instance()
-                        
-                        # Decode the payment request using the parser client
-                        decoded_result = await parser_client.decode_asset_pay_req(
-                            asset_id=asset_id_to_try,
-                            payment_request=payment_request
-                        )
-                        
-                        # Extract the asset amount
-                        if 'asset_amount' in decoded_result:
-                            asset_amount = float(decoded_result['asset_amount'])
-                            asset_id = asset_id_to_try  # Note: This is just for reference, actual payment will use client-provided asset_id
-                            log_info(API, f"Extracted invoice amount={asset_amount} using first available asset")
-                        else:
-                            raise Exception("Response does not contain asset_amount")
-                    else:
-                        raise Exception("First asset has no asset_id")
-                else:
-                    raise Exception("No assets available for decoding invoice")
-            except Exception as e:
-                log_warning(API, f"Failed to get assets or try them: {str(e)}")
-            
-            # If we couldn't extract the amount, raise an error
-            if asset_amount is None:
-                error_msg = "Could not extract asset amount from invoice"
-                log_error(API, error_msg)
-                raise Exception(error_msg)
-            
-            # Create and return the parsed invoice
-            return ParsedInvoice(
-                payment_hash=decoded.payment_hash,
-                amount=asset_amount,
-                description=description,
-                expiry=decoded.expiry if hasattr(decoded, "expiry") else 3600,
-                timestamp=decoded.date,
-                valid=True,
-                asset_id=asset_id
-            )
+                decoded_result = await parser_client.decode_asset_pay_req(
+                    asset_id=asset_id_to_try,
+                    payment_request=payment_request
+                )
+            except Exception:
+                # The cached asset may no longer exist, pick again next time
+                cache.pop(cls.DECODE_ASSET_ID_CACHE_KEY)
+                raise
+            
+            # Extract the asset amount
+            if 'asset_amount' in decoded_result:
+                asset_amount = float(decoded_result['asset_amount'])
+                asset_id = asset_id_to_try  # Note: This is just for reference, actual payment will use client-provided asset_id
+                log_info(API, "Extracted invoice amount={} using first available asset", asset_amount)
+            else:
+                raise Exception("Response does not contain asset_amount")
+        except Exception as e:
+            log_warning(API, f"Failed to get assets or try them: {str(e)}")
+        
+        # If we couldn't extract the amount, raise an error
+        if asset_amount is None:
+            error_msg = "Could not extract asset amount from invoice"
+            log_error(API, error_msg)
+            raise Exception(error_msg)
+        
+        return asset_amount, asset_id
     
     @staticmethod
+    def _build_parsed_invoice(
+        decoded: DecodedInvoice,
+        asset_amount: float,
+        asset_id: Optional[str]
+    ) -> ParsedInvoice:
+        """
+        Merge a locally decoded invoice with its remotely decoded asset amount.
+        
+        Args:
+            decoded: The locally decoded BOLT11 invoice
+            asset_amount: The asset amount decoded by tapd
+            asset_id: The asset ID used for decoding
+            
+        Returns:
+            ParsedInvoice: Parsed invoice data with amount
+        """
+        return ParsedInvoice(
+            payment_hash=decoded.payment_hash,
+            amount=asset_amount,
+            description=decoded.description,
+            expiry=decoded.expiry,
+            timestamp=decoded.date,
+            valid=True,
+            asset_id=asset_id
+        )
+    
+    @classmethod
     async def determine_payment_type(
+        cls,
         payment_hash: str, 
         user_id: str
     ) -> str:
@@ -464,33 +591,61 @@ class PaymentService:
         Returns:
             str: Payment type - "external", "internal", or "self"
         """
-        # Check if this is an internal payment
-        is_internal_pay = await is_internal_payment(payment_hash)
+        payment_type, _ = await cls.resolve_payment_type(payment_hash, user_id)
+        return payment_type
+    
+    @staticmethod
+    async def resolve_payment_type(
+        payment_hash: str,
+        user_id: str
+    ) -> Tuple[str, Optional[TaprootInvoice]]:
+        """
+        Determine the payment type and fetch the local invoice in one lookup.
         
-        if is_internal_pay:
-            # Check if this is a self-payment
-            is_self_pay = await is_self_payment(payment_hash, user_id)
-            return "self" if is_self_pay else "internal"
+        Args:
+            payment_hash: The payment hash to check
+            user_id: The current user's ID
+            
+        Returns:
+            Tuple containing:
+            - payment_type (str): "external", "internal", or "self"
+            - invoice (Optional[TaprootInvoice]): The local invoice, None for external payments
+        """
+        # An invoice owned by any local user makes this an internal payment,
+        # and a self-payment if that user is the payer
+        invoice = await load_invoice_by_payment_hash(payment_hash)
+        
+        if invoice is None:
+            return "external", None
         
-        return "external"
+        return ("self" if invoice.user_id == user_id else "internal"), invoice
     
     @staticmethod
-    async def get_user_payments(user_id: str) -> List[TaprootPayment]:
+    async def get_user_payments(
+        user_id: str,
+        limit: int = 100,
+        cursor: Optional[str] = None
+    ) -> Tuple[List[TaprootPayment], Optional[str]]:
         """
-        Get all Taproot Asset payments for a user.
+        Get a page of Taproot Asset payments for a user, newest first.
         
         Args:
             user_id: The user ID
+            limit: Maximum number of payments to return
+            cursor: ID of the last payment of the previous page, None for the first page
             
         Returns:
-            List[TaprootPayment]: List of payments
+            Tuple containing:
+            - payments (List[TaprootPayment]): The page of payments
+            - next_cursor (Optional[str]): Cursor for the next page, None if this is the last page
             
         Raises:
-            HTTPException: If there's an error retrieving payments
+            HTTPException: If the cursor is unknown or there's an error retrieving payments
         """
         try:
-            payments = await get_user_payments(user_id)
-            return payments
+            return await get_user_payments_paginated(user_id, limit, cursor)
+        except ValueError as e:
+            raise_http_exception(status_code=HTTPStatus.BAD_REQUEST, detail=str(e))
         except Exception as e:
             log_error(PAYMENT, f"Error retrieving payments: {str(e)}")
             raise_http_exception(
@@ -0,0 +1,284 @@
+"""
+Rate service for Taproot Assets extension.
+Handles RFQ rate quotes for assets.
+"""
+from typing import Dict, Any, Optional, Tuple
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+import asyncio
+import functools
+import time
+
+from lnbits.core.models import WalletTypeInfo
+
+from ..tapd.taproot_factory import TaprootAssetsFactory
+from ..tapd.taproot_adapter import rfq_pb2, rfq_pb2_grpc
+from ..logging_utils import log_debug, log_info, log_warning, API
+from .asset_service import AssetService
+
+
+@functools.lru_cache(maxsize=1024)
+def _hex_to_bytes(value: str) -> bytes:
+    """Decode a hex asset ID or pubkey to bytes, memoized per value."""
+    return bytes.fromhex(value)
+
+
+def _quantize(amount: int) -> int:
+    """Round an amount down to a power of two, so nearby amounts share a quote."""
+    return 1 << (amount.bit_length() - 1) if amount > 0 else 0
+
+
+class RateService:
+    """
+    Service for getting RFQ rates for Taproot Assets.
+    
+    Quotes are cached briefly per asset and power-of-two amount bucket, and
+    concurrent requests for the same quote share a single RFQ instead of each
+    asking the peer.
+    """
+    
+    # Cache expiry for accepted quotes (in seconds), well within the quote expiry
+    RATE_CACHE_EXPIRY = 30
+    
+    # Maximum number of cached quotes, least recently used are evicted first
+    RATE_CACHE_MAX_SIZE = 1024
+    
+    # Quote expiry and RFQ timeout (in seconds)
+    QUOTE_EXPIRY = 60
+    RFQ_TIMEOUT = 5
+    
+    # How long a timed out RFQ is remembered, so retries don't pile onto a
+    # slow peer (in seconds)
+    RATE_TIMEOUT_CACHE_EXPIRY = 2
+    
+    # Cached quotes with their monotonic expiry time
+    _rate_cache: "OrderedDict[str, Tuple[Dict[str, Any], float]]" = OrderedDict()
+    _inflight: Dict[str, asyncio.Task] = {}
+    
+    @classmethod
+    async def get_current_rate(
+        cls,
+        wallet: WalletTypeInfo,
+        asset_id: str,
+        amount: int = 1
+    ) -> Dict[str, Any]:
+        """
+        Get the current RFQ rate for an asset.
+        
+        Args:
+            wallet: The wallet information
+            asset_id: The asset ID to get a rate for
+            amount: Amount of the asset to quote
+        
+        Returns:
+            Dict containing the rate in sats per asset unit, or an error and
+            a None rate_per_unit if no quote could be obtained
+        
+        Raises:
+            Exception: If the RFQ request fails
+        """
+        # The rate per unit barely changes between nearby amounts, so amounts
+        # in the same power-of-two bucket share a quote
+        key = f"{asset_id}:{_quantize(amount)}"
+        
+        cached = cls._get_cached_rate(key)
+        if cached is not None:
+            log_debug(API, "Using cached rate for asset {}", asset_id)
+            return cls._for_amount(cached, amount)
+        
+        timeout = cls.RFQ_TIMEOUT
+        
+        # Ask for the quote in its own task, shared by every request for it, so
+        # a caller that goes away (e.g. a client disconnect) can't cancel the
+        # RFQ for the others
+        task = cls._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(cls._fetch_rate(key, wallet, asset_id, amount, timeout))
+            cls._inflight[key] = task
+            task.add_done_callback(functools.partial(cls._rate_fetched, key))
+        else:
+            log_debug(API, "Waiting for in-flight RFQ for asset {}", asset_id)
+        
+        try:
+            result = await asyncio.wait_for(asyncio.shield(task), timeout=timeout)
+        except asyncio.TimeoutError:
+            return {"error": "Timed out waiting for RFQ quote", "rate_per_unit": None}
+        return cls._for_amount(result, amount)
+    
+    @classmethod
+    async def _fetch_rate(
+        cls,
+        key: str,
+        wallet: WalletTypeInfo,
+        asset_id: str,
+        amount: int,
+        timeout: float
+    ) -> Dict[str, Any]:
+        """
+        Request a quote and cache the outcome for its amount bucket.
+        
+        Args:
+            key: The quote cache key
+            wallet: The wallet information
+            asset_id: The asset ID to get a rate for
+            amount: Amount of the asset to quote
+            timeout: Maximum time to wait for the quote (in seconds)
+            
+        Returns:
+            Dict containing the rate, or an error if no quote was obtained
+        """
+        try:
+            result = await cls._request_rate(wallet, asset_id, amount, timeout)
+        except asyncio.TimeoutError:
+            log_warning(API, f"RFQ for asset {asset_id} timed out after {timeout:.1f}s")
+            result = {"error": "Timed out waiting for RFQ quote", "rate_per_unit": None}
+            cls._set_cached_rate(key, result, expiry=cls.RATE_TIMEOUT_CACHE_EXPIRY)
+        else:
+            if result.get("rate_per_unit") is not None:
+                cls._set_cached_rate(key, result)
+        return result
+    
+    @classmethod
+    def _rate_fetched(cls, key: str, task: asyncio.Task) -> None:
+        """Forget a finished RFQ task, retrieving its outcome in case nobody awaited it."""
+        if cls._inflight.get(key) is task:
+            del cls._inflight[key]
+        if not task.cancelled():
+            task.exception()
+    
+    @staticmethod
+    def _for_amount(result: Dict[str, Any], amount: int) -> Dict[str, Any]:
+        """
+        Adapt a quote from the same amount bucket to the requested amount.
+        
+        The quote ID only stands for the buy order the quote was accepted
+        for, so it is left out when the amount differs.
+        
+        Args:
+            result: The shared quote
+            amount: The requested amount
+            
+        Returns:
+            Dict containing the rate with amount and total_sats for the requested amount
+        """
+        rate_per_unit = result.get("rate_per_unit")
+        if rate_per_unit is None or result.get("amount") == amount:
+            return result
+        adapted = {key: value for key, value in result.items() if key != "quote_id"}
+        adapted["amount"] = amount
+        adapted["total_sats"] = int(amount * rate_per_unit)
+        return adapted
+    
+    @classmethod
+    def _get_cached_rate(cls, key: str) -> Optional[Dict[str, Any]]:
+        """Get a cached quote if it hasn't expired yet."""
+        entry = cls._rate_cache.get(key)
+        if entry is None:
+            return None
+        
+        result, expires_at = entry
+        if expires_at <= time.monotonic():
+            cls._rate_cache.pop(key, None)
+            return None
+        
+        cls._rate_cache.move_to_end(key)
+        return result
+    
+    @classmethod
+    def _set_cached_rate(
+        cls,
+        key: str,
+        result: Dict[str, Any],
+        expiry: Optional[float] = None
+    ) -> None:
+        """Cache a quote, evicting the least recently used one when full."""
+        expiry = cls.RATE_CACHE_EXPIRY if expiry is None else expiry
+        cls._rate_cache[key] = (result, time.monotonic() + expiry)
+        cls._rate_cache.move_to_end(key)
+        while len(cls._rate_cache) > cls.RATE_CACHE_MAX_SIZE:
+            cls._rate_cache.popitem(last=False)
+    
+    @classmethod
+    async def _request_rate(
+        cls,
+        wallet: WalletTypeInfo,
+        asset_id: str,
+        amount: int,
+        timeout: float
+    ) -> Dict[str, Any]:
+        """
+        Request a quote for an asset from the peer of its channel.
+        
+        Args:
+            wallet: The wallet information
+            asset_id: The asset ID to get a rate for
+            amount: Amount of the asset to quote
+            timeout: Maximum time to wait for the quote (in seconds)
+        
+        Returns:
+            Dict containing the rate, or an error if no quote was received
+            
+        Raises:
+            asyncio.TimeoutError: If no quote arrives within the timeout
+        """
+        log_info(API, f"Requesting RFQ quote for asset {asset_id}, amount={amount}")
+        
+        # Create wallet instance
+        taproot_wallet = await TaprootAssetsFactory.create_wallet(
+            user_id=wallet.wallet.user,
+            wallet_id=wallet.wallet.id
+        )
+        
+        # Get RFQ stub
+        rfq_stub = rfq_pb2_grpc.RfqStub(taproot_wallet.node.channel)
+        
+        # Find peer with asset channel
+        assets = await AssetService.list_assets(wallet)
+        peer_pubkey = None
+        
+        for asset in assets:
+            if asset.get("asset_id") == asset_id and asset.get("channel_info") and asset["channel_info"].get("peer_pubkey"):
+                peer_pubkey = asset["channel_info"]["peer_pubkey"]
+                break
+        
+        if not peer_pubkey:
+            return {
+                "error": "No peer found with channel for this asset",
+                "rate_per_unit": None
+            }
+        
+        # Create buy order request
+        buy_order_request = rfq_pb2.AddAssetBuyOrderRequest(
+            asset_specifier=rfq_pb2.AssetSpecifier(asset_id=_hex_to_bytes(asset_id)),
+            asset_max_amt=amount,
+            expiry=int((datetime.now(timezone.utc) + timedelta(seconds=cls.QUOTE_EXPIRY)).timestamp()),
+            timeout_seconds=cls.RFQ_TIMEOUT,
+            peer_pub_key=_hex_to_bytes(peer_pubkey)
+        )
+        
+        # Get quote, bounded locally as well so a stalled channel can't hold us
+        buy_order_response = await asyncio.wait_for(
+            rfq_stub.AddAssetBuyOrder(buy_order_request, timeout=timeout),
+            timeout=timeout
+        )
+        
+        if not buy_order_response.accepted_quote:
+            return {
+                "error": "No RFQ quote received",
+                "rate_per_unit": None
+            }
+        
+        # Extract rate. The fixed-point coefficient is in millisats, so the
+        # math stays in integers until the single final division.
+        rate_info = buy_order_response.accepted_quote.ask_asset_rate
+        numerator = int(rate_info.coefficient)
+        millisats_denominator = 10 ** int(rate_info.scale) * 1000
+        rate_per_unit = numerator / (millisats_denominator * amount)
+        
+        return {
+            "asset_id": asset_id,
+            "amount": amount,
+            "rate_per_unit": rate_per_unit,
+            "total_sats": numerator // millisats_denominator,
+            "quote_id": buy_order_response.accepted_quote.id.hex()
+        }
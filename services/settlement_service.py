@@ -3,68 +3,170 @@ Centralized Settlement Service for Taproot Assets extension.
 Handles all invoice settlement logic consistently across different payment types.
 """
 import asyncio
-import hashlib
+import contextlib
+import functools
+import re
+import secrets
 import time
-from typing import Optional, Dict, Any, Tuple, List, Protocol, Type
-import grpc
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Tuple
 import grpc.aio
-from abc import ABC, abstractmethod
-from loguru import logger
 
+from lnbits.helpers import urlsafe_short_hash
 from lnbits.utils.cache import cache
 from ..tapd.taproot_adapter import invoices_pb2
 from .notification_service import NotificationService
-from ..models import TaprootInvoice, TaprootPayment
-from ..db_utils import transaction, with_transaction
+from .transaction_service import TransactionService
+from ..models import TaprootInvoice, TaprootPayment, InvoiceStatus, TxType
+from ..db_utils import AsyncKeyedLock, now_cached, timestamp_scope, transaction, with_transaction
 
 # Import database functions from crud re-exports
 from ..crud import (
     get_invoice_by_payment_hash,
+    is_invoice_paid,
     update_invoice_status,
-    is_internal_payment,
-    is_self_payment,
-    record_asset_transaction,
-    update_asset_balance,
-    get_asset_balance,
     create_payment_record
 )
 
 from ..logging_utils import (
     log_debug, log_info, log_warning, log_error, 
-    log_exception, PAYMENT, TRANSFER, LogContext
+    is_log_level_enabled, PAYMENT, TRANSFER, LogContext
 )
-from ..error_utils import ErrorContext, handle_error
+from ..error_utils import ErrorContext, TaprootAssetError
 
-# Define a settlement strategy abstract base class
-class SettlementStrategy(ABC):
-    """Base class for settlement strategies."""
+
+# Settlement start/completion messages are logged at INFO; when that level is
+# filtered out at load time the LogContext around each settlement is skipped
+_LOG_SETTLEMENT_PROGRESS = is_log_level_enabled("info")
+
+
+# LND's error for settling an invoice twice, matched without lowercasing a copy
+_ALREADY_SETTLED_RE = re.compile(r"invoice is already settled", re.IGNORECASE)
+
+# Cache key prefix of replayed settlement results
+_SETTLEMENT_RESULT_PREFIX = "taproot:settlement_result:"
+
+
+class _SettlementAborted(TaprootAssetError):
+    """Raised inside a settlement transaction so it rolls back instead of committing."""
+
+
+@functools.lru_cache(maxsize=4096)
+def _preimage_to_bytes(preimage_hex: str) -> bytes:
+    """Decode a hex preimage to bytes, memoized for invoices presented again."""
+    return bytes.fromhex(preimage_hex)
+
+
+class SettlementService:
+    """
+    Centralized service for handling all invoice settlement operations.
+    Provides consistent behavior across different payment types while
+    preserving the unique aspects of each.
+    """
     
-    @abstractmethod
-    async def execute(
-        self, 
-        payment_hash: str,
-        invoice: Optional[TaprootInvoice],
-        preimage_hex: str,
-        context: Dict[str, Any]
-    ) -> Tuple[bool, Dict[str, Any]]:
+    # Cache expiry time in seconds
+    SETTLED_PAYMENT_CACHE_EXPIRY = 86400  # 24 hours
+    
+    # How long a settlement result is replayed to duplicate requests (in seconds)
+    SETTLEMENT_RESULT_CACHE_EXPIRY = 600  # 10 minutes
+    
+    # How often expired settled markers are swept (in seconds)
+    SETTLED_SWEEP_INTERVAL = 60
+    
+    # Maximum number of preimages kept in memory, least recently used are evicted first
+    PREIMAGE_CACHE_MAX_SIZE = 8192
+    
+    # Deadline of the SettleInvoice call (in seconds), so a hung call can't
+    # hold up every later settlement of the same payment hash
+    SETTLE_INVOICE_TIMEOUT = 5.0
+    
+    # Per-payment-hash locks, so concurrent settlements of a payment run once
+    _settlement_locks = AsyncKeyedLock()
+    
+    # Settled payment markers, keyed by the raw 32-byte payment hash, with
+    # their time.monotonic() expiry. They only guard against settling twice in
+    # this process, so they don't need to go through the shared cache.
+    _settled_payments: Dict[bytes, float] = {}
+    _next_settled_sweep: float = 0.0
+    
+    # Recently used preimages, keyed by the raw payment hash
+    _preimages: "OrderedDict[bytes, str]" = OrderedDict()
+    
+    # In-flight SettleInvoice calls by payment hash, shared by concurrent settlements
+    _node_settlements: Dict[str, asyncio.Future] = {}
+    
+    @staticmethod
+    def _settled_key(payment_hash: str) -> bytes:
+        """Get the settled marker key for a payment hash."""
+        try:
+            return bytes.fromhex(payment_hash)
+        except ValueError:
+            return payment_hash.encode()
+    
+    @classmethod
+    def _is_settled(cls, payment_hash: str) -> bool:
         """
-        Execute the settlement strategy.
+        Check whether a payment was marked as settled and the marker hasn't expired.
         
         Args:
-            payment_hash: The payment hash
-            invoice: The invoice to settle
-            preimage_hex: The preimage in hex format
-            context: Additional context for the settlement
+            payment_hash: The payment hash to check
             
         Returns:
-            Tuple containing:
-                - Success status (bool)
-                - Result dictionary
+            bool: True if the payment is marked as settled
         """
-        pass
+        key = cls._settled_key(payment_hash)
+        expires_at = cls._settled_payments.get(key)
+        if expires_at is None:
+            return False
+        
+        if expires_at <= time.monotonic():
+            cls._settled_payments.pop(key, None)
+            return False
+        return True
     
-    async def update_invoice_status(
-        self, 
+    @classmethod
+    def _mark_settled(cls, payment_hash: str) -> None:
+        """
+        Mark a payment as settled, sweeping expired markers now and then.
+        
+        Args:
+            payment_hash: The payment hash to mark
+        """
+        now = time.monotonic()
+        settled = cls._settled_payments
+        settled[cls._settled_key(payment_hash)] = now + cls.SETTLED_PAYMENT_CACHE_EXPIRY
+        
+        if now >= cls._next_settled_sweep:
+            cls._next_settled_sweep = now + cls.SETTLED_SWEEP_INTERVAL
+            expired = [key for key, expires_at in settled.items() if expires_at <= now]
+            for key in expired:
+                del settled[key]
+    
+    @staticmethod
+    def _determine_payment_type(
+        is_internal: bool = False,
+        sender_info: Optional[Dict[str, Any]] = None
+    ) -> str:
+        """
+        Determine the payment type based on the provided parameters.
+        
+        Args:
+            is_internal: Whether this is an internal payment
+            sender_info: Optional information about the sender
+            
+        Returns:
+            The payment type as a string
+        """
+        if is_internal:
+            if sender_info:
+                return "internal_with_sender"
+            else:
+                return "internal"
+        else:
+            return "lightning"
+    
+    @staticmethod
+    async def _update_invoice_status(
         invoice_id: str, 
         status: str, 
         conn=None
@@ -88,8 +190,8 @@ class SettlementStrategy(ABC):
             return False, None
         return True, updated_invoice
     
-    async def record_asset_transaction(
-        self,
+    @staticmethod
+    async def _record_asset_transaction(
         wallet_id: str,
         asset_id: str,
         amount: int,
@@ -116,8 +218,6 @@ class SettlementStrategy(ABC):
         Returns:
             Success status (bool)
         """
-        from ..services.transaction_service import TransactionService
-        
         try:
             success, _, _ = await TransactionService.record_transaction(
                 wallet_id=wallet_id,
@@ -134,8 +234,8 @@ class SettlementStrategy(ABC):
             log_error(TRANSFER, f"Failed to record asset transaction: {str(e)}")
             return False
     
-    def format_result(
-        self,
+    @staticmethod
+    def _format_result(
         payment_hash: str,
         preimage_hex: str,
         is_internal: bool = False,
@@ -159,322 +259,273 @@ class SettlementStrategy(ABC):
         Returns:
             Result dictionary
         """
-        result = {
+        return {
             "success": True,
             "payment_hash": payment_hash,
             "preimage": preimage_hex,
-            "updated_invoice": updated_invoice
+            "updated_invoice": updated_invoice,
+            **({"is_internal": True, "is_self_payment": is_self_payment} if is_internal else {}),
+            **({"lightning_settled": True} if lightning_settled else {}),
+            **(additional_data or {})
         }
-        
-        if is_internal:
-            result["is_internal"] = True
-            result["is_self_payment"] = is_self_payment
-        
-        if lightning_settled:
-            result["lightning_settled"] = lightning_settled
-            
-        if additional_data:
-            result.update(additional_data)
-            
-        return result
-
-
-class InternalPaymentStrategy(SettlementStrategy):
-    """Strategy for settling internal payments without sender information."""
     
-    async def execute(
-        self, 
+    @staticmethod
+    async def _settle_internal(
         payment_hash: str,
         invoice: Optional[TaprootInvoice],
         preimage_hex: str,
-        context: Dict[str, Any]
+        is_self_payment: bool = False,
+        conn=None
     ) -> Tuple[bool, Dict[str, Any]]:
         """
-        Execute the internal payment settlement strategy.
+        Settle an internal payment without sender information.
         
         Args:
             payment_hash: The payment hash
             invoice: The invoice to settle
             preimage_hex: The preimage in hex format
-            context: Additional context for the settlement
-            
+            is_self_payment: Whether this is a self-payment
+            conn: Optional database connection to settle in
+        
         Returns:
             Tuple containing:
                 - Success status (bool)
                 - Result dictionary
         """
-        with ErrorContext("settle_internal_payment", TRANSFER):
-            if not invoice:
-                log_error(TRANSFER, f"No invoice found with payment_hash: {payment_hash}")
-                return False, {"error": "Invoice not found"}
-            
-            is_self_payment = context.get("is_self_payment", False)
-            
-            # Use transaction context manager to ensure atomicity
-            async with transaction() as conn:
+        if not invoice:
+            log_error(TRANSFER, f"No invoice found with payment_hash: {payment_hash}")
+            return False, {"error": "Invoice not found"}
+        
+        # Use transaction context manager to ensure atomicity. Failures raise,
+        # returning from the block would commit the status update alone.
+        try:
+            async with transaction(conn=conn) as conn:
                 # Update invoice status to paid
-                status_updated, updated_invoice = await self.update_invoice_status(invoice.id, "paid", conn=conn)
+                status_updated, updated_invoice = await SettlementService._update_invoice_status(invoice.id, InvoiceStatus.PAID, conn=conn)
                 if not status_updated:
-                    return False, {"error": "Failed to update invoice status"}
+                    raise _SettlementAborted("Failed to update invoice status")
                 
                 # Credit the recipient
-                credit_success = await self.record_asset_transaction(
+                credit_success = await SettlementService._record_asset_transaction(
                     wallet_id=invoice.wallet_id,
                     asset_id=invoice.asset_id,
                     amount=invoice.asset_amount,
-                    tx_type="credit",
+                    tx_type=TxType.CREDIT,
                     payment_hash=payment_hash,
                     description=invoice.description or "",
                     conn=conn
                 )
                 
                 if not credit_success:
-                    return False, {"error": "Failed to record asset transaction"}
-            
-            payment_type = "self-payment" if is_self_payment else "internal payment"
-            log_info(TRANSFER, f"Database updated: Invoice {invoice.id} status set to paid ({payment_type})")
-            
-            # Return success with details
-            return True, self.format_result(
-                payment_hash=payment_hash,
-                preimage_hex=preimage_hex,
-                is_internal=True,
-                is_self_payment=is_self_payment,
-                updated_invoice=updated_invoice
-            )
-
-
-class InternalPaymentWithSenderStrategy(SettlementStrategy):
-    """Strategy for settling internal payments with sender information."""
+                    raise _SettlementAborted("Failed to record asset transaction")
+        except _SettlementAborted as e:
+            return False, {"error": str(e)}
+        
+        payment_type = "self-payment" if is_self_payment else "internal payment"
+        log_info(TRANSFER, f"Database updated: Invoice {invoice.id} status set to paid ({payment_type})")
+        
+        # Return success with details
+        return True, SettlementService._format_result(
+            payment_hash=payment_hash,
+            preimage_hex=preimage_hex,
+            is_internal=True,
+            is_self_payment=is_self_payment,
+            updated_invoice=updated_invoice
+        )
     
-    async def execute(
-        self, 
+    @staticmethod
+    async def _settle_internal_with_sender(
         payment_hash: str,
         invoice: Optional[TaprootInvoice],
         preimage_hex: str,
-        context: Dict[str, Any]
+        sender_info: Dict[str, Any],
+        is_self_payment: bool = False,
+        conn=None
     ) -> Tuple[bool, Dict[str, Any]]:
         """
-        Execute the internal payment with sender settlement strategy.
+        Settle an internal payment, debiting the sender and crediting the recipient.
         
         Args:
             payment_hash: The payment hash
             invoice: The invoice to settle
             preimage_hex: The preimage in hex format
-            context: Additional context for the settlement
-            
+            sender_info: Information about the sender (wallet_id, user_id, asset_id)
+            is_self_payment: Whether this is a self-payment
+            conn: Optional database connection to settle in
+        
         Returns:
             Tuple containing:
                 - Success status (bool)
                 - Result dictionary
         """
-        with ErrorContext("settle_internal_payment_with_sender", TRANSFER):
-            if not invoice:
-                log_error(TRANSFER, f"No invoice found with payment_hash: {payment_hash}")
-                return False, {"error": "Invoice not found"}
-                
-            sender_info = context.get("sender_info", {})
-            is_self_payment = context.get("is_self_payment", False)
-            
-            sender_wallet_id = sender_info.get("wallet_id")
-            sender_user_id = sender_info.get("user_id")
-            
-            if not sender_wallet_id or not sender_user_id:
-                log_error(TRANSFER, f"Missing sender information for payment: {payment_hash}")
-                return False, {"error": "Incomplete sender information"}
+        if not invoice:
+            log_error(TRANSFER, f"No invoice found with payment_hash: {payment_hash}")
+            return False, {"error": "Invoice not found"}
+        
+        sender_wallet_id = sender_info.get("wallet_id")
+        sender_user_id = sender_info.get("user_id")
+        
+        if not sender_wallet_id or not sender_user_id:
+            log_error(TRANSFER, f"Missing sender information for payment: {payment_hash}")
+            return False, {"error": "Incomplete sender information"}
+        
+        # Determine which asset ID to use
+        if sender_info.get("asset_id"):
+            log_info(PAYMENT, f"Using client-provided asset_id={sender_info.get('asset_id')}")
+            debit_asset_id = sender_info.get("asset_id")
+        elif invoice.asset_id:
+            log_info(PAYMENT, f"Using invoice asset_id={invoice.asset_id}")
+            debit_asset_id = invoice.asset_id
+        else:
+            log_debug(PAYMENT, "No asset ID available from client or invoice")
+            debit_asset_id = None
             
-            # Determine which asset ID to use
-            if sender_info.get("asset_id"):
-                log_info(PAYMENT, f"Using client-provided asset_id={sender_info.get('asset_id')}")
-                debit_asset_id = sender_info.get("asset_id")
-            elif invoice.asset_id:
-                log_info(PAYMENT, f"Using invoice asset_id={invoice.asset_id}")
-                debit_asset_id = invoice.asset_id
-            else:
-                log_debug(PAYMENT, "No asset ID available from client or invoice")
-                debit_asset_id = None
-                
-            # Use transaction context manager to ensure atomicity
-            async with transaction() as conn:
+        # Use transaction context manager to ensure atomicity. Failures raise,
+        # returning from the block would commit the status update alone.
+        try:
+            async with transaction(conn=conn) as conn:
                 # 1. Update invoice status to paid
-                status_updated, updated_invoice = await self.update_invoice_status(invoice.id, "paid", conn=conn)
+                status_updated, updated_invoice = await SettlementService._update_invoice_status(invoice.id, InvoiceStatus.PAID, conn=conn)
                 if not status_updated:
-                    return False, {"error": "Failed to update invoice status"}
-                
-                # 2. Credit the recipient (record transaction and update balance)
-                credit_success = await self.record_asset_transaction(
-                    wallet_id=invoice.wallet_id,
-                    asset_id=invoice.asset_id,
-                    amount=invoice.asset_amount,
-                    tx_type="credit",
-                    payment_hash=payment_hash,
-                    description=invoice.description or "",
-                    conn=conn
-                )
+                    raise _SettlementAborted("Failed to update invoice status")
                 
-                # 3. Debit the sender (record transaction and update balance)
-                debit_success = await self.record_asset_transaction(
-                    wallet_id=sender_wallet_id,
-                    asset_id=debit_asset_id,
-                    amount=invoice.asset_amount,
-                    tx_type="debit",
+                # 2. Credit the recipient and debit the sender in one batch
+                recorded = await TransactionService.record_transactions_bulk(
+                    [
+                        (invoice.wallet_id, invoice.asset_id, invoice.asset_amount, TxType.CREDIT),
+                        (sender_wallet_id, debit_asset_id, invoice.asset_amount, TxType.DEBIT)
+                    ],
                     payment_hash=payment_hash,
                     description=invoice.description or "",
                     conn=conn
                 )
                 
-                if not credit_success or not debit_success:
-                    return False, {"error": "Failed to record asset transactions"}
-            
-            payment_type = "self-payment" if is_self_payment else "internal payment"
-            log_info(TRANSFER, f"Database updated: Invoice {invoice.id} status set to paid ({payment_type})")
-            log_info(TRANSFER, f"Asset balance updated for both sender and recipient, amount={invoice.asset_amount}")
-            
-            # Return success with details
-            return True, self.format_result(
-                payment_hash=payment_hash,
-                preimage_hex=preimage_hex,
-                is_internal=True,
-                is_self_payment=is_self_payment,
-                updated_invoice=updated_invoice
-            )
-
-
-class LightningPaymentStrategy(SettlementStrategy):
-    """Strategy for settling Lightning network payments."""
+                if not recorded:
+                    raise _SettlementAborted("Failed to record asset transactions")
+        except _SettlementAborted as e:
+            return False, {"error": str(e)}
+        
+        payment_type = "self-payment" if is_self_payment else "internal payment"
+        log_info(TRANSFER, f"Database updated: Invoice {invoice.id} status set to paid ({payment_type})")
+        log_info(TRANSFER, f"Asset balance updated for both sender and recipient, amount={invoice.asset_amount}")
+        
+        # Return success with details
+        return True, SettlementService._format_result(
+            payment_hash=payment_hash,
+            preimage_hex=preimage_hex,
+            is_internal=True,
+            is_self_payment=is_self_payment,
+            updated_invoice=updated_invoice
+        )
     
-    async def execute(
-        self, 
+    @staticmethod
+    async def _settle_lightning(
         payment_hash: str,
         invoice: Optional[TaprootInvoice],
         preimage_hex: str,
-        context: Dict[str, Any]
+        node,
+        conn=None
     ) -> Tuple[bool, Dict[str, Any]]:
         """
-        Execute the Lightning payment settlement strategy.
+        Settle a Lightning network payment on the node.
         
         Args:
             payment_hash: The payment hash
-            invoice: The invoice to settle
+            invoice: The invoice to settle, if there is a record of it
             preimage_hex: The preimage in hex format
-            context: Additional context for the settlement
-            
+            node: The TaprootAssetsNodeExtension instance
+            conn: Optional database connection to settle in
+        
         Returns:
             Tuple containing:
                 - Success status (bool)
                 - Result dictionary
         """
-        with ErrorContext("settle_lightning_payment", TRANSFER):
-            node = context.get("node")
-            if not node:
-                return False, {"error": "Node not provided"}
-                
-            # Convert the preimage to bytes
-            preimage_bytes = bytes.fromhex(preimage_hex)
-
-            # Create settlement request
-            settle_request = invoices_pb2.SettleInvoiceMsg(
-                preimage=preimage_bytes
-            )
-
-            # Flag to track Lightning settlement
-            lightning_settled = False
-            error_message = None
+        if not node:
+            return False, {"error": "Node not provided"}
             
-            try:
-                # Settle the invoice
-                await node.invoices_stub.SettleInvoice(settle_request)
-                log_info(TRANSFER, f"Lightning invoice {payment_hash[:8]}... successfully settled")
+        # Flag to track Lightning settlement
+        lightning_settled = False
+        error_message = None
+        
+        try:
+            # Settle the invoice
+            await SettlementService._settle_on_node(node, payment_hash, preimage_hex)
+            log_info(TRANSFER, f"Lightning invoice {payment_hash[:8]}... successfully settled")
+            lightning_settled = True
+        except grpc.aio.AioRpcError as e:
+            # Check if already settled
+            if _ALREADY_SETTLED_RE.search(e.details() or ""):
+                log_info(TRANSFER, f"Lightning invoice {payment_hash[:8]}... was already settled on the node")
                 lightning_settled = True
-            except grpc.aio.AioRpcError as e:
-                # Check if already settled
-                if "invoice is already settled" in e.details().lower():
-                    log_info(TRANSFER, f"Lightning invoice {payment_hash[:8]}... was already settled on the node")
-                    lightning_settled = True
-                else:
-                    error_message = f"gRPC error in settle_invoice: {e.code()}: {e.details()}"
-                    log_error(TRANSFER, error_message)
-            
-            # If Lightning settlement failed, stop here
-            if not lightning_settled:
-                return False, {"error": error_message or "Lightning settlement failed"}
-            
-            # Update the invoice status in the database if we have an invoice record
-            updated_invoice = None
-            if invoice:
-                # Use transaction context manager to ensure atomicity
-                async with transaction() as conn:
-                    status_updated, updated_invoice = await self.update_invoice_status(invoice.id, "paid", conn=conn)
-                
-                if status_updated:
-                    log_info(TRANSFER, f"Database updated: Invoice {invoice.id} status set to paid")
-                else:
-                    log_error(TRANSFER, f"Failed to update invoice {invoice.id} status in database")
-                    # Note: We don't fail the operation here since the Lightning settlement succeeded
-            
-            # Return success with details
-            return True, self.format_result(
-                payment_hash=payment_hash,
-                preimage_hex=preimage_hex,
-                lightning_settled=lightning_settled,
-                updated_invoice=updated_invoice
-            )
-
-
-class SettlementService:
-    """
-    Centralized service for handling all invoice settlement operations.
-    Provides consistent behavior across different payment types while
-    preserving the unique aspects of each.
-    """
-    
-    # Cache expiry time in seconds
-    SETTLED_PAYMENT_CACHE_EXPIRY = 86400  # 24 hours
-    
-    # Strategy instances
-    _internal_strategy = InternalPaymentStrategy()
-    _internal_with_sender_strategy = InternalPaymentWithSenderStrategy()
-    _lightning_strategy = LightningPaymentStrategy()
-    
-    @classmethod
-    def _determine_payment_type(cls, **kwargs) -> str:
-        """
-        Determine the payment type based on the provided parameters.
+            else:
+                error_message = f"gRPC error in settle_invoice: {e.code()}: {e.details()}"
+                log_error(TRANSFER, error_message)
         
-        Args:
-            **kwargs: Keyword arguments to determine the payment type
-            
-        Returns:
-            The payment type as a string
-        """
-        is_internal = kwargs.get("is_internal", False)
-        sender_info = kwargs.get("sender_info")
+        # If Lightning settlement failed, stop here
+        if not lightning_settled:
+            return False, {"error": error_message or "Lightning settlement failed"}
         
-        if is_internal:
-            if sender_info:
-                return "internal_with_sender"
+        # Update the invoice status in the database if we have an invoice record
+        updated_invoice = None
+        if invoice:
+            # Use transaction context manager to ensure atomicity
+            async with transaction(conn=conn) as conn:
+                status_updated, updated_invoice = await SettlementService._update_invoice_status(invoice.id, InvoiceStatus.PAID, conn=conn)
+            
+            if status_updated:
+                log_info(TRANSFER, f"Database updated: Invoice {invoice.id} status set to paid")
             else:
-                return "internal"
-        else:
-            return "lightning"
+                log_error(TRANSFER, f"Failed to update invoice {invoice.id} status in database")
+                # Note: We don't fail the operation here since the Lightning settlement succeeded
+        
+        # Return success with details
+        return True, SettlementService._format_result(
+            payment_hash=payment_hash,
+            preimage_hex=preimage_hex,
+            lightning_settled=lightning_settled,
+            updated_invoice=updated_invoice
+        )
     
     @classmethod
-    def _get_settlement_strategy(cls, payment_type: str) -> SettlementStrategy:
+    async def _settle_on_node(cls, node, payment_hash: str, preimage_hex: str) -> None:
         """
-        Get the appropriate settlement strategy for the given payment type.
+        Settle an invoice on the node, sharing the call with concurrent settlements.
+        
+        LND has no batch settlement RPC, and separate invoices already share
+        the node's HTTP/2 connection, so what is coalesced here are duplicate
+        settlements of the same invoice (e.g. when a client reconnects) which
+        now make a single SettleInvoice call.
         
         Args:
-            payment_type: The payment type
+            node: The TaprootAssetsNodeExtension instance
+            payment_hash: The payment hash of the invoice
+            preimage_hex: The preimage in hex format
             
-        Returns:
-            The settlement strategy
-        """
-        if payment_type == "internal_with_sender":
-            return cls._internal_with_sender_strategy
-        elif payment_type == "internal":
-            return cls._internal_strategy
-        else:  # lightning
-            return cls._lightning_strategy
+        Raises:
+            grpc.aio.AioRpcError: If the node rejects the settlement or it
+                doesn't complete within SETTLE_INVOICE_TIMEOUT (DEADLINE_EXCEEDED)
+        """
+        inflight = cls._node_settlements.get(payment_hash)
+        if inflight is not None:
+            log_debug(TRANSFER, "Joining in-flight settlement of {}...", payment_hash[:8])
+            await asyncio.shield(inflight)
+            return
+        
+        settle_request = invoices_pb2.SettleInvoiceMsg(
+            preimage=_preimage_to_bytes(preimage_hex)
+        )
+        future = asyncio.ensure_future(
+            node.invoices_stub.SettleInvoice(settle_request, timeout=cls.SETTLE_INVOICE_TIMEOUT)
+        )
+        # Retrieve the outcome even if every waiter was cancelled
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        cls._node_settlements[payment_hash] = future
+        try:
+            await asyncio.shield(future)
+        finally:
+            if cls._node_settlements.get(payment_hash) is future:
+                cls._node_settlements.pop(payment_hash, None)
     
     @classmethod
     async def settle_invoice(
@@ -485,10 +536,15 @@ class SettlementService:
         is_self_payment: bool = False,
         user_id: Optional[str] = None,
         wallet_id: Optional[str] = None,
-        sender_info: Optional[Dict[str, Any]] = None
+        sender_info: Optional[Dict[str, Any]] = None,
+        conn=None
     ) -> Tuple[bool, Optional[Dict[str, Any]]]:
         """
-        Settle an invoice using the appropriate strategy based on payment type.
+        Settle an invoice according to its payment type.
+        
+        When a connection is passed the caller owns the transaction, so marking
+        the payment as settled and sending notifications are left to the caller
+        once it has committed.
         
         Args:
             payment_hash: The payment hash of the invoice to settle
@@ -498,78 +554,86 @@ class SettlementService:
             user_id: Optional user ID for notification
             wallet_id: Optional wallet ID for balance updates
             sender_info: Optional information about the sender for internal payments
-            
+            conn: Optional database connection to settle in
+        
         Returns:
             Tuple containing:
                 - Success status (bool)
                 - Optional result data dictionary
         """
         log_context = "internal payment" if is_internal else "Lightning payment"
+        progress_context = (
+            LogContext(TRANSFER, f"settling invoice {payment_hash[:8]}... ({log_context})", log_level="info")
+            if _LOG_SETTLEMENT_PROGRESS else contextlib.nullcontext()
+        )
         with ErrorContext(f"settle_invoice_{log_context}", TRANSFER):
-            with LogContext(TRANSFER, f"settling invoice {payment_hash[:8]}... ({log_context})", log_level="info"):
+            with progress_context:
                 # Check if already settled in cache
-                is_settled = cache.get(f"taproot:settled:{payment_hash}")
-                if is_settled:
+                if cls._is_settled(payment_hash):
                     log_info(TRANSFER, f"Invoice {payment_hash[:8]}... already marked as settled in memory, skipping")
                     return True, {"already_settled": True}
                 
                 # Check if already settled in database
-                invoice = await get_invoice_by_payment_hash(payment_hash)
-                if invoice and invoice.status == "paid":
+                invoice = await get_invoice_by_payment_hash(payment_hash, conn=conn)
+                if invoice and invoice.status == InvoiceStatus.PAID:
                     log_info(TRANSFER, f"Invoice {payment_hash[:8]}... already paid in database, skipping")
                     # Add to cache to avoid future DB lookups
-                    cache.set(f"taproot:settled:{payment_hash}", True, expiry=cls.SETTLED_PAYMENT_CACHE_EXPIRY)
+                    cls._mark_settled(payment_hash)
                     return True, {"already_settled": True}
                 
-                # Get or generate preimage
+                # Only an unpaid invoice needs its preimage, generating and
+                # storing one if none exists yet
                 preimage_hex = await cls._get_or_generate_preimage(node, payment_hash)
                 if not preimage_hex:
                     log_error(TRANSFER, f"Failed to get or generate preimage for {payment_hash[:8]}...")
                     return False, {"error": "No preimage available"}
                 
-                # Determine payment type and get appropriate strategy
+                # Settle according to the payment type
                 payment_type = cls._determine_payment_type(
                     is_internal=is_internal,
                     sender_info=sender_info
                 )
-                strategy = cls._get_settlement_strategy(payment_type)
-                
-                # Prepare context for the strategy
-                context = {
-                    "node": node,
-                    "is_self_payment": is_self_payment,
-                    "user_id": user_id,
-                    "wallet_id": wallet_id,
-                    "sender_info": sender_info
-                }
-                
-                # Execute the strategy
-                success, result = await strategy.execute(
-                    payment_hash, invoice, preimage_hex, context
-                )
+                if payment_type == "internal_with_sender":
+                    success, result = await cls._settle_internal_with_sender(
+                        payment_hash, invoice, preimage_hex, sender_info, is_self_payment, conn=conn
+                    )
+                elif payment_type == "internal":
+                    success, result = await cls._settle_internal(
+                        payment_hash, invoice, preimage_hex, is_self_payment, conn=conn
+                    )
+                else:  # lightning
+                    success, result = await cls._settle_lightning(
+                        payment_hash, invoice, preimage_hex, node, conn=conn
+                    )
                 
                 # If successful, track settlement
                 if success:
-                    cache.set(f"taproot:settled:{payment_hash}", True, expiry=cls.SETTLED_PAYMENT_CACHE_EXPIRY)
-                    
                     # For Lightning payments, update asset balance if invoice exists
                     if not is_internal and invoice:
                         # Update asset balance if it's not an internal payment
-                        async with transaction() as conn:
+                        async with transaction(conn=conn) as tx_conn:
                             await cls._update_asset_balance(
                                 invoice.wallet_id,
                                 invoice.asset_id,
                                 invoice.asset_amount,
                                 payment_hash,
                                 invoice.description,
-                                conn=conn
+                                conn=tx_conn
                             )
                     
-                    # Send WebSocket notifications if invoice exists
+                    # The caller marks and notifies once its transaction commits
+                    if conn is not None:
+                        return success, result
+                    
+                    cls._mark_settled(payment_hash)
+                    
+                    # Send WebSocket notifications if invoice exists, without
+                    # holding up the settlement while they fan out
                     if invoice:
-                        # Send WebSocket notifications
-                        await cls._send_settlement_notifications(
-                            invoice, result.get("updated_invoice"), node
+                        NotificationService.send_in_background(
+                            cls._send_settlement_notifications(
+                                invoice, result.get("updated_invoice"), node
+                            )
                         )
                 
                 return success, result
@@ -593,7 +657,7 @@ class SettlementService:
     ) -> Tuple[bool, Dict[str, Any]]:
         """
         Unified method to handle all payment settlement operations.
-        Combines the logic from settle_invoice and record_payment.
+        Combines the logic from settle_invoice and the payment recorders.
         
         Args:
             payment_hash: Payment hash
@@ -615,53 +679,141 @@ class SettlementService:
                 - Success status (bool)
                 - Result dictionary with payment details
         """
+        async with cls._settlement_locks(payment_hash):
+            # A retried or concurrent request for a payment we just settled
+            # gets the same result instead of settling it again
+            result_key = _SETTLEMENT_RESULT_PREFIX + user_id + ":" + payment_hash
+            cached_result = cache.get(result_key)
+            if cached_result:
+                log_info(PAYMENT, f"Payment {payment_hash[:8]}... already settled, returning previous result")
+                return True, cached_result
+            
+            # All rows written for this settlement share one timestamp
+            with timestamp_scope():
+                success, result = await cls._process_payment_settlement(
+                    payment_hash=payment_hash,
+                    payment_request=payment_request,
+                    asset_id=asset_id,
+                    asset_amount=asset_amount,
+                    fee_sats=fee_sats,
+                    user_id=user_id,
+                    wallet_id=wallet_id,
+                    node=node,
+                    is_internal=is_internal,
+                    is_self_payment=is_self_payment,
+                    description=description,
+                    preimage=preimage,
+                    sender_info=sender_info
+                )
+            if success:
+                cache.set(result_key, result, expiry=cls.SETTLEMENT_RESULT_CACHE_EXPIRY)
+            return success, result
+    
+    @classmethod
+    async def _process_payment_settlement(
+        cls,
+        payment_hash: str,
+        payment_request: str,
+        asset_id: str,
+        asset_amount: int,
+        fee_sats: int,
+        user_id: str,
+        wallet_id: str,
+        node=None,
+        is_internal: bool = False,
+        is_self_payment: bool = False,
+        description: Optional[str] = None,
+        preimage: Optional[str] = None,
+        sender_info: Optional[Dict[str, Any]] = None
+    ) -> Tuple[bool, Dict[str, Any]]:
+        """Settle and record a payment; see process_payment_settlement."""
         with ErrorContext("process_payment_settlement", PAYMENT):
             log_info(PAYMENT, f"Processing payment settlement: hash={payment_hash[:8]}..., type={'internal' if is_internal else 'external'}")
             
-            # Step 1: Settle the invoice if this is an internal payment
             settlement_result = {}
-            if is_internal and node:
-                # Determine if we have sender info
-                has_sender = sender_info is not None and len(sender_info) > 0
+            if is_internal:
+                if not node:
+                    log_error(PAYMENT, "Cannot settle an internal payment without a node")
+                    return False, {"error": "Node required to settle an internal payment"}
                 
-                # Settle the invoice
-                settle_success, settle_result = await cls.settle_invoice(
+                # Settle the invoice and record the payment in one transaction,
+                # so an internal payment is a single commit. A failed
+                # settlement raises to roll back whatever it already wrote.
+                try:
+                    async with transaction() as conn:
+                        settle_success, settle_result = await cls.settle_invoice(
+                            payment_hash=payment_hash,
+                            node=node,
+                            is_internal=True,
+                            is_self_payment=is_self_payment,
+                            user_id=user_id,
+                            wallet_id=wallet_id,
+                            sender_info=sender_info,
+                            conn=conn
+                        )
+                        
+                        if not settle_success:
+                            raise _SettlementAborted(settle_result.get('error', 'Unknown error'))
+                        
+                        settlement_result = settle_result
+                        
+                        # If we have a preimage from settlement, use it
+                        if not preimage and 'preimage' in settle_result:
+                            preimage = settle_result['preimage']
+                        
+                        await cls.record_internal_payment_receipt(
+                            payment_hash=payment_hash,
+                            payment_request=payment_request,
+                            asset_id=asset_id,
+                            asset_amount=asset_amount,
+                            user_id=user_id,
+                            wallet_id=wallet_id,
+                            description=description,
+                            preimage=preimage,
+                            conn=conn
+                        )
+                except _SettlementAborted as e:
+                    log_error(PAYMENT, f"Failed to settle invoice: {str(e)}")
+                    return False, {"error": f"Failed to settle invoice: {str(e)}"}
+                
+                # Mark settled and notify now that the transaction is committed
+                cls._mark_settled(payment_hash)
+                log_info(PAYMENT, f"Internal payment settled and recorded: {payment_hash[:8]}...")
+                
+                updated_invoice = settlement_result.get("updated_invoice")
+                if updated_invoice:
+                    NotificationService.send_in_background(
+                        cls._send_settlement_notifications(updated_invoice, updated_invoice, node)
+                    )
+                
+                NotificationService.send_in_background(
+                    cls._notify_transaction_complete(
+                        user_id=user_id,
+                        wallet_id=wallet_id,
+                        payment_hash=payment_hash,
+                        asset_id=asset_id,
+                        asset_amount=asset_amount,
+                        description=description,
+                        fee_sats=fee_sats,
+                        is_internal=is_internal,
+                        is_self_payment=is_self_payment
+                    )
+                )
+            else:
+                payment_success, payment_record = await cls.record_external_payment(
                     payment_hash=payment_hash,
-                    node=node,
-                    is_internal=True,
-                    is_self_payment=is_self_payment,
+                    payment_request=payment_request,
+                    asset_id=asset_id,
+                    asset_amount=asset_amount,
+                    fee_sats=fee_sats,
                     user_id=user_id,
                     wallet_id=wallet_id,
-                    sender_info=sender_info
+                    description=description,
+                    preimage=preimage
                 )
                 
-                if not settle_success:
-                    log_error(PAYMENT, f"Failed to settle invoice: {settle_result.get('error', 'Unknown error')}")
-                    return False, {"error": f"Failed to settle invoice: {settle_result.get('error', 'Unknown error')}"}
-                
-                settlement_result = settle_result
-                
-                # If we have a preimage from settlement, use it
-                if not preimage and 'preimage' in settle_result:
-                    preimage = settle_result['preimage']
-            
-            # Step 2: Record the payment
-            payment_success, payment_record = await cls.record_payment(
-                payment_hash=payment_hash,
-                payment_request=payment_request,
-                asset_id=asset_id,
-                asset_amount=asset_amount,
-                fee_sats=fee_sats,
-                user_id=user_id,
-                wallet_id=wallet_id,
-                description=description,
-                preimage=preimage,
-                is_internal=is_internal,
-                is_self_payment=is_self_payment
-            )
-            
-            if not payment_success:
-                log_warning(PAYMENT, "Payment settlement was successful but failed to record in database")
+                if not payment_success:
+                    log_warning(PAYMENT, "Payment settlement was successful but failed to record in database")
             
             # Combine results
             result = {
@@ -683,8 +835,55 @@ class SettlementService:
             
             return True, result
     
+    @staticmethod
+    async def record_internal_payment_receipt(
+        payment_hash: str,
+        payment_request: str,
+        asset_id: str,
+        asset_amount: int,
+        user_id: str,
+        wallet_id: str,
+        description: Optional[str] = None,
+        preimage: Optional[str] = None,
+        conn=None
+    ) -> TaprootPayment:
+        """
+        Record the sender's payment record for a settled internal payment.
+        
+        Both balances were already updated by the settlement, so this only
+        writes the payment record, normally in the settlement's transaction.
+        
+        Args:
+            payment_hash: Payment hash
+            payment_request: Original payment request
+            asset_id: Asset ID
+            asset_amount: Amount of the asset
+            user_id: User ID of the sender
+            wallet_id: Wallet ID of the sender
+            description: Optional description
+            preimage: Optional preimage
+            conn: Optional database connection to reuse
+            
+        Returns:
+            TaprootPayment: The payment record
+        """
+        payment_record = await create_payment_record(
+            payment_hash=payment_hash,
+            payment_request=payment_request,
+            asset_id=asset_id,
+            asset_amount=asset_amount,
+            fee_sats=0,  # No fee for internal payments
+            user_id=user_id,
+            wallet_id=wallet_id,
+            description=description or "",
+            preimage=preimage or "",
+            conn=conn
+        )
+        log_info(PAYMENT, f"Internal payment record created: {payment_hash[:8]}...")
+        return payment_record
+    
     @classmethod
-    async def record_payment(
+    async def record_external_payment(
         cls,
         payment_hash: str,
         payment_request: str,
@@ -695,12 +894,14 @@ class SettlementService:
         wallet_id: str,
         description: Optional[str] = None,
         preimage: Optional[str] = None,
-        is_internal: bool = False,
-        is_self_payment: bool = False,
         conn=None
     ) -> Tuple[bool, Optional[TaprootPayment]]:
         """
-        Record a payment in the database with proper transaction handling to ensure atomicity.
+        Record an outgoing Lightning payment and debit the sender's balance atomically.
+        
+        When a connection is passed the caller owns the transaction, so write
+        errors are raised to roll it back, and marking the payment as settled
+        and sending notifications are left to the caller once it has committed.
         
         Args:
             payment_hash: Payment hash
@@ -712,8 +913,6 @@ class SettlementService:
             wallet_id: Wallet ID
             description: Optional description
             preimage: Optional preimage
-            is_internal: Whether this is an internal payment
-            is_self_payment: Whether this is a self-payment
             conn: Optional database connection to reuse
             
         Returns:
@@ -721,117 +920,142 @@ class SettlementService:
                 - Success status (bool)
                 - Optional payment record
         """
-        with ErrorContext("record_payment", PAYMENT):
+        with ErrorContext("record_external_payment", PAYMENT):
             log_info(PAYMENT, f"Recording payment: hash={payment_hash[:8]}..., asset_amount={asset_amount}, fee_sats={fee_sats}")
             
-            # Check if we've already processed this payment hash to avoid duplicates
-            is_processed = cache.get(f"taproot:settled:{payment_hash}")
-            if is_processed and is_internal:
-                # For internal payments, we already handled both sides in settle_invoice
-                # Just create the payment record for notification purposes
-                try:
-                    payment_record = await create_payment_record(
-                        payment_hash=payment_hash,
-                        payment_request=payment_request,
-                        asset_id=asset_id,
-                        asset_amount=asset_amount,
-                        fee_sats=fee_sats,
-                        user_id=user_id,
-                        wallet_id=wallet_id,
-                        description=description or "",
-                        preimage=preimage or "",
-                        conn=conn
-                    )
-                    
-                    log_info(PAYMENT, f"Internal payment record created for notification purposes: {payment_hash[:8]}...")
-                    return True, payment_record
-                except Exception as e:
-                    log_warning(PAYMENT, f"Failed to create payment record for notification: {str(e)}")
-                    return False, None
-            elif is_processed:
+            # Check if we've already processed this payment hash to avoid a double debit
+            if cls._is_settled(payment_hash):
                 log_info(PAYMENT, f"Payment {payment_hash[:8]}... already processed, skipping record creation")
                 return True, None
-                
-            
-            # Use transaction context manager with retry capability
-            async with transaction(conn=conn, max_retries=5, retry_delay=0.2) as tx_conn:
-                try:
-                    # Check if the invoice is already paid
-                    invoice = await get_invoice_by_payment_hash(payment_hash, conn=tx_conn)
-                    if invoice and invoice.status == "paid":
-                        log_info(PAYMENT, f"Invoice for payment {payment_hash[:8]}... is already paid, skipping payment record")
-                        return True, None
-                    
-                    # Record the payment
-                    payment_record = await create_payment_record(
-                        payment_hash=payment_hash,
-                        payment_request=payment_request,
-                        asset_id=asset_id,
-                        asset_amount=asset_amount,
-                        fee_sats=fee_sats,
-                        user_id=user_id,
-                        wallet_id=wallet_id,
-                        description=description or "",
-                        preimage=preimage or "",
-                        conn=tx_conn
-                    )
-                    
-                    # Only create asset transaction if this is not an internal payment
-                    if not is_internal:
-                        # Get the strategy instance to use its record_asset_transaction method
-                        strategy = cls._internal_strategy
-                        
-                        # Record the transaction
-                        await strategy.record_asset_transaction(
-                            wallet_id=wallet_id,
-                            asset_id=asset_id,
-                            amount=asset_amount,
-                            tx_type="debit",  # Outgoing payment
-                            payment_hash=payment_hash,
-                            description=description or "",
-                            conn=tx_conn
-                        )
-                    
-                    # Add to settled payment hashes cache
-                    cache.set(f"taproot:settled:{payment_hash}", True, expiry=cls.SETTLED_PAYMENT_CACHE_EXPIRY)
-                    
-                    log_info(PAYMENT, f"Payment record created successfully for hash={payment_hash[:8]}...")
-                except Exception as e:
-                    log_error(PAYMENT, f"Failed to record payment: {str(e)}")
-                    return False, None
             
-            # Send notifications after the transaction is committed
+            # Record the payment and the outgoing debit in one write
+            payment_record = TaprootPayment(
+                id=urlsafe_short_hash(),
+                payment_hash=payment_hash,
+                payment_request=payment_request,
+                asset_id=asset_id,
+                asset_amount=asset_amount,
+                fee_sats=fee_sats,
+                description=description or "",
+                user_id=user_id,
+                wallet_id=wallet_id,
+                created_at=now_cached(),
+                preimage=preimage or ""
+            )
             try:
-                await NotificationService.notify_transaction_complete(
+                recorded = await cls._write_external_payment(payment_record, conn=conn)
+            except Exception as e:
+                log_error(PAYMENT, f"Failed to record payment: {str(e)}")
+                if conn is not None:
+                    raise
+                # Our own transaction has rolled back, so nothing was written
+                return False, None
+            
+            if not recorded:
+                log_info(PAYMENT, f"Invoice for payment {payment_hash[:8]}... is already paid, skipping payment record")
+                return True, None
+            
+            # The caller marks and notifies once its transaction commits
+            if conn is not None:
+                return True, payment_record
+            
+            # Add to settled payment hashes cache only once the write is committed
+            cls._mark_settled(payment_hash)
+            log_info(PAYMENT, f"Payment record created successfully for hash={payment_hash[:8]}...")
+            
+            # Send notifications in the background now that the write is committed
+            NotificationService.send_in_background(
+                cls._notify_transaction_complete(
                     user_id=user_id,
                     wallet_id=wallet_id,
                     payment_hash=payment_hash,
                     asset_id=asset_id,
                     asset_amount=asset_amount,
-                    tx_type="debit",
                     description=description,
                     fee_sats=fee_sats,
-                    is_internal=is_internal,
-                    is_self_payment=is_self_payment
+                    is_internal=False,
+                    is_self_payment=False
                 )
-            except Exception as e:
-                log_warning(PAYMENT, f"Payment recorded but notification failed: {str(e)}")
+            )
             
             return True, payment_record
     
+    @staticmethod
+    @with_transaction
+    async def _write_external_payment(payment: TaprootPayment, conn=None) -> bool:
+        """
+        Write an outgoing payment record and its debit, unless the invoice is already paid.
+        
+        Errors propagate so the transaction rolls back as a whole; when the
+        transaction is opened here, contention retries run the whole write again.
+        
+        Args:
+            payment: The payment record to write
+            conn: Optional database connection to reuse
+            
+        Returns:
+            bool: True if the payment was written, False if its invoice is already paid
+        """
+        # Check if the invoice is already paid, a single indexed lookup
+        if await is_invoice_paid(payment.payment_hash, conn=conn):
+            return False
+        
+        await TransactionService.record_payment_with_debit(payment, conn=conn)
+        return True
+    
+    @staticmethod
+    async def _notify_transaction_complete(
+        user_id: str,
+        wallet_id: str,
+        payment_hash: str,
+        asset_id: str,
+        asset_amount: int,
+        description: Optional[str],
+        fee_sats: int,
+        is_internal: bool,
+        is_self_payment: bool
+    ) -> None:
+        """Notify the sender that a recorded payment is complete."""
+        try:
+            await NotificationService.notify_transaction_complete(
+                user_id=user_id,
+                wallet_id=wallet_id,
+                payment_hash=payment_hash,
+                asset_id=asset_id,
+                asset_amount=asset_amount,
+                tx_type=TxType.DEBIT,
+                description=description,
+                fee_sats=fee_sats,
+                is_internal=is_internal,
+                is_self_payment=is_self_payment
+            )
+        except Exception as e:
+            log_warning(PAYMENT, f"Payment recorded but notification failed: {str(e)}")
+    
     @classmethod
     async def _get_or_generate_preimage(cls, node, payment_hash: str) -> Optional[str]:
         """Get an existing preimage or generate a new one if needed."""
+        # A preimage never changes for a payment hash, so recently used ones
+        # are served from memory
+        key = cls._settled_key(payment_hash)
+        preimage_hex = cls._preimages.get(key)
+        if preimage_hex:
+            cls._preimages.move_to_end(key)
+            return preimage_hex
+        
         # Try to get existing preimage
         preimage_hex = node._get_preimage(payment_hash)
         
         # Generate a new one if not found
         if not preimage_hex:
             log_info(TRANSFER, f"No preimage found for {payment_hash[:8]}..., generating one")
-            preimage = hashlib.sha256(f"{payment_hash}_{time.time()}".encode()).digest()
-            preimage_hex = preimage.hex()
+            preimage_hex = secrets.token_bytes(32).hex()
             # Store it
             node._store_preimage(payment_hash, preimage_hex)
+        
+        cls._preimages[key] = preimage_hex
+        if len(cls._preimages) > cls.PREIMAGE_CACHE_MAX_SIZE:
+            cls._preimages.popitem(last=False)
             
         return preimage_hex
     
@@ -860,8 +1084,6 @@ class SettlementService:
         Returns:
             bool: Success status
         """
-        from ..services.transaction_service import TransactionService
-        
         with ErrorContext("update_asset_balance", TRANSFER):
             try:
                 # Always create a transaction record if we have a description
@@ -871,7 +1093,7 @@ class SettlementService:
                     wallet_id=wallet_id,
                     asset_id=asset_id,
                     amount=amount,
-                    tx_type="credit",
+                    tx_type=TxType.CREDIT,
                     payment_hash=payment_hash,
                     description=description or "",
                     create_tx_record=create_tx_record,
@@ -917,7 +1139,7 @@ class SettlementService:
                 {
                     "id": invoice.id,
                     "payment_hash": invoice.payment_hash,
-                    "status": "paid",
+                    "status": InvoiceStatus.PAID,
                     "asset_id": invoice.asset_id,
                     "asset_amount": invoice.asset_amount,
                     "paid_at": paid_at
@@ -944,15 +1166,19 @@ class SettlementService:
                 # Get assets with channel info
                 assets = await node.list_assets()
                 
-                # Filter to only include assets with channel info
-                filtered_assets = [asset for asset in assets if asset.get("channel_info")]
+                # Filter to only include assets with channel info. Entries are
+                # copied so adding balances doesn't touch the cached list.
+                filtered_assets = [dict(asset) for asset in assets if asset.get("channel_info")]
                 
-                # Add user balance information
+                # Add user balance information, fetched in a single query
+                balances = await TransactionService.get_asset_balances(
+                    invoice.wallet_id,
+                    list({asset["asset_id"] for asset in filtered_assets if asset.get("asset_id")})
+                )
                 for asset in filtered_assets:
                     asset_id_check = asset.get("asset_id")
                     if asset_id_check:
-                        balance = await get_asset_balance(invoice.wallet_id, asset_id_check)
-                        asset["user_balance"] = balance.balance if balance else 0
+                        asset["user_balance"] = balances.get(asset_id_check, 0)
                 
                 # Send assets update notification
                 if filtered_assets:
@@ -7,12 +7,58 @@ from datetime import datetime
 
 from lnbits.helpers import urlsafe_short_hash
 
-from ..models import AssetTransaction, AssetBalance
-from ..db_utils import transaction, with_transaction
+from ..models import AssetTransaction, AssetBalance, TaprootPayment, TxType
+from ..db_utils import now_cached, transaction, with_transaction
 from ..logging_utils import log_info, log_error, TRANSFER
 from ..error_utils import ErrorContext
 from ..db import db, get_table_name
 
+
+def _build_transactions_query(by_wallet: bool, by_asset: bool, by_cursor: bool) -> str:
+    """Build the asset transaction listing query for a combination of filters."""
+    table = get_table_name("asset_transactions")
+    where_clauses = []
+    if by_wallet:
+        where_clauses.append("wallet_id = :wallet_id")
+    if by_asset:
+        where_clauses.append("asset_id = :asset_id")
+    if by_cursor:
+        # Transactions sharing the cursor's created_at are told apart by id.
+        # The cursor only counts if it is one of the listed wallet's transactions.
+        cursor_row = f"SELECT created_at FROM {table} WHERE id = :cursor"
+        if by_wallet:
+            cursor_row += " AND wallet_id = :wallet_id"
+        where_clauses.append(
+            f"(created_at < ({cursor_row}) "
+            f"OR (created_at = ({cursor_row}) AND id < :cursor))"
+        )
+    
+    query = (
+        "SELECT id, wallet_id, asset_id, payment_hash, amount, fee, description, type, created_at "
+        f"FROM {table}"
+    )
+    if where_clauses:
+        query += " WHERE " + " AND ".join(where_clauses)
+    return query + " ORDER BY created_at DESC, id DESC LIMIT :limit"
+
+
+# Listing queries for every (wallet_id, asset_id, cursor) filter combination,
+# built once at import instead of on every call
+_TRANSACTIONS_QUERIES = {
+    (by_wallet, by_asset, by_cursor): _build_transactions_query(by_wallet, by_asset, by_cursor)
+    for by_wallet in (False, True)
+    for by_asset in (False, True)
+    for by_cursor in (False, True)
+}
+
+# Single balance lookup, served by the UNIQUE(wallet_id, asset_id) index
+_BALANCE_QUERY = (
+    "SELECT id, wallet_id, asset_id, balance, last_payment_hash, created_at, updated_at "
+    f"FROM {get_table_name('asset_balances')} "
+    "WHERE wallet_id = :wallet_id AND asset_id = :asset_id"
+)
+
+
 class TransactionService:
     """
     Unified service for handling all asset transaction operations.
@@ -20,7 +66,7 @@ class TransactionService:
     """
     
     @staticmethod
-    @with_transaction
+    @with_transaction(operation="record_transaction")
     async def record_transaction(
         wallet_id: str,
         asset_id: str,
@@ -54,11 +100,11 @@ class TransactionService:
         """
         with ErrorContext("record_transaction", TRANSFER):
             try:
-                now = datetime.now()
+                now = now_cached()
                 tx = None
                 
                 # For debit, amount should be negative for balance update
-                balance_change = amount if tx_type == 'credit' else -amount
+                balance_change = amount if tx_type == TxType.CREDIT else -amount
                 
                 # Step 1: Create transaction record if requested
                 if create_tx_record:
@@ -79,38 +125,32 @@ class TransactionService:
                     await conn.insert(get_table_name("asset_transactions"), tx)
                     log_info(TRANSFER, f"Transaction record created: {tx_id} for wallet {wallet_id}")
                 
-                # Step 2: Get current balance
-                balance = await TransactionService.get_asset_balance(wallet_id, asset_id, conn=conn)
+                # Step 2: Create or adjust the balance in one atomic UPSERT, so
+                # concurrent updates of the same balance can't overwrite each other
+                upsert = f"""
+                    INSERT INTO {get_table_name('asset_balances')} AS b
+                    (id, wallet_id, asset_id, balance, last_payment_hash, created_at, updated_at)
+                    VALUES (:id, :wallet_id, :asset_id, :balance, :last_payment_hash, :now, :now)
+                    ON CONFLICT (wallet_id, asset_id) DO UPDATE SET
+                        balance = b.balance + excluded.balance,
+                        last_payment_hash = COALESCE(excluded.last_payment_hash, b.last_payment_hash),
+                        updated_at = excluded.updated_at
+                """
+                params = {
+                    "id": urlsafe_short_hash(),
+                    "wallet_id": wallet_id,
+                    "asset_id": asset_id,
+                    "balance": balance_change,
+                    "last_payment_hash": payment_hash,
+                    "now": now
+                }
                 
-                # Step 3: Update or create balance
-                if balance:
-                    # Update existing balance
-                    balance.balance += balance_change
-                    if payment_hash:
-                        balance.last_payment_hash = payment_hash
-                    balance.updated_at = now
-                    
-                    # Update in database
-                    await conn.update(
-                        get_table_name("asset_balances"),
-                        balance,
-                        "WHERE wallet_id = :wallet_id AND asset_id = :asset_id"
-                    )
+                if db.type == "SQLITE":
+                    # RETURNING needs SQLite 3.35, so read the row back instead
+                    await conn.execute(upsert, params)
+                    balance = await TransactionService.get_asset_balance(wallet_id, asset_id, conn=conn)
                 else:
-                    # Create new balance
-                    balance_id = urlsafe_short_hash()
-                    balance = AssetBalance(
-                        id=balance_id,
-                        wallet_id=wallet_id,
-                        asset_id=asset_id,
-                        balance=balance_change,
-                        last_payment_hash=payment_hash,
-                        created_at=now,
-                        updated_at=now
-                    )
-                    
-                    # Insert new balance
-                    await conn.insert(get_table_name("asset_balances"), balance)
+                    balance = await conn.fetchone(f"{upsert} RETURNING *", params, AssetBalance)
                 
                 log_info(TRANSFER, f"Balance updated for wallet {wallet_id}, asset {asset_id}: {balance_change}")
                 return True, tx, balance
@@ -119,6 +159,168 @@ class TransactionService:
                 log_error(TRANSFER, f"Failed to record transaction: {str(e)}")
                 return False, None, None
     
+    @staticmethod
+    @with_transaction
+    async def record_transactions_bulk(
+        rows: List[Tuple[str, str, int, str]],
+        payment_hash: Optional[str] = None,
+        description: Optional[str] = None,
+        conn=None
+    ) -> bool:
+        """
+        Record several transactions and apply their balance changes in two statements.
+        
+        All transaction records go into a single multi-row INSERT, and all
+        balance changes into a single UPSERT that creates missing balances and
+        adjusts existing ones in place, instead of a read and a write per row.
+        
+        Args:
+            rows: List of (wallet_id, asset_id, amount, tx_type) tuples, where
+                  tx_type is 'credit' or 'debit' and amount is unsigned
+            payment_hash: Optional payment hash shared by all rows
+            description: Optional description shared by all rows
+            conn: Optional database connection
+            
+        Returns:
+            bool: Success status
+        """
+        if not rows:
+            return True
+        
+        with ErrorContext("record_transactions_bulk", TRANSFER):
+            try:
+                now = now_cached()
+                tx_params: Dict[str, Any] = {
+                    "payment_hash": payment_hash,
+                    "description": description,
+                    "now": now
+                }
+                tx_values = []
+                # Net balance change per (wallet_id, asset_id); a self-payment
+                # credits and debits the same balance
+                balance_changes: Dict[Tuple[str, str], int] = {}
+                
+                for i, (wallet_id, asset_id, amount, tx_type) in enumerate(rows):
+                    tx_params.update({
+                        f"id_{i}": urlsafe_short_hash(),
+                        f"wallet_id_{i}": wallet_id,
+                        f"asset_id_{i}": asset_id,
+                        f"amount_{i}": amount,
+                        f"type_{i}": tx_type
+                    })
+                    tx_values.append(
+                        f"(:id_{i}, :wallet_id_{i}, :asset_id_{i}, :payment_hash, "
+                        f":amount_{i}, 0, :description, :type_{i}, :now)"
+                    )
+                    key = (wallet_id, asset_id)
+                    change = amount if tx_type == TxType.CREDIT else -amount
+                    balance_changes[key] = balance_changes.get(key, 0) + change
+                
+                await conn.execute(
+                    f"""
+                    INSERT INTO {get_table_name('asset_transactions')}
+                    (id, wallet_id, asset_id, payment_hash, amount, fee, description, type, created_at)
+                    VALUES {", ".join(tx_values)}
+                    """,
+                    tx_params
+                )
+                
+                balance_params: Dict[str, Any] = {"payment_hash": payment_hash, "now": now}
+                balance_values = []
+                for i, ((wallet_id, asset_id), change) in enumerate(balance_changes.items()):
+                    balance_params.update({
+                        f"id_{i}": urlsafe_short_hash(),
+                        f"wallet_id_{i}": wallet_id,
+                        f"asset_id_{i}": asset_id,
+                        f"balance_{i}": change
+                    })
+                    balance_values.append(
+                        f"(:id_{i}, :wallet_id_{i}, :asset_id_{i}, :balance_{i}, "
+                        f":payment_hash, :now, :now)"
+                    )
+                
+                await conn.execute(
+                    f"""
+                    INSERT INTO {get_table_name('asset_balances')} AS b
+                    (id, wallet_id, asset_id, balance, last_payment_hash, created_at, updated_at)
+                    VALUES {", ".join(balance_values)}
+                    ON CONFLICT (wallet_id, asset_id) DO UPDATE SET
+                        balance = b.balance + excluded.balance,
+                        last_payment_hash = COALESCE(excluded.last_payment_hash, b.last_payment_hash),
+                        updated_at = excluded.updated_at
+                    """,
+                    balance_params
+                )
+                
+                log_info(TRANSFER, f"Recorded {len(rows)} transactions, {len(balance_changes)} balances updated")
+                return True
+                
+            except Exception as e:
+                log_error(TRANSFER, f"Failed to record transactions: {str(e)}")
+                return False
+    
+    @staticmethod
+    @with_transaction(operation="record_payment")
+    async def record_payment_with_debit(payment: TaprootPayment, conn=None) -> None:
+        """
+        Record a sent payment together with its debit transaction and balance change.
+        
+        The balance is adjusted with an UPSERT rather than read and written
+        back. On PostgreSQL the three inserts are chained as data-modifying
+        CTEs into a single statement, so the whole write is one round trip;
+        SQLite runs them as three statements in the same transaction.
+        
+        Args:
+            payment: The payment record to insert
+            conn: Optional database connection
+            
+        Raises:
+            Exception: If any of the writes fails, so the transaction rolls back
+        """
+        params = {
+            **payment.dict(),
+            "tx_id": urlsafe_short_hash(),
+            "tx_type": TxType.DEBIT,
+            "balance_id": urlsafe_short_hash(),
+            "balance_change": -payment.asset_amount
+        }
+        
+        payment_insert = f"""
+            INSERT INTO {get_table_name('payments')}
+            (id, payment_hash, payment_request, asset_id, asset_amount, fee_sats,
+             description, status, user_id, wallet_id, created_at, preimage)
+            VALUES (:id, :payment_hash, :payment_request, :asset_id, :asset_amount, :fee_sats,
+                    :description, :status, :user_id, :wallet_id, :created_at, :preimage)
+        """
+        transaction_insert = f"""
+            INSERT INTO {get_table_name('asset_transactions')}
+            (id, wallet_id, asset_id, payment_hash, amount, fee, description, type, created_at)
+            VALUES (:tx_id, :wallet_id, :asset_id, :payment_hash, :asset_amount, 0,
+                    :description, :tx_type, :created_at)
+        """
+        balance_upsert = f"""
+            INSERT INTO {get_table_name('asset_balances')} AS b
+            (id, wallet_id, asset_id, balance, last_payment_hash, created_at, updated_at)
+            VALUES (:balance_id, :wallet_id, :asset_id, :balance_change, :payment_hash,
+                    :created_at, :created_at)
+            ON CONFLICT (wallet_id, asset_id) DO UPDATE SET
+                balance = b.balance + excluded.balance,
+                last_payment_hash = excluded.last_payment_hash,
+                updated_at = excluded.updated_at
+        """
+        
+        if db.type == "SQLITE":
+            await conn.execute(payment_insert, params)
+            await conn.execute(transaction_insert, params)
+            await conn.execute(balance_upsert, params)
+        else:
+            await conn.execute(
+                f"WITH p AS ({payment_insert}), t AS ({transaction_insert}) {balance_upsert}",
+                params
+            )
+        
+        log_info(TRANSFER, f"Payment {payment.payment_hash[:8]}... recorded, wallet {payment.wallet_id} debited {payment.asset_amount}")
+    
     @staticmethod
     async def get_asset_balance(wallet_id: str, asset_id: str, conn=None) -> Optional[AssetBalance]:
         """
@@ -133,10 +335,7 @@ class TransactionService:
             Optional[AssetBalance]: The asset balance if found, None otherwise
         """
         return await (conn or db).fetchone(
-            f"""
-            SELECT * FROM {get_table_name('asset_balances')}
-            WHERE wallet_id = :wallet_id AND asset_id = :asset_id
-            """,
+            _BALANCE_QUERY,
             {
                 "wallet_id": wallet_id,
                 "asset_id": asset_id
@@ -144,6 +343,38 @@ class TransactionService:
             AssetBalance
         )
     
+    @staticmethod
+    async def get_asset_balances(wallet_id: str, asset_ids: List[str], conn=None) -> Dict[str, int]:
+        """
+        Get balances for several assets of a wallet in a single query.
+        
+        Args:
+            wallet_id: The wallet ID to get balances for
+            asset_ids: The asset IDs to get balances for
+            conn: Optional database connection to reuse
+            
+        Returns:
+            Dict[str, int]: Mapping of asset ID to balance; assets without a
+            balance record are omitted
+        """
+        if not asset_ids:
+            return {}
+        
+        params: Dict[str, Any] = {"wallet_id": wallet_id}
+        placeholders = []
+        for i, asset_id in enumerate(asset_ids):
+            params[f"asset_id_{i}"] = asset_id
+            placeholders.append(f":asset_id_{i}")
+        
+        rows = await (conn or db).fetchall(
+            f"""
+            SELECT asset_id, balance FROM {get_table_name('asset_balances')}
+            WHERE wallet_id = :wallet_id AND asset_id IN ({", ".join(placeholders)})
+            """,
+            params
+        )
+        return {row["asset_id"]: row["balance"] for row in rows}
+    
     @staticmethod
     async def get_wallet_asset_balances(wallet_id: str) -> List[AssetBalance]:
         """
@@ -169,36 +400,49 @@ class TransactionService:
     async def get_asset_transactions(
         wallet_id: Optional[str] = None,
         asset_id: Optional[str] = None,
-        limit: int = 100
-    ) -> List[AssetTransaction]:
+        limit: int = 100,
+        cursor: Optional[str] = None
+    ) -> Tuple[List[AssetTransaction], Optional[str]]:
         """
-        Get asset transactions, optionally filtered by wallet and/or asset.
+        Get a page of asset transactions, optionally filtered by wallet and/or asset.
+        
+        Uses keyset pagination on (created_at, id), so pages stay stable while
+        new transactions are inserted and transactions sharing a timestamp
+        are neither skipped nor repeated.
         
         Args:
             wallet_id: Optional wallet ID to filter by
             asset_id: Optional asset ID to filter by
             limit: Maximum number of transactions to return
+            cursor: ID of the last transaction of the previous page, None for the first page
             
         Returns:
-            List[AssetTransaction]: List of asset transactions
+            Tuple containing:
+            - transactions (List[AssetTransaction]): The page of transactions, newest first
+            - next_cursor (Optional[str]): Cursor for the next page, None if this is the last page
+            
+        Raises:
+            ValueError: If the cursor is not one of the wallet's transactions
         """
-        # Build query
-        query = f"SELECT * FROM {get_table_name('asset_transactions')}"
-        params = {}
-        where_clauses = []
-
+        # Only the filters' parameters vary per call, the query is prebuilt
+        query = _TRANSACTIONS_QUERIES[(bool(wallet_id), bool(asset_id), bool(cursor))]
+        params: Dict[str, Any] = {"limit": limit}
         if wallet_id:
-            where_clauses.append("wallet_id = :wallet_id")
             params["wallet_id"] = wallet_id
-
         if asset_id:
-            where_clauses.append("asset_id = :asset_id")
             params["asset_id"] = asset_id
+        if cursor:
+            params["cursor"] = cursor
 
-        if where_clauses:
-            query += " WHERE " + " AND ".join(where_clauses)
-
-        query += " ORDER BY created_at DESC LIMIT :limit"
-        params["limit"] = limit
-
-        return await db.fetchall(query, params, AssetTransaction)
+        transactions = await db.fetchall(query, params, AssetTransaction)
+        # An empty page is either the end of the history or a cursor that isn't the wallet's
+        if cursor and not transactions:
+            cursor_query = f"SELECT id FROM {get_table_name('asset_transactions')} WHERE id = :cursor"
+            cursor_params = {"cursor": cursor}
+            if wallet_id:
+                cursor_query += " AND wallet_id = :wallet_id"
+                cursor_params["wallet_id"] = wallet_id
+            if not await db.fetchone(cursor_query, cursor_params):
+                raise ValueError(f"Unknown cursor: {cursor}")
+        next_cursor = transactions[-1].id if len(transactions) == limit else None
+        return transactions, next_cursor
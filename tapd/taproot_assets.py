@@ -1,15 +1,45 @@
+import asyncio
+import functools
+import hashlib
 import json
-from typing import List, Dict, Any, Optional
+import random
+import time
+import grpc
+import grpc.aio
+from collections import OrderedDict, defaultdict
+from typing import Awaitable, Callable, List, Dict, Any, Optional
 from loguru import logger
 
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional
+    orjson = None
+
 from lnbits.utils.cache import cache
 
 from .taproot_adapter import (
     taprootassets_pb2,
-    lightning_pb2
+    lightning_pb2,
+    router_pb2,
+    router_pb2_grpc
 )
 from ..tapd_settings import ASSET_CACHE_EXPIRY_SECONDS
 
+
+def _parse_channel_data(data: bytes) -> Dict[str, Any]:
+    """Parse a channel's custom_channel_data JSON, using orjson when it is installed."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _amounts_by_asset(entries: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Map each asset ID to the amount of its first entry in a channel's asset list."""
+    amounts: Dict[str, Any] = {}
+    for entry in entries:
+        amounts.setdefault(entry.get("asset_id"), entry.get("amount", 0))
+    return amounts
+
 class TaprootAssetManager:
     """
     Handles Taproot Asset management functionality.
@@ -21,6 +51,27 @@ class TaprootAssetManager:
     CHANNEL_ASSET_CACHE_KEY = "taproot:channel_assets:list"
     ASSET_CACHE_EXPIRY = ASSET_CACHE_EXPIRY_SECONDS
 
+    # Maximum number of parsed custom_channel_data payloads kept per manager
+    CHANNEL_DATA_CACHE_MAX_SIZE = 256
+
+    # In-flight refreshes per cache key, shared by all managers like the cache
+    _inflight: Dict[str, asyncio.Task] = {}
+
+    # Exponent of the early refresh probability, (age / expiry) ** exponent.
+    # Higher values keep entries longer before refreshing them early.
+    EARLY_REFRESH_EXPONENT = 4
+
+    # Delay before resubscribing to node events after a stream ends (in seconds),
+    # doubled on every consecutive failure up to the maximum
+    EVENT_RESUBSCRIBE_DELAY = 5
+    EVENT_RESUBSCRIBE_MAX_DELAY = 300
+
+    # Stream errors resubscribing won't fix, the stream is given up on
+    EVENT_PERMANENT_ERRORS = (grpc.StatusCode.UNIMPLEMENTED, grpc.StatusCode.PERMISSION_DENIED)
+
+    # Cache invalidation watchers, one per daemon host
+    _event_watchers: Dict[str, asyncio.Task] = {}
+
     def __init__(self, node):
         """
         Initialize the asset manager with a reference to the node.
@@ -29,6 +80,253 @@ class TaprootAssetManager:
             node: The TaprootAssetsNodeExtension instance
         """
         self.node = node
+        # Parsed custom_channel_data keyed by a digest of the raw bytes, so
+        # unchanged channels aren't parsed again on every refresh
+        self._cdata_cache: "OrderedDict[bytes, Dict[str, Any]]" = OrderedDict()
+        self._start_event_watcher()
+
+    @classmethod
+    def invalidate_cache(cls) -> None:
+        """Drop the cached asset and channel asset lists, so the next call refetches them."""
+        cache.pop(cls.ASSET_CACHE_KEY)
+        cache.pop(cls.CHANNEL_ASSET_CACHE_KEY)
+
+    def _start_event_watcher(self) -> None:
+        """
+        Start the cache invalidation watcher of this manager's daemon, once per host.
+
+        Managers are created per wallet, but they all share the same cache,
+        so a single set of event streams per daemon is enough.
+        """
+        host = getattr(self.node, "host", None)
+        if not host or not hasattr(self.node, "ln_stub") or not hasattr(self.node, "ln_channel"):
+            # Parser clients only talk to tapd, the TTL covers them
+            return
+
+        watcher = self._event_watchers.get(host)
+        if watcher is not None and not watcher.done():
+            return
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Not created inside the event loop, the next manager starts it
+            return
+        self._event_watchers[host] = loop.create_task(self._watch_events())
+
+    @classmethod
+    def stop_event_watchers(cls) -> None:
+        """Cancel the cache invalidation watchers of all daemons."""
+        for watcher in cls._event_watchers.values():
+            watcher.cancel()
+        cls._event_watchers.clear()
+
+    async def _watch_events(self) -> None:
+        """
+        Invalidate the asset caches whenever the node reports a balance-changing event.
+
+        Watches LND channel events, settled incoming invoices and completed
+        outgoing payments, plus tapd asset receives and sends. When any stream
+        ends the others are torn down too, the caches are dropped (events may
+        have been missed) and everything is resubscribed after a delay that
+        grows while the streams keep failing. Streams the node refuses for
+        good are dropped, the cache TTL covers their events.
+        """
+        router_stub = router_pb2_grpc.RouterStub(self.node.ln_channel)
+        subscriptions: Dict[str, Any] = {
+            "channel events": (
+                lambda: self.node.ln_stub.SubscribeChannelEvents(lightning_pb2.ChannelEventSubscription()),
+                None
+            ),
+            "invoices": (
+                lambda: self.node.ln_stub.SubscribeInvoices(lightning_pb2.InvoiceSubscription()),
+                lambda invoice: invoice.state == lightning_pb2.Invoice.SETTLED
+            ),
+            "payments": (
+                lambda: router_stub.TrackPayments(router_pb2.TrackPaymentsRequest(no_inflight_updates=True)),
+                lambda payment: payment.status == lightning_pb2.Payment.SUCCEEDED
+            ),
+            "asset receives": (
+                lambda: self.node.stub.SubscribeReceiveEvents(taprootassets_pb2.SubscribeReceiveEventsRequest()),
+                None
+            ),
+            "asset sends": (
+                lambda: self.node.stub.SubscribeSendEvents(taprootassets_pb2.SubscribeSendEventsRequest()),
+                None
+            ),
+        }
+
+        delay = self.EVENT_RESUBSCRIBE_DELAY
+        while subscriptions:
+            started = time.monotonic()
+            tasks = {
+                asyncio.ensure_future(self._invalidate_on(name, subscribe(), predicate)): name
+                for name, (subscribe, predicate) in subscriptions.items()
+            }
+            try:
+                done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+            for task in done:
+                if task.result():
+                    logger.warning(f"Not resubscribing to {tasks[task]}, the node refused the subscription")
+                    del subscriptions[tasks[task]]
+
+            self.invalidate_cache()
+            if not subscriptions:
+                break
+
+            # Streams that stayed up for a while don't count as repeated failures
+            if time.monotonic() - started >= self.EVENT_RESUBSCRIBE_MAX_DELAY:
+                delay = self.EVENT_RESUBSCRIBE_DELAY
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.EVENT_RESUBSCRIBE_MAX_DELAY)
+
+    async def _invalidate_on(
+        self,
+        name: str,
+        stream,
+        predicate: Optional[Callable[[Any], bool]] = None
+    ) -> bool:
+        """
+        Invalidate the asset caches on every (matching) event of a stream.
+
+        Args:
+            name: Stream name for logging
+            stream: The gRPC server stream to consume
+            predicate: Optional filter, events it rejects are ignored
+
+        Returns:
+            bool: True if the stream ended with an error resubscribing won't fix
+        """
+        try:
+            async for event in stream:
+                if predicate is None or predicate(event):
+                    logger.debug(f"Invalidating asset caches on {name} event")
+                    self.invalidate_cache()
+        except asyncio.CancelledError:
+            stream.cancel()
+            raise
+        except grpc.aio.AioRpcError as e:
+            logger.debug(f"Subscription to {name} ended: {e.code()}: {e.details()}")
+            return e.code() in self.EVENT_PERMANENT_ERRORS
+        except Exception as e:
+            logger.debug(f"Subscription to {name} ended: {e}")
+        return False
+
+    def _parse_cached_channel_data(self, data: bytes) -> Dict[str, Any]:
+        """
+        Parse a channel's custom_channel_data, reusing the result for unchanged data.
+
+        The parsed structure is shared between refreshes and must not be mutated.
+
+        Args:
+            data: The raw custom_channel_data bytes
+
+        Returns:
+            Dict[str, Any]: The parsed channel data
+        """
+        key = hashlib.blake2b(data, digest_size=16).digest()
+        parsed = self._cdata_cache.get(key)
+        if parsed is None:
+            parsed = _parse_channel_data(data)
+            self._cdata_cache[key] = parsed
+            if len(self._cdata_cache) > self.CHANNEL_DATA_CACHE_MAX_SIZE:
+                self._cdata_cache.popitem(last=False)
+        return parsed
+
+    async def _single_flight(
+        self,
+        key: str,
+        fetch: Callable[[], Awaitable[List[Dict[str, Any]]]]
+    ) -> List[Dict[str, Any]]:
+        """
+        Run a cache refresh once for all concurrent callers of the same key.
+
+        The first caller runs the fetch, everyone arriving while it is in
+        flight awaits the same result instead of calling tapd or LND again.
+
+        Args:
+            key: The cache key being refreshed
+            fetch: Coroutine function performing the refresh
+
+        Returns:
+            List[Dict[str, Any]]: The refreshed list
+        """
+        return await asyncio.shield(self._refresh(key, fetch))
+
+    def _refresh(
+        self,
+        key: str,
+        fetch: Callable[[], Awaitable[List[Dict[str, Any]]]]
+    ) -> asyncio.Task:
+        """
+        Get the in-flight refresh of a key, starting one if there is none.
+
+        The refresh runs in its own task, so a caller being cancelled only
+        stops that caller from waiting and never fails the shared refresh.
+
+        Args:
+            key: The cache key being refreshed
+            fetch: Coroutine function performing the refresh
+
+        Returns:
+            asyncio.Task: The task performing the refresh
+        """
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(fetch())
+            self._inflight[key] = task
+            task.add_done_callback(functools.partial(self._refresh_done, key))
+        return task
+
+    @classmethod
+    def _refresh_done(cls, key: str, task: asyncio.Task) -> None:
+        """Forget a finished refresh and retrieve its exception, if any."""
+        if cls._inflight.get(key) is task:
+            del cls._inflight[key]
+        if not task.cancelled():
+            task.exception()
+
+    def _get_cached(
+        self,
+        key: str,
+        fetch: Callable[[], Awaitable[List[Dict[str, Any]]]]
+    ) -> Optional[List[Dict[str, Any]]]:
+        """
+        Get a cached list, refreshing it early in the background now and then.
+
+        The closer an entry gets to its expiry, the likelier a hit starts a
+        background refresh while still returning the cached list (XFetch),
+        so entries are usually replaced before they expire and callers
+        rarely wait for tapd or LND.
+
+        Args:
+            key: The cache key
+            fetch: Coroutine function refreshing and caching the list
+
+        Returns:
+            Optional[List[Dict[str, Any]]]: The cached list, or None on a miss
+        """
+        entry = cache.get(key)
+        if not entry:
+            return None
+        value, cached_at = entry
+        if not value:
+            return None
+
+        age = (time.monotonic() - cached_at) / self.ASSET_CACHE_EXPIRY
+        if key not in self._inflight and random.random() < age ** self.EARLY_REFRESH_EXPONENT:
+            logger.debug(f"Refreshing {key} early in the background")
+            self._refresh(key, fetch)
+        return value
+
+    def _set_cached(self, key: str, value: List[Dict[str, Any]]) -> None:
+        """Cache a list together with its insertion time for early refreshes."""
+        cache.set(key, (value, time.monotonic()), expiry=self.ASSET_CACHE_EXPIRY)
 
     async def list_assets(self, force_refresh=False) -> List[Dict[str, Any]]:
         """
@@ -44,12 +342,30 @@ class TaprootAssetManager:
         
         # Check cache first if not forcing refresh
         if not force_refresh:
-            cached_assets = cache.get(self.ASSET_CACHE_KEY)
+            cached_assets = self._get_cached(
+                self.ASSET_CACHE_KEY,
+                lambda: self._fetch_assets(force_refresh=False)
+            )
             if cached_assets:
                 logger.info(f"Returning {len(cached_assets)} cached assets")
                 return cached_assets
         
         logger.info("No cache hit, fetching from tapd")
+        return await self._single_flight(
+            self.ASSET_CACHE_KEY,
+            lambda: self._fetch_assets(force_refresh)
+        )
+
+    async def _fetch_assets(self, force_refresh: bool) -> List[Dict[str, Any]]:
+        """
+        Fetch all Taproot Assets from tapd, merge their channels and cache them.
+
+        Args:
+            force_refresh: Whether to force a refresh of the channel assets
+
+        Returns:
+            List[Dict[str, Any]]: List of assets, empty on error
+        """
         try:
             # Get all assets from tapd
             logger.info("Creating ListAssetRequest")
@@ -60,37 +376,44 @@ class TaprootAssetManager:
             logger.info(f"Node host: {self.node.host}")
             logger.info(f"Request params: with_witness={request.with_witness}, include_spent={request.include_spent}, include_leased={request.include_leased}, include_unconfirmed_mints={request.include_unconfirmed_mints}")
             
-            response = await self.node.stub.ListAssets(request, timeout=10)
+            # The channel assets don't depend on the assets, so both round
+            # trips run concurrently
+            response, channel_assets = await asyncio.gather(
+                self.node.stub.ListAssets(request, timeout=10),
+                self.list_channel_assets(force_refresh=force_refresh),
+                return_exceptions=True
+            )
+            if isinstance(response, BaseException):
+                raise response
+            if isinstance(channel_assets, BaseException):
+                raise channel_assets
             logger.info(f"ListAssets RPC completed successfully, got {len(response.assets)} assets")
 
-            # Convert response assets to dictionary format
-            assets = []
-            for asset in response.assets:
-                assets.append({
-                    "name": asset.asset_genesis.name.decode('utf-8') if isinstance(asset.asset_genesis.name, bytes) else asset.asset_genesis.name,
-                    "asset_id": asset.asset_genesis.asset_id.hex() if isinstance(asset.asset_genesis.asset_id, bytes) else asset.asset_genesis.asset_id,
+            # Convert response assets to dictionary format. The protobuf
+            # fields are typed, so names are always str and IDs, hashes and
+            # keys always bytes.
+            assets = [
+                {
+                    "name": asset.asset_genesis.name,
+                    "asset_id": asset.asset_genesis.asset_id.hex(),
                     "type": str(asset.asset_genesis.asset_type),
                     "amount": str(asset.amount),
                     "genesis_point": asset.asset_genesis.genesis_point,
-                    "meta_hash": asset.asset_genesis.meta_hash.hex() if isinstance(asset.asset_genesis.meta_hash, bytes) else asset.asset_genesis.meta_hash,
+                    "meta_hash": asset.asset_genesis.meta_hash.hex(),
                     "version": str(asset.version),
                     "is_spent": asset.is_spent,
-                    "script_key": asset.script_key.hex() if isinstance(asset.script_key, bytes) else asset.script_key
-                })
-
-            # Get channel assets
-            channel_assets = await self.list_channel_assets(force_refresh=force_refresh)
+                    "script_key": asset.script_key.hex()
+                }
+                for asset in response.assets
+            ]
 
             # Create asset map for lookup
             asset_map = {asset["asset_id"]: asset for asset in assets}
             
             # Group channel assets by asset_id
-            channel_assets_by_id = {}
+            channel_assets_by_id = defaultdict(list)
             for channel_asset in channel_assets:
-                asset_id = channel_asset["asset_id"]
-                if asset_id not in channel_assets_by_id:
-                    channel_assets_by_id[asset_id] = []
-                channel_assets_by_id[asset_id].append(channel_asset)
+                channel_assets_by_id[channel_asset["asset_id"]].append(channel_asset)
 
             # Process assets with channels
             result_assets = []
@@ -104,20 +427,23 @@ class TaprootAssetManager:
                     "amount": "0",
                 })
                 
-                # Add each channel as a separate asset entry
-                for channel in channels:
-                    asset_with_channel = base_asset.copy()
-                    asset_with_channel["channel_info"] = {
-                        "channel_point": channel["channel_point"],
-                        "capacity": channel["capacity"],
-                        "local_balance": channel["local_balance"],
-                        "remote_balance": channel["remote_balance"],
-                        "peer_pubkey": channel["remote_pubkey"],
-                        "channel_id": channel["channel_id"],
-                        "active": channel.get("active", True)  # Add active status
+                # Add each channel as a separate asset entry, merged over the base asset
+                result_assets.extend(
+                    {
+                        **base_asset,
+                        "channel_info": {
+                            "channel_point": channel["channel_point"],
+                            "capacity": channel["capacity"],
+                            "local_balance": channel["local_balance"],
+                            "remote_balance": channel["remote_balance"],
+                            "peer_pubkey": channel["remote_pubkey"],
+                            "channel_id": channel["channel_id"],
+                            "active": channel.get("active", True)  # Add active status
+                        },
+                        "amount": str(channel["local_balance"])
                     }
-                    asset_with_channel["amount"] = str(channel["local_balance"])
-                    result_assets.append(asset_with_channel)
+                    for channel in channels
+                )
             
             # We're not adding non-channel assets anymore, per the requirements
             # The commented code below would add regular assets without channels
@@ -129,7 +455,7 @@ class TaprootAssetManager:
             #         result_assets.append(asset)
 
             # Store in cache before returning
-            cache.set(self.ASSET_CACHE_KEY, result_assets, expiry=self.ASSET_CACHE_EXPIRY)
+            self._set_cached(self.ASSET_CACHE_KEY, result_assets)
             return result_assets
         except Exception as e:
             logger.error(f"Failed to list assets: {str(e)}")
@@ -151,9 +477,18 @@ class TaprootAssetManager:
         """
         # Check cache first if not forcing refresh
         if not force_refresh:
-            cached_assets = cache.get(self.CHANNEL_ASSET_CACHE_KEY)
+            cached_assets = self._get_cached(self.CHANNEL_ASSET_CACHE_KEY, self._fetch_channel_assets)
             if cached_assets:
                 return cached_assets
+        return await self._single_flight(self.CHANNEL_ASSET_CACHE_KEY, self._fetch_channel_assets)
+
+    async def _fetch_channel_assets(self) -> List[Dict[str, Any]]:
+        """
+        Fetch the Lightning channels with Taproot Assets from LND and cache them.
+
+        Returns:
+            List[Dict[str, Any]]: List of channel assets, empty on error
+        """
         try:
             # Get channels from LND
             request = lightning_pb2.ListChannelsRequest()
@@ -161,18 +496,24 @@ class TaprootAssetManager:
 
             channel_assets = []
 
-            # Process each channel
-            for channel in response.channels:
-                # Skip channels without custom_channel_data
-                if not hasattr(channel, 'custom_channel_data') or not channel.custom_channel_data:
-                    continue
-                    
+            # Process each channel, skipping those without custom_channel_data
+            # (anything shorter than "{}" can't hold assets)
+            asset_channels = [
+                channel for channel in response.channels
+                if len(channel.custom_channel_data) >= 2
+            ]
+            for channel in asset_channels:
                 try:
-                    # Parse JSON data
-                    asset_data = json.loads(channel.custom_channel_data.decode('utf-8'))
+                    # Parse JSON data straight from the bytes
+                    asset_data = self._parse_cached_channel_data(channel.custom_channel_data)
                     
                     # Handle new v0.15.0 format with funding_assets
                     if "funding_assets" in asset_data:
+                        # Index the balances once per channel instead of
+                        # scanning them for every funding asset
+                        local_balances = _amounts_by_asset(asset_data.get("local_assets", []))
+                        remote_balances = _amounts_by_asset(asset_data.get("remote_assets", []))
+                        
                         # Process funding assets (contains full asset details)
                         for asset in asset_data.get("funding_assets", []):
                             asset_genesis = asset.get("asset_genesis", {})
@@ -182,20 +523,6 @@ class TaprootAssetManager:
                             if not asset_id:
                                 continue
                             
-                            # Get balance info from local_assets
-                            local_balance = 0
-                            for local_asset in asset_data.get("local_assets", []):
-                                if local_asset.get("asset_id") == asset_id:
-                                    local_balance = local_asset.get("amount", 0)
-                                    break
-                            
-                            # Get remote balance
-                            remote_balance = 0
-                            for remote_asset in asset_data.get("remote_assets", []):
-                                if remote_asset.get("asset_id") == asset_id:
-                                    remote_balance = remote_asset.get("amount", 0)
-                                    break
-                            
                             asset_info = {
                                 "asset_id": asset_id,
                                 "name": name,
@@ -203,8 +530,8 @@ class TaprootAssetManager:
                                 "channel_point": channel.channel_point,
                                 "remote_pubkey": channel.remote_pubkey,
                                 "capacity": asset_data.get("capacity", 0),
-                                "local_balance": local_balance,
-                                "remote_balance": remote_balance,
+                                "local_balance": local_balances.get(asset_id, 0),
+                                "remote_balance": remote_balances.get(asset_id, 0),
                                 "commitment_type": str(channel.commitment_type),
                                 "active": channel.active
                             }
@@ -253,7 +580,7 @@ class TaprootAssetManager:
                     continue
                     
             # Store in cache before returning
-            cache.set(self.CHANNEL_ASSET_CACHE_KEY, channel_assets, expiry=self.ASSET_CACHE_EXPIRY)
+            self._set_cached(self.CHANNEL_ASSET_CACHE_KEY, channel_assets)
             return channel_assets
         except Exception as e:
             logger.debug(f"Error listing channel assets: {e}")
@@ -5,6 +5,7 @@ from lnbits.utils.cache import cache
 from .taproot_wallet import TaprootWalletExtension
 from .taproot_node import TaprootAssetsNodeExtension
 from ..logging_utils import log_info, log_debug, log_warning, FACTORY, LogContext
+from ..db_utils import AsyncKeyedLock
 
 
 class TaprootAssetsFactory:
@@ -19,6 +20,9 @@ class TaprootAssetsFactory:
     # Cache expiry time in seconds
     WALLET_CACHE_EXPIRY = 3600  # 1 hour
     
+    # Per-wallet creation locks, so concurrent first requests share one instance
+    _creation_locks = AsyncKeyedLock()
+    
     @classmethod
     async def create_wallet_and_node(
         cls,
@@ -49,20 +53,72 @@ class TaprootAssetsFactory:
         Returns:
             tuple: (wallet, node) - The initialized wallet and node instances
         """
-        # Check if we have valid user_id and wallet_id for caching
-        if user_id and wallet_id:
-            cache_key = f"taproot:wallet:{user_id}:{wallet_id}"
+        # Without a user_id and wallet_id there is nothing to cache
+        if not (user_id and wallet_id):
+            return cls._create_wallet_and_node(
+                user_id, wallet_id, host, network, tls_cert_path, macaroon_path,
+                ln_macaroon_path, ln_macaroon_hex, tapd_macaroon_hex
+            )
+        
+        cache_key = f"taproot:wallet:{user_id}:{wallet_id}"
+        cached = cls._get_cached_wallet(cache_key, user_id, wallet_id)
+        if cached:
+            return cached
+        
+        async with cls._creation_locks(cache_key):
+            # Another request may have created the wallet while we waited
+            cached = cls._get_cached_wallet(cache_key, user_id, wallet_id)
+            if cached:
+                return cached
             
-            # Check if we already have a wallet instance for this user and wallet
-            wallet = cache.get(cache_key)
-            if wallet and wallet.initialized and wallet.node:
-                log_debug(FACTORY, f"Using cached wallet instance for user {user_id}, wallet {wallet_id}")
-                return wallet, wallet.node
-            elif wallet:
-                # If the wallet exists but isn't properly initialized, remove it from cache
-                log_warning(FACTORY, f"Found uninitialized wallet in cache for {user_id}, {wallet_id}. Recreating.")
-                cache.pop(cache_key)
+            wallet, node = cls._create_wallet_and_node(
+                user_id, wallet_id, host, network, tls_cert_path, macaroon_path,
+                ln_macaroon_path, ln_macaroon_hex, tapd_macaroon_hex
+            )
+            cache.set(cache_key, wallet, expiry=cls.WALLET_CACHE_EXPIRY)
+            return wallet, node
+    
+    @staticmethod
+    def _get_cached_wallet(
+        cache_key: str,
+        user_id: str,
+        wallet_id: str
+    ) -> Optional[Tuple[TaprootWalletExtension, TaprootAssetsNodeExtension]]:
+        """
+        Get a cached, initialized wallet and its node.
         
+        Args:
+            cache_key: The wallet's cache key
+            user_id: User ID of the wallet
+            wallet_id: ID of the wallet
+            
+        Returns:
+            tuple: (wallet, node) if an initialized wallet is cached, None otherwise
+        """
+        # Check if we already have a wallet instance for this user and wallet
+        wallet = cache.get(cache_key)
+        if wallet and wallet.initialized and wallet.node:
+            log_debug(FACTORY, f"Using cached wallet instance for user {user_id}, wallet {wallet_id}")
+            return wallet, wallet.node
+        elif wallet:
+            # If the wallet exists but isn't properly initialized, remove it from cache
+            log_warning(FACTORY, f"Found uninitialized wallet in cache for {user_id}, {wallet_id}. Recreating.")
+            cache.pop(cache_key)
+        return None
+    
+    @staticmethod
+    def _create_wallet_and_node(
+        user_id: Optional[str],
+        wallet_id: Optional[str],
+        host: Optional[str],
+        network: Optional[str],
+        tls_cert_path: Optional[str],
+        macaroon_path: Optional[str],
+        ln_macaroon_path: Optional[str],
+        ln_macaroon_hex: Optional[str],
+        tapd_macaroon_hex: Optional[str]
+    ) -> Tuple[TaprootWalletExtension, TaprootAssetsNodeExtension]:
+        """Create a wallet and its node and link them together."""
         with LogContext(FACTORY, f"Creating wallet and node for user {user_id}, wallet {wallet_id}"):
             # Create wallet
             # Create wallet instance
@@ -88,11 +144,6 @@ class TaprootAssetsFactory:
             wallet.node = node
             wallet.initialized = True
             
-            # Add to cache if we have a valid user_id and wallet_id
-            if user_id and wallet_id:
-                cache_key = f"taproot:wallet:{user_id}:{wallet_id}"
-                cache.set(cache_key, wallet, expiry=cls.WALLET_CACHE_EXPIRY)
-            
             log_info(FACTORY, f"Successfully created wallet and node for user {user_id}, wallet {wallet_id}")
             return wallet, node
 
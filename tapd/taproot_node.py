@@ -54,6 +54,9 @@ class TaprootAssetsNodeExtension(Node):
     # Cache expiry times in seconds
     PREIMAGE_CACHE_EXPIRY = 86400  # 24 hours
     ASSET_ID_CACHE_EXPIRY = 86400  # 24 hours
+    
+    # gRPC channels shared by all nodes, keyed by (host, cert, macaroon)
+    _shared_channels: Dict[tuple, grpc.aio.Channel] = {}
 
     def _store_preimage(self, payment_hash: str, preimage: str):
         """Store a preimage for a given payment hash."""
@@ -160,19 +163,18 @@ class TaprootAssetsNodeExtension(Node):
             self.credentials, self.ln_auth_creds
         )
 
-        # Create gRPC channels
-        # Create gRPC channels
-        self.channel = grpc.aio.secure_channel(self.host, self.combined_creds)
+        # Create gRPC channels, reusing the ones already open to this daemon
+        self.channel = self._get_shared_channel(self.host, self.cert, self.macaroon, self.combined_creds)
         
         self.stub = create_taprootassets_client(self.channel)
 
         # Create Lightning gRPC channel
-        self.ln_channel = grpc.aio.secure_channel(self.host, self.ln_combined_creds)
+        self.ln_channel = self._get_shared_channel(self.host, self.cert, self.ln_macaroon, self.ln_combined_creds)
         self.ln_stub = create_lightning_client(self.ln_channel)
         self.invoices_stub = create_invoices_client(self.ln_channel)
 
-        # Create TaprootAssetChannels gRPC channel
-        self.tap_channel = grpc.aio.secure_channel(self.host, self.combined_creds)
+        # TaprootAssetChannels calls are multiplexed on the Taproot Assets channel
+        self.tap_channel = self.channel
         self.tapchannel_stub = create_tapchannel_client(self.tap_channel)
 
         # Initialize managers
@@ -186,6 +188,32 @@ class TaprootAssetsNodeExtension(Node):
         # Note: Asset transfer monitoring has been removed as it was not fully implemented
         # All connections initialized
     
+    @classmethod
+    def _get_shared_channel(cls, host: str, cert: bytes, macaroon, credentials) -> grpc.aio.Channel:
+        """
+        Get the async gRPC channel for a daemon and macaroon, creating it once.
+        
+        Nodes are created per wallet, so sharing channels keeps a single
+        HTTP/2 connection (and TLS handshake) per daemon instead of one per
+        wallet. Stubs created on the channel multiplex their calls over it.
+        
+        Args:
+            host: The daemon's host:port
+            cert: The daemon's TLS certificate
+            macaroon: The macaroon the channel authenticates with
+            credentials: The composite channel credentials to use
+            
+        Returns:
+            grpc.aio.Channel: The shared channel
+        """
+        key = (host, cert, macaroon)
+        channel = cls._shared_channels.get(key)
+        if channel is None:
+            log_debug(NODE, f"Opening gRPC channel to {host}")
+            channel = grpc.aio.secure_channel(host, credentials)
+            cls._shared_channels[key] = channel
+        return channel
+    
     def _try_litd_integrated_mode(self, lnbits_settings):
         """Try to configure for litd integrated mode using LNbits LND settings."""
         try:
@@ -468,12 +496,13 @@ class TaprootAssetsNodeExtension(Node):
         payment_request: str,
         fee_limit_sats: Optional[int] = None,
         asset_id: Optional[str] = None,
-        peer_pubkey: Optional[str] = None
+        peer_pubkey: Optional[str] = None,
+        payment_hash: Optional[str] = None
     ) -> Dict[str, Any]:
         """Pay a Taproot Asset invoice."""
         with LogContext(NODE, "paying asset invoice", log_level="info"):
             return await self.payment_manager.pay_asset_invoice(
-                payment_request, fee_limit_sats, asset_id, peer_pubkey
+                payment_request, fee_limit_sats, asset_id, peer_pubkey, payment_hash
             )
 
     async def update_after_payment(
@@ -500,9 +529,20 @@ class TaprootAssetsNodeExtension(Node):
             return await self.transfer_manager.monitor_invoice(payment_hash)
 
     async def close(self):
-        """Close the gRPC channels."""
-        log_debug(NODE, "Closing gRPC channels")
-        await self.channel.close()
-        await self.ln_channel.close()
-        await self.tap_channel.close()
+        """
+        Release this node's gRPC channels.
+        
+        The channels are shared with every other node connected to the same
+        daemon, so they stay open here; close_shared_channels() closes them
+        all on shutdown.
+        """
+        log_debug(NODE, "Leaving shared gRPC channels open for other nodes")
+    
+    @classmethod
+    async def close_shared_channels(cls) -> None:
+        """Close all shared gRPC channels, so nodes created afterwards open new ones."""
+        channels, cls._shared_channels = list(cls._shared_channels.values()), {}
+        log_debug(NODE, f"Closing {len(channels)} shared gRPC channels")
+        for channel in channels:
+            await channel.close()
         log_debug(NODE, "gRPC channels closed")
@@ -50,7 +50,8 @@ class TaprootPaymentManager:
         payment_request: str,
         fee_limit_sats: Optional[int] = None,
         asset_id: Optional[str] = None,
-        peer_pubkey: Optional[str] = None
+        peer_pubkey: Optional[str] = None,
+        payment_hash: Optional[str] = None
     ) -> Dict[str, Any]:
         """
         Pay a Taproot Asset invoice.
@@ -60,6 +61,7 @@ class TaprootPaymentManager:
             fee_limit_sats: Optional fee limit in satoshis
             asset_id: Optional asset ID to use for payment
             peer_pubkey: Optional peer public key to specify which channel to use
+            payment_hash: Optional payment hash, if the caller already decoded the invoice
 
         Returns:
             Dict with payment details
@@ -78,14 +80,15 @@ class TaprootPaymentManager:
                 fee_limit_sats = max(fee_limit_sats or 10, 1)
                 log_info(PAYMENT, f"Using fee_limit_sats={fee_limit_sats} for payment")
 
-                # Decode invoice to get payment hash
-                try:
-                    decoded = bolt11.decode(payment_request)
-                    payment_hash = decoded.payment_hash
-                    log_info(PAYMENT, f"Payment hash: {payment_hash}")
-                except Exception as e:
-                    log_error(PAYMENT, f"Failed to decode invoice: {str(e)}")
-                    raise Exception(f"Invalid invoice format: {str(e)}")
+                # Decode invoice to get payment hash, unless the caller already did
+                if not payment_hash:
+                    try:
+                        decoded = bolt11.decode(payment_request)
+                        payment_hash = decoded.payment_hash
+                    except Exception as e:
+                        log_error(PAYMENT, f"Failed to decode invoice: {str(e)}")
+                        raise Exception(f"Invalid invoice format: {str(e)}")
+                log_info(PAYMENT, f"Payment hash: {payment_hash}")
 
                 # If asset_id is not available, try to get it from available assets
                 if not asset_id:
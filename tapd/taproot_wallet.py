@@ -204,7 +204,8 @@ class TaprootWalletExtension(Wallet):
         payment_request: str,
         fee_limit_sats: Optional[int] = None,
         asset_id: Optional[str] = None,
-        peer_pubkey: Optional[str] = None
+        peer_pubkey: Optional[str] = None,
+        payment_hash: Optional[str] = None
     ) -> Dict[str, Any]:
         """
         Low-level method to send a payment to a Taproot Asset invoice.
@@ -215,6 +216,7 @@ class TaprootWalletExtension(Wallet):
             fee_limit_sats: Optional fee limit in satoshis
             asset_id: Optional ID of the Taproot Asset to use for payment
             peer_pubkey: Optional peer public key to specify which channel to use
+            payment_hash: Optional payment hash, so an already decoded invoice isn't decoded again
             
         Returns:
             Dict[str, Any]: Raw payment result from the node
@@ -229,7 +231,8 @@ class TaprootWalletExtension(Wallet):
                 payment_request=payment_request,
                 fee_limit_sats=fee_limit_sats,
                 asset_id=asset_id,
-                peer_pubkey=peer_pubkey
+                peer_pubkey=peer_pubkey,
+                payment_hash=payment_hash
             )
             
             # Store the asset_id in the node's cache if present
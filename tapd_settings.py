@@ -3,8 +3,9 @@ from typing import Dict, Any, Optional
 from loguru import logger
 from pathlib import Path
 
-# Default cache expiry times
-ASSET_CACHE_EXPIRY_SECONDS = 300  # 5 minutes
+# Default cache expiry times. Asset lists are invalidated by node events, so
+# the expiry is only a safety net against missed events.
+ASSET_CACHE_EXPIRY_SECONDS = 3600  # 1 hour
 
 class TaprootSettings:
     """
@@ -40,6 +41,14 @@ class TaprootSettings:
         default_fee = config_values.get("TAPD_DEFAULT_SAT_FEE") or os.environ.get("TAPD_DEFAULT_SAT_FEE", "1")
         self.default_sat_fee = int(default_fee)
         
+        # Database transaction retry settings
+        db_max_retries = config_values.get("DB_MAX_RETRIES") or os.environ.get("DB_MAX_RETRIES", "3")
+        self.db_max_retries = int(db_max_retries)
+        db_base_delay = config_values.get("DB_RETRY_BASE_DELAY_MS") or os.environ.get("DB_RETRY_BASE_DELAY_MS", "50")
+        self.db_retry_base_delay_ms = int(db_base_delay)
+        db_max_delay = config_values.get("DB_RETRY_MAX_DELAY_MS") or os.environ.get("DB_RETRY_MAX_DELAY_MS", "1000")
+        self.db_retry_max_delay_ms = int(db_max_delay)
+        
         # Only log config details if we have standalone configuration
         if self.has_standalone_config:
             logger.info("Taproot Assets settings loaded for standalone tapd mode")
@@ -89,7 +98,10 @@ class TaprootSettings:
             "tapd_macaroon_hex": self.tapd_macaroon_hex,
             "lnd_macaroon_path": self.lnd_macaroon_path,
             "lnd_macaroon_hex": self.lnd_macaroon_hex,
-            "default_sat_fee": self.default_sat_fee
+            "default_sat_fee": self.default_sat_fee,
+            "db_max_retries": self.db_max_retries,
+            "db_retry_base_delay_ms": self.db_retry_base_delay_ms,
+            "db_retry_max_delay_ms": self.db_retry_max_delay_ms
         }
 
 # Create a singleton instance
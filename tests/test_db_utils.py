@@ -0,0 +1,195 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+import pytest
+
+from .. import db_utils
+from ..db_utils import AsyncKeyedLock, BackoffPolicy, with_transaction
+
+
+async def _hold(locks: AsyncKeyedLock, key: str, order: list, name: str):
+    async with locks(key):
+        order.append(f"{name} start")
+        await asyncio.sleep(0)
+        order.append(f"{name} end")
+
+
+@pytest.mark.asyncio
+async def test_keyed_lock_serializes_same_key():
+    locks = AsyncKeyedLock()
+    order: list = []
+
+    await asyncio.gather(
+        _hold(locks, "hash", order, "a"),
+        _hold(locks, "hash", order, "b"),
+    )
+
+    assert order == ["a start", "a end", "b start", "b end"]
+
+
+@pytest.mark.asyncio
+async def test_keyed_lock_runs_different_keys_concurrently():
+    locks = AsyncKeyedLock()
+    other_key_held = asyncio.Event()
+
+    async def first():
+        async with locks("a"):
+            await other_key_held.wait()
+
+    async def second():
+        async with locks("b"):
+            other_key_held.set()
+
+    await asyncio.wait_for(asyncio.gather(first(), second()), timeout=1)
+
+
+@pytest.mark.asyncio
+async def test_keyed_lock_is_kept_while_tasks_wait_for_it():
+    locks = AsyncKeyedLock()
+    order: list = []
+
+    async with locks("hash"):
+        waiter = asyncio.create_task(_hold(locks, "hash", order, "waiter"))
+        await asyncio.sleep(0)
+        assert locks._refcounts["hash"] == 2
+
+    # The waiter still needs the lock, a new task must queue behind it
+    late = asyncio.create_task(_hold(locks, "hash", order, "late"))
+    await asyncio.gather(waiter, late)
+
+    assert order == ["waiter start", "waiter end", "late start", "late end"]
+    assert not locks._locks
+    assert not locks._refcounts
+    assert len(locks._pool) == 1
+
+
+@pytest.mark.asyncio
+async def test_keyed_lock_releases_cancelled_waiters():
+    locks = AsyncKeyedLock()
+
+    async with locks("hash"):
+        waiter = asyncio.create_task(_hold(locks, "hash", [], "waiter"))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert locks._refcounts["hash"] == 1
+
+    assert not locks._locks
+    assert not locks._refcounts
+
+
+class FakeDatabase:
+    """Stand-in for the extension database, handing out a new connection per transaction."""
+
+    def __init__(self):
+        self.connections: list = []
+
+    @asynccontextmanager
+    async def connect(self):
+        conn = object()
+        self.connections.append(conn)
+        yield conn
+
+
+@pytest.fixture
+def database(monkeypatch):
+    fake = FakeDatabase()
+    monkeypatch.setattr(db_utils, "db", fake)
+    monkeypatch.setattr(db_utils, "_backoff_delay", lambda *args: 0)
+    monkeypatch.setattr(db_utils, "_jittered", lambda delay_ms: 0)
+    monkeypatch.setattr(BackoffPolicy, "_ceilings", {})
+    return fake
+
+
+@pytest.mark.asyncio
+async def test_with_transaction_reruns_the_function_on_contention(database):
+    connections: list = []
+
+    @with_transaction
+    async def write(conn=None):
+        connections.append(conn)
+        if len(connections) < 3:
+            raise Exception("database is locked")
+        return "written"
+
+    assert await write() == "written"
+    # Every attempt runs from the start in a transaction of its own
+    assert connections == database.connections
+    assert len(set(map(id, connections))) == 3
+
+
+@pytest.mark.asyncio
+async def test_with_transaction_gives_up_after_max_retries(database):
+    attempts: list = []
+
+    @with_transaction
+    async def write(conn=None):
+        attempts.append(conn)
+        raise Exception("could not serialize access due to concurrent update")
+
+    with pytest.raises(Exception, match="could not serialize access"):
+        await write()
+    assert len(attempts) == db_utils._MAX_RETRIES + 1
+
+
+@pytest.mark.asyncio
+async def test_with_transaction_does_not_retry_other_errors(database):
+    attempts: list = []
+
+    @with_transaction
+    async def write(conn=None):
+        attempts.append(conn)
+        raise ValueError("bad amount")
+
+    with pytest.raises(ValueError):
+        await write()
+    assert len(attempts) == 1
+
+
+@pytest.mark.asyncio
+async def test_with_transaction_leaves_retries_to_the_callers_transaction(database):
+    attempts: list = []
+    conn = object()
+
+    @with_transaction
+    async def write(conn=None):
+        attempts.append(conn)
+        raise Exception("database is locked")
+
+    with pytest.raises(Exception, match="database is locked"):
+        await write(conn=conn)
+    assert attempts == [conn]
+    assert not database.connections
+
+
+@pytest.mark.asyncio
+async def test_tagged_transaction_adapts_its_backoff(database):
+    attempts: list = []
+
+    @with_transaction(operation="record_payment")
+    async def write(conn=None):
+        attempts.append(conn)
+        if len(attempts) == 1:
+            raise Exception("database is locked")
+        return "written"
+
+    assert await write() == "written"
+    grown = db_utils._RETRY_BASE_DELAY_MS * (1 + BackoffPolicy.ABORT_ALPHA[0])
+    assert BackoffPolicy._ceilings == {("record_payment", 0): grown}
+
+    # A commit without contention shrinks the ceiling again
+    assert await write() == "written"
+    assert BackoffPolicy._ceilings == {("record_payment", 0): grown / (1 + BackoffPolicy.COMMIT_ALPHA)}
+
+
+def test_backoff_ceiling_stays_within_bounds(monkeypatch):
+    monkeypatch.setattr(BackoffPolicy, "_ceilings", {})
+
+    for _ in range(20):
+        BackoffPolicy.on_abort("record_transaction", 2, 50, 1000)
+    assert BackoffPolicy._ceilings[("record_transaction", 2)] == 1000
+
+    for _ in range(50):
+        BackoffPolicy.on_commit("record_transaction", 2, 50, 1000)
+    assert BackoffPolicy._ceilings[("record_transaction", 2)] == 50
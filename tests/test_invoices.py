@@ -0,0 +1,56 @@
+import asyncio
+
+import pytest
+
+from ..crud import invoices
+
+
+@pytest.fixture
+def queries(monkeypatch) -> list:
+    """Replace the batch query with a stub and return the payment hashes of each query."""
+    batches: list = []
+
+    async def get_invoices_by_payment_hashes(payment_hashes):
+        batches.append(sorted(payment_hashes))
+        return {payment_hash: f"invoice {payment_hash}" for payment_hash in payment_hashes if payment_hash != "missing"}
+
+    monkeypatch.setattr(invoices, "get_invoices_by_payment_hashes", get_invoices_by_payment_hashes)
+    return batches
+
+
+@pytest.mark.asyncio
+async def test_concurrent_lookups_share_one_query(queries):
+    loader = invoices._InvoiceLoader()
+
+    results = await asyncio.gather(
+        loader.load("a"),
+        loader.load("b"),
+        loader.load("a"),
+        loader.load("missing"),
+    )
+
+    assert results == ["invoice a", "invoice b", "invoice a", None]
+    assert queries == [["a", "b", "missing"]]
+
+
+@pytest.mark.asyncio
+async def test_sequential_lookups_query_separately(queries):
+    loader = invoices._InvoiceLoader()
+
+    assert await loader.load("a") == "invoice a"
+    assert await loader.load("b") == "invoice b"
+
+    assert queries == [["a"], ["b"]]
+
+
+@pytest.mark.asyncio
+async def test_failed_query_fails_every_lookup_of_the_batch(monkeypatch):
+    async def get_invoices_by_payment_hashes(payment_hashes):
+        raise RuntimeError("database unavailable")
+
+    monkeypatch.setattr(invoices, "get_invoices_by_payment_hashes", get_invoices_by_payment_hashes)
+    loader = invoices._InvoiceLoader()
+
+    results = await asyncio.gather(loader.load("a"), loader.load("b"), return_exceptions=True)
+
+    assert all(isinstance(result, RuntimeError) for result in results)
@@ -0,0 +1,130 @@
+import asyncio
+import time
+
+import pytest
+
+from ..services.rate_service import RateService
+
+QUOTE = {
+    "asset_id": "aa",
+    "amount": 100,
+    "rate_per_unit": 2.0,
+    "total_sats": 200,
+    "quote_id": "ff",
+}
+
+
+@pytest.fixture(autouse=True)
+def clear_rates():
+    RateService._rate_cache.clear()
+    RateService._inflight.clear()
+    yield
+    RateService._rate_cache.clear()
+    RateService._inflight.clear()
+
+
+def _stub_rfq(monkeypatch, result=QUOTE, delay=0.01) -> list:
+    """Replace the RFQ with a slow stub and return the amounts it was asked for."""
+    requested: list = []
+
+    async def request_rate(wallet, asset_id, amount, timeout):
+        requested.append(amount)
+        await asyncio.sleep(delay)
+        if isinstance(result, BaseException):
+            raise result
+        return dict(result)
+
+    monkeypatch.setattr(RateService, "_request_rate", staticmethod(request_rate))
+    return requested
+
+
+@pytest.mark.asyncio
+async def test_concurrent_requests_share_one_rfq(monkeypatch):
+    requested = _stub_rfq(monkeypatch)
+
+    results = await asyncio.gather(
+        *(RateService.get_current_rate(None, "aa", 100) for _ in range(5))
+    )
+
+    assert requested == [100]
+    assert all(result["rate_per_unit"] == 2.0 for result in results)
+    assert not RateService._inflight
+
+
+@pytest.mark.asyncio
+async def test_accepted_quote_is_cached(monkeypatch):
+    requested = _stub_rfq(monkeypatch)
+
+    await RateService.get_current_rate(None, "aa", 100)
+    result = await RateService.get_current_rate(None, "aa", 100)
+
+    assert requested == [100]
+    assert result["rate_per_unit"] == 2.0
+
+
+@pytest.mark.asyncio
+async def test_cancelled_caller_does_not_fail_the_others(monkeypatch):
+    requested = _stub_rfq(monkeypatch)
+
+    first = asyncio.create_task(RateService.get_current_rate(None, "aa", 100))
+    second = asyncio.create_task(RateService.get_current_rate(None, "aa", 100))
+    await asyncio.sleep(0)
+    first.cancel()
+
+    result = await second
+
+    with pytest.raises(asyncio.CancelledError):
+        await first
+    assert requested == [100]
+    assert result["rate_per_unit"] == 2.0
+
+
+@pytest.mark.asyncio
+async def test_failed_quote_is_not_cached(monkeypatch):
+    requested = _stub_rfq(monkeypatch, {"error": "No RFQ quote received", "rate_per_unit": None})
+
+    first = await RateService.get_current_rate(None, "aa", 100)
+    second = await RateService.get_current_rate(None, "aa", 100)
+
+    assert requested == [100, 100]
+    assert first["rate_per_unit"] is None
+    assert second["rate_per_unit"] is None
+
+
+@pytest.mark.asyncio
+async def test_quote_id_is_only_shared_for_the_quoted_amount(monkeypatch):
+    requested = _stub_rfq(monkeypatch)
+
+    quoted = await RateService.get_current_rate(None, "aa", 100)
+    nearby = await RateService.get_current_rate(None, "aa", 120)
+
+    assert requested == [100]
+    assert quoted["quote_id"] == "ff"
+    assert "quote_id" not in nearby
+    assert nearby["amount"] == 120
+    assert nearby["total_sats"] == 240
+
+
+@pytest.mark.asyncio
+async def test_timed_out_rfq_is_cached_briefly(monkeypatch):
+    requested = _stub_rfq(monkeypatch, asyncio.TimeoutError())
+
+    first = await RateService.get_current_rate(None, "aa", 100)
+    retried = await RateService.get_current_rate(None, "aa", 100)
+
+    assert requested == [100]
+    assert first["rate_per_unit"] is None
+    assert retried == first
+    _, expires_at = RateService._rate_cache["aa:64"]
+    assert expires_at - time.monotonic() <= RateService.RATE_TIMEOUT_CACHE_EXPIRY
+
+
+@pytest.mark.asyncio
+async def test_rfq_is_asked_again_once_the_timeout_expires(monkeypatch):
+    monkeypatch.setattr(RateService, "RATE_TIMEOUT_CACHE_EXPIRY", 0)
+    requested = _stub_rfq(monkeypatch, asyncio.TimeoutError())
+
+    await RateService.get_current_rate(None, "aa", 100)
+    await RateService.get_current_rate(None, "aa", 100)
+
+    assert requested == [100, 100]
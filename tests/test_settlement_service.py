@@ -0,0 +1,79 @@
+import asyncio
+import secrets
+
+import pytest
+
+from ..services.settlement_service import SettlementService
+
+
+@pytest.fixture
+def settlements(monkeypatch) -> list:
+    """Replace the settlement itself with a slow stub and return the payment hashes it settled."""
+    settled: list = []
+
+    async def process(**kwargs):
+        settled.append(kwargs["payment_hash"])
+        await asyncio.sleep(0.01)
+        return True, {"payment_hash": kwargs["payment_hash"], "asset_amount": kwargs["asset_amount"]}
+
+    monkeypatch.setattr(SettlementService, "_process_payment_settlement", staticmethod(process))
+    return settled
+
+
+def _settle(payment_hash: str, user_id: str = "user"):
+    return SettlementService.process_payment_settlement(
+        payment_hash=payment_hash,
+        payment_request="lnbc1",
+        asset_id="aa",
+        asset_amount=100,
+        fee_sats=0,
+        user_id=user_id,
+        wallet_id="wallet",
+    )
+
+
+@pytest.mark.asyncio
+async def test_concurrent_duplicates_settle_once(settlements):
+    payment_hash = secrets.token_hex(32)
+
+    results = await asyncio.gather(*(_settle(payment_hash) for _ in range(3)))
+
+    assert settlements == [payment_hash]
+    assert results == [(True, {"payment_hash": payment_hash, "asset_amount": 100})] * 3
+
+
+@pytest.mark.asyncio
+async def test_retried_settlement_replays_the_result(settlements):
+    payment_hash = secrets.token_hex(32)
+
+    first = await _settle(payment_hash)
+    retried = await _settle(payment_hash)
+
+    assert settlements == [payment_hash]
+    assert retried == first
+
+
+@pytest.mark.asyncio
+async def test_results_are_not_replayed_to_other_users(settlements):
+    payment_hash = secrets.token_hex(32)
+
+    await _settle(payment_hash, user_id="alice")
+    await _settle(payment_hash, user_id="bob")
+
+    assert settlements == [payment_hash, payment_hash]
+
+
+@pytest.mark.asyncio
+async def test_failed_settlement_is_not_replayed(monkeypatch):
+    payment_hash = secrets.token_hex(32)
+    attempts: list = []
+
+    async def process(**kwargs):
+        attempts.append(kwargs["payment_hash"])
+        return False, {"error": "Insufficient balance"}
+
+    monkeypatch.setattr(SettlementService, "_process_payment_settlement", staticmethod(process))
+
+    assert await _settle(payment_hash) == (False, {"error": "Insufficient balance"})
+    assert await _settle(payment_hash) == (False, {"error": "Insufficient balance"})
+    assert attempts == [payment_hash, payment_hash]
@@ -0,0 +1,71 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from ..tapd.taproot_assets import TaprootAssetManager
+
+KEY = "taproot:test:list"
+
+
+@pytest.fixture
+def manager():
+    TaprootAssetManager._inflight.clear()
+    # A node without a host doesn't start the event watcher
+    yield TaprootAssetManager(SimpleNamespace())
+    TaprootAssetManager._inflight.clear()
+
+
+def _counting_fetch(result=None, error=None):
+    """Build a slow fetch and return it with the list of its calls."""
+    calls: list = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        if error is not None:
+            raise error
+        return result
+
+    return fetch, calls
+
+
+@pytest.mark.asyncio
+async def test_single_flight_shares_one_fetch(manager):
+    fetch, calls = _counting_fetch([{"asset_id": "aa"}])
+
+    results = await asyncio.gather(*(manager._single_flight(KEY, fetch) for _ in range(5)))
+
+    assert len(calls) == 1
+    assert results == [[{"asset_id": "aa"}]] * 5
+    assert KEY not in TaprootAssetManager._inflight
+
+
+@pytest.mark.asyncio
+async def test_single_flight_survives_cancelled_first_caller(manager):
+    fetch, calls = _counting_fetch([{"asset_id": "aa"}])
+
+    first = asyncio.create_task(manager._single_flight(KEY, fetch))
+    second = asyncio.create_task(manager._single_flight(KEY, fetch))
+    await asyncio.sleep(0)
+    first.cancel()
+
+    assert await second == [{"asset_id": "aa"}]
+    with pytest.raises(asyncio.CancelledError):
+        await first
+    assert len(calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_single_flight_fails_all_callers_and_forgets_the_refresh(manager):
+    fetch, calls = _counting_fetch(error=RuntimeError("tapd unavailable"))
+
+    results = await asyncio.gather(
+        manager._single_flight(KEY, fetch),
+        manager._single_flight(KEY, fetch),
+        return_exceptions=True,
+    )
+
+    assert len(calls) == 1
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert KEY not in TaprootAssetManager._inflight
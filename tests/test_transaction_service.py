@@ -0,0 +1,242 @@
+import sqlite3
+from datetime import datetime
+
+import pytest
+
+from ..crud.payments import get_user_payments_paginated
+from ..db import db
+from ..models import TaprootPayment
+from ..services import transaction_service
+from ..services.transaction_service import TransactionService
+
+SCHEMA = """
+CREATE TABLE payments (
+    id TEXT PRIMARY KEY,
+    payment_hash TEXT NOT NULL,
+    payment_request TEXT NOT NULL,
+    asset_id TEXT NOT NULL,
+    asset_amount INTEGER NOT NULL,
+    fee_sats INTEGER NOT NULL DEFAULT 0,
+    description TEXT,
+    status TEXT NOT NULL DEFAULT 'completed',
+    user_id TEXT NOT NULL,
+    wallet_id TEXT NOT NULL,
+    created_at TIMESTAMP NOT NULL,
+    preimage TEXT
+);
+CREATE TABLE asset_balances (
+    id TEXT PRIMARY KEY,
+    wallet_id TEXT NOT NULL,
+    asset_id TEXT NOT NULL,
+    balance INTEGER NOT NULL DEFAULT 0,
+    last_payment_hash TEXT,
+    created_at TIMESTAMP NOT NULL,
+    updated_at TIMESTAMP NOT NULL,
+    UNIQUE(wallet_id, asset_id)
+);
+CREATE TABLE asset_transactions (
+    id TEXT PRIMARY KEY,
+    wallet_id TEXT NOT NULL,
+    asset_id TEXT NOT NULL,
+    payment_hash TEXT,
+    amount INTEGER NOT NULL,
+    fee INTEGER DEFAULT 0,
+    description TEXT,
+    type TEXT NOT NULL,
+    created_at TIMESTAMP NOT NULL
+);
+"""
+
+
+def _bind(params):
+    return {
+        key: value.isoformat() if isinstance(value, datetime) else value
+        for key, value in (params or {}).items()
+    }
+
+
+class SqliteConnection:
+    """Stand-in for an LNbits connection, running the statements on an in-memory SQLite database."""
+
+    def __init__(self):
+        self.db = sqlite3.connect(":memory:")
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(SCHEMA)
+        self.statements: list = []
+
+    async def execute(self, query, params=None):
+        self.statements.append(query)
+        self.db.execute(query, _bind(params))
+
+    async def insert(self, table, model):
+        values = model.dict()
+        columns = ", ".join(values)
+        placeholders = ", ".join(f":{column}" for column in values)
+        await self.execute(f"INSERT INTO {table} ({columns}) VALUES ({placeholders})", values)
+
+    async def fetchone(self, query, params=None, model=None):
+        row = self.db.execute(query, _bind(params)).fetchone()
+        if row is None:
+            return None
+        return model(**dict(row)) if model else dict(row)
+
+    async def fetchall(self, query, params=None, model=None):
+        rows = self.db.execute(query, _bind(params)).fetchall()
+        return [model(**dict(row)) if model else dict(row) for row in rows]
+
+    def rows(self, query):
+        return [dict(row) for row in self.db.execute(query).fetchall()]
+
+
+class RecordingConnection:
+    """Stand-in for an LNbits connection that only records the statements it gets."""
+
+    def __init__(self):
+        self.statements: list = []
+
+    async def execute(self, query, params=None):
+        self.statements.append(query)
+
+    async def insert(self, table, model):
+        self.statements.append(f"INSERT INTO {table}")
+
+    async def fetchone(self, query, params=None, model=None):
+        self.statements.append(query)
+        return None
+
+
+def _payment(payment_hash="ab" * 32, amount=30):
+    return TaprootPayment(
+        id=f"payment-{payment_hash[:8]}",
+        payment_hash=payment_hash,
+        payment_request="lnbc1",
+        asset_id="aa",
+        asset_amount=amount,
+        fee_sats=1,
+        user_id="user",
+        wallet_id="wallet",
+        created_at=datetime.now(),
+    )
+
+
+@pytest.fixture
+def sqlite(monkeypatch):
+    monkeypatch.setattr(db, "type", "SQLITE")
+    return SqliteConnection()
+
+
+@pytest.fixture
+def postgres(monkeypatch):
+    monkeypatch.setattr(db, "type", "POSTGRES")
+    return RecordingConnection()
+
+
+@pytest.mark.asyncio
+async def test_record_payment_with_debit_on_sqlite(sqlite):
+    sqlite.db.execute(
+        "INSERT INTO asset_balances VALUES ('b1', 'wallet', 'aa', 100, NULL, '2024-01-01', '2024-01-01')"
+    )
+
+    await TransactionService.record_payment_with_debit(_payment(amount=30), conn=sqlite)
+
+    assert len(sqlite.statements) == 3
+    assert [row["payment_hash"] for row in sqlite.rows("SELECT * FROM payments")] == ["ab" * 32]
+    transactions = sqlite.rows("SELECT * FROM asset_transactions")
+    assert [(tx["amount"], tx["type"]) for tx in transactions] == [(30, "debit")]
+    balances = sqlite.rows("SELECT * FROM asset_balances")
+    assert [(b["balance"], b["last_payment_hash"]) for b in balances] == [(70, "ab" * 32)]
+
+
+@pytest.mark.asyncio
+async def test_record_payment_with_debit_creates_missing_balance(sqlite):
+    await TransactionService.record_payment_with_debit(_payment(amount=30), conn=sqlite)
+
+    balances = sqlite.rows("SELECT * FROM asset_balances")
+    assert [(b["wallet_id"], b["asset_id"], b["balance"]) for b in balances] == [("wallet", "aa", -30)]
+
+
+@pytest.mark.asyncio
+async def test_record_payment_with_debit_on_postgres_is_one_statement(postgres):
+    await TransactionService.record_payment_with_debit(_payment(), conn=postgres)
+
+    assert len(postgres.statements) == 1
+    statement = " ".join(postgres.statements[0].split())
+    assert statement.startswith("WITH p AS ( INSERT INTO ")
+    assert "payments" in statement
+    assert "asset_transactions" in statement
+    assert "ON CONFLICT (wallet_id, asset_id) DO UPDATE" in statement
+
+
+@pytest.mark.asyncio
+async def test_record_payment_with_debit_failure_propagates(sqlite):
+    payment = _payment()
+    await TransactionService.record_payment_with_debit(payment, conn=sqlite)
+
+    # The payment ID is taken, so the caller's transaction must roll back
+    with pytest.raises(sqlite3.IntegrityError):
+        await TransactionService.record_payment_with_debit(payment, conn=sqlite)
+
+
+@pytest.mark.asyncio
+async def test_record_transaction_adjusts_the_balance_in_place(sqlite):
+    await TransactionService.record_transaction("wallet", "aa", 100, "credit", payment_hash="h1", conn=sqlite)
+    await TransactionService.record_transaction("wallet", "aa", 30, "debit", conn=sqlite)
+    success, tx, balance = await TransactionService.record_transaction(
+        "wallet", "aa", 5, "credit", create_tx_record=False, conn=sqlite
+    )
+
+    assert success
+    assert tx is None
+    assert balance.balance == 75
+    # Updates without a payment hash keep the last one
+    assert balance.last_payment_hash == "h1"
+    assert len(sqlite.rows("SELECT * FROM asset_balances")) == 1
+    assert len(sqlite.rows("SELECT * FROM asset_transactions")) == 2
+    assert not any(statement.lstrip().startswith("UPDATE") for statement in sqlite.statements)
+
+
+@pytest.mark.asyncio
+async def test_record_transaction_on_postgres_returns_the_upserted_balance(postgres):
+    await TransactionService.record_transaction("wallet", "aa", 100, "credit", conn=postgres)
+
+    assert "asset_transactions" in postgres.statements[0]
+    upsert = " ".join(postgres.statements[1].split())
+    assert "ON CONFLICT (wallet_id, asset_id) DO UPDATE" in upsert
+    assert upsert.endswith("RETURNING *")
+    assert len(postgres.statements) == 2
+
+
+@pytest.mark.asyncio
+async def test_asset_transactions_cursor_is_scoped_to_the_wallet(sqlite, monkeypatch):
+    monkeypatch.setattr(transaction_service, "db", sqlite)
+    sqlite.db.executescript(
+        "INSERT INTO asset_transactions VALUES ('t1', 'wallet', 'aa', NULL, 10, 0, NULL, 'credit', '2024-01-01T00:00:00');"
+        "INSERT INTO asset_transactions VALUES ('t2', 'wallet', 'aa', NULL, 20, 0, NULL, 'credit', '2024-01-02T00:00:00');"
+        "INSERT INTO asset_transactions VALUES ('o1', 'other', 'aa', NULL, 30, 0, NULL, 'credit', '2024-01-03T00:00:00');"
+    )
+
+    first, cursor = await TransactionService.get_asset_transactions("wallet", limit=1)
+    second, _ = await TransactionService.get_asset_transactions("wallet", limit=1, cursor=cursor)
+    last, last_cursor = await TransactionService.get_asset_transactions("wallet", limit=1, cursor="t1")
+
+    assert [tx.id for tx in first] == ["t2"]
+    assert [tx.id for tx in second] == ["t1"]
+    assert last == [] and last_cursor is None
+    with pytest.raises(ValueError, match="Unknown cursor"):
+        await TransactionService.get_asset_transactions("wallet", limit=1, cursor="o1")
+
+
+@pytest.mark.asyncio
+async def test_payments_cursor_is_scoped_to_the_user(sqlite):
+    await TransactionService.record_payment_with_debit(_payment("ab" * 32), conn=sqlite)
+    other = _payment("cd" * 32)
+    other.user_id = "other"
+    await TransactionService.record_payment_with_debit(other, conn=sqlite)
+
+    payments, next_cursor = await get_user_payments_paginated("user", limit=1, conn=sqlite)
+    rest, _ = await get_user_payments_paginated("user", limit=1, cursor=next_cursor, conn=sqlite)
+
+    assert [payment.payment_hash for payment in payments] == ["ab" * 32]
+    assert rest == []
+    with pytest.raises(ValueError, match="Unknown cursor"):
+        await get_user_payments_paginated("user", cursor=other.id, conn=sqlite)
@@ -1,8 +1,7 @@
 from http import HTTPStatus
 from typing import Optional
-from datetime import datetime, timedelta, timezone
 
-from fastapi import APIRouter, Depends, Query
+from fastapi import APIRouter, Depends, Query, Response
 from lnbits.core.models import User, WalletTypeInfo
 from lnbits.decorators import check_user_exists, require_admin_key
 from pydantic import BaseModel
@@ -16,6 +15,7 @@ from .services.asset_service import AssetService
 from .services.invoice_service import InvoiceService
 from .services.payment_service import PaymentService
 from .services.lnurl_service import LnurlService
+from .services.rate_service import RateService
 
 # The parent router in __init__.py already adds the "/taproot_assets" prefix
 # So we only need to add the API path here
@@ -201,11 +201,22 @@ async def api_pay_invoice(
 @taproot_assets_api_router.get("/payments", status_code=HTTPStatus.OK)
 @handle_api_error
 async def api_list_payments(
+    response: Response,
+    limit: int = Query(100, ge=1, le=1000, description="Maximum number of payments to return"),
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor header of the previous page"),
     wallet: WalletTypeInfo = Depends(require_admin_key),
 ):
-    """List all Taproot Asset payments for the current user."""
+    """
+    List Taproot Asset payments for the current user, newest first.
+    
+    The body is a plain list of payments. When more payments follow, the cursor of
+    the next page is returned in the X-Next-Cursor header.
+    """
     log_debug(API, f"Listing payments for user {wallet.wallet.user}")
-    return await PaymentService.get_user_payments(wallet.wallet.user)
+    payments, next_cursor = await PaymentService.get_user_payments(wallet.wallet.user, limit, cursor)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return payments
 
 
 @taproot_assets_api_router.get("/invoices", status_code=HTTPStatus.OK)
@@ -265,13 +276,23 @@ async def api_get_asset_balance(
 @taproot_assets_api_router.get("/asset-transactions", status_code=HTTPStatus.OK)
 @handle_api_error
 async def api_get_asset_transactions(
+    response: Response,
     wallet: WalletTypeInfo = Depends(require_admin_key),
     asset_id: Optional[str] = None,
     limit: int = 100,
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor header of the previous page"),
 ):
-    """Get asset transactions for the current wallet."""
+    """
+    Get asset transactions for the current wallet, newest first.
+    
+    When more transactions follow, the cursor of the next page is returned
+    in the X-Next-Cursor header.
+    """
     log_debug(API, f"Getting asset transactions for wallet {wallet.wallet.id}, asset_id={asset_id or 'all'}, limit={limit}")
-    return await AssetService.get_asset_transactions(wallet, asset_id, limit)
+    transactions, next_cursor = await AssetService.get_asset_transactions(wallet, asset_id, limit, cursor)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return transactions
 
 
 @taproot_assets_api_router.post("/lnurl/info", status_code=HTTPStatus.OK)
@@ -301,65 +322,7 @@ async def api_get_asset_rate(
     log_info(API, f"Getting rate for asset {asset_id}, amount={amount}")
     
     try:
-        # Import required modules
-        from .tapd.taproot_factory import TaprootAssetsFactory
-        from ...wallets.tapd_grpc_files.rfqrpc import rfq_pb2, rfq_pb2_grpc
-        
-        # Create wallet instance
-        taproot_wallet = await TaprootAssetsFactory.create_wallet(
-            user_id=wallet.wallet.user,
-            wallet_id=wallet.wallet.id
-        )
-        
-        # Get RFQ stub
-        rfq_stub = rfq_pb2_grpc.RfqStub(taproot_wallet.node.channel)
-        
-        # Find peer with asset channel
-        assets = await AssetService.list_assets(wallet)
-        peer_pubkey = None
-        
-        for asset in assets:
-            if asset.get("asset_id") == asset_id and asset.get("channel_info") and asset["channel_info"].get("peer_pubkey"):
-                peer_pubkey = asset["channel_info"]["peer_pubkey"]
-                break
-        
-        if not peer_pubkey:
-            return {
-                "error": "No peer found with channel for this asset",
-                "rate_per_unit": None
-            }
-        
-        # Create buy order request
-        buy_order_request = rfq_pb2.AddAssetBuyOrderRequest(
-            asset_specifier=rfq_pb2.AssetSpecifier(asset_id=bytes.fromhex(asset_id)),
-            asset_max_amt=amount,
-            expiry=int((datetime.now(timezone.utc) + timedelta(minutes=1)).timestamp()),
-            timeout_seconds=5,
-            peer_pub_key=bytes.fromhex(peer_pubkey)
-        )
-        
-        # Get quote
-        buy_order_response = await rfq_stub.AddAssetBuyOrder(buy_order_request, timeout=5)
-        
-        if buy_order_response.accepted_quote:
-            # Extract rate
-            rate_info = buy_order_response.accepted_quote.ask_asset_rate
-            total_millisats = float(rate_info.coefficient) / (10 ** rate_info.scale)
-            rate_per_unit = (total_millisats / amount) / 1000
-            
-            return {
-                "asset_id": asset_id,
-                "amount": amount,
-                "rate_per_unit": rate_per_unit,
-                "total_sats": int(amount * rate_per_unit),
-                "quote_id": buy_order_response.accepted_quote.id.hex()
-            }
-        else:
-            return {
-                "error": "No RFQ quote received",
-                "rate_per_unit": None
-            }
-            
+        return await RateService.get_current_rate(wallet, asset_id, amount)
     except Exception as e:
         log_error(API, f"Failed to get rate: {str(e)}")
         return {